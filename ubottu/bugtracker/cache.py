@@ -0,0 +1,181 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from launchpad.utils import cache as redis_cache
+from launchpad.singleflight import SingleFlight
+from launchpad.codec import codec
+from launchpad.errors import NotFoundError, PrivateError
+from launchpad.negative import NegativeCache
+from .trackers import BugNotFoundError, BugPrivateError
+
+# Statuses after which a bug rarely changes again, cached for longer
+CLOSED_STATUSES = {
+    'fix released', 'invalid', "won't fix", 'opinion', 'expired', 'closed', 'merged',
+}
+
+class BugCache:
+    """
+    Two tier cache for bug metadata: a small in-process LRU in front of Redis.
+
+    Entries are keyed by the normalized (tracker, bug id). Each one is fresh
+    for a time that depends on the bug's status and then stays usable for a
+    stale period, during which it is served as is while a background thread
+    fetches a new copy. Only misses past the stale period wait on the fetch.
+    Bugs that turn out not to exist or to be private are remembered for
+    not_found_timeout or private_timeout seconds, and looking them up again
+    raises NotFoundError or PrivateError without asking upstream.
+    """
+    def __init__(self, open_timeout=15 * 60, closed_timeout=24 * 3600, stale_timeout=3600,
+                 local_entries=512, local_timeout=60, refresh_workers=2, not_found_timeout=300, private_timeout=900):
+        self.open_timeout = open_timeout
+        self.closed_timeout = closed_timeout
+        self.stale_timeout = stale_timeout
+        self.local_entries = local_entries
+        self.local_timeout = local_timeout
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._executor = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix='bug-refresh')
+        # Concurrent misses for one bug, in any worker, share one upstream call
+        self.flight = SingleFlight('bugs', client=redis_cache, not_found=(NotFoundError, BugNotFoundError),
+                                   private=(PrivateError, BugPrivateError))
+        self.negative = NegativeCache(redis_cache, not_found_timeout, private_timeout,
+                                      not_found=(NotFoundError, BugNotFoundError),
+                                      private=(PrivateError, BugPrivateError))
+
+    def key(self, tracker, bug_id):
+        return f"bug_{tracker.lower()}_{str(bug_id).strip().lower().lstrip('#')}"
+
+    def timeout(self, data):
+        status = str(data.get('status') or data.get('state') or '').lower()
+        return self.closed_timeout if status in CLOSED_STATUSES else self.open_timeout
+
+    def get(self, tracker, bug_id, fetch):
+        """
+        Return the bug data for tracker/bug_id, calling fetch() to get it from
+        upstream when it is not cached. Exceptions from fetch() propagate,
+        only not found and private outcomes are remembered.
+        """
+        key = self.key(tracker, bug_id)
+        now = time.time()
+        entry = self._get_local(key, now) or self._get_redis(key)
+        if entry is not None:
+            if entry['fresh_until'] > now:
+                return entry['data']
+            if entry['fresh_until'] + self.stale_timeout > now:
+                self._refresh_later(key, fetch)
+                return entry['data']
+        return self._fetch(key, fetch)
+
+    def peek(self, tracker, bug_id, fetch=None):
+        """
+        Return the cached data for tracker/bug_id without waiting on
+        upstream, or None on a miss. A stale entry is still returned and,
+        given fetch, refreshed in the background. Remembered not found and
+        private outcomes raise like in get().
+        """
+        key = self.key(tracker, bug_id)
+        now = time.time()
+        entry = self._get_local(key, now) or self._get_redis(key)
+        if entry is None or entry['fresh_until'] + self.stale_timeout <= now:
+            return None
+        if entry['fresh_until'] <= now and fetch is not None:
+            self._refresh_later(key, fetch)
+        return entry['data']
+
+    def expires_in(self, tracker, bug_id):
+        """Seconds until the shared entry for tracker/bug_id stops being fresh, or None if there is none."""
+        entry = self._get_redis(self.key(tracker, bug_id))
+        return None if entry is None else entry['fresh_until'] - time.time()
+
+    def refresh(self, tracker, bug_id, fetch):
+        """Fetch and store tracker/bug_id now, whatever is cached."""
+        return self._fetch(self.key(tracker, bug_id), fetch)
+
+    def set(self, key, data):
+        now = time.time()
+        entry = {'data': data, 'fresh_until': now + self.timeout(data)}
+        self._set_local(key, entry, now)
+        try:
+            redis_cache.setex(key, int(self.timeout(data) + self.stale_timeout), codec.dumps(entry))
+        except Exception as e:
+            print(f"Could not write bug cache for {key}: {e}")
+        return entry
+
+    def delete(self, tracker, bug_id):
+        key = self.key(tracker, bug_id)
+        with self._lock:
+            self._local.pop(key, None)
+        try:
+            redis_cache.delete(key, self.negative.key(key))
+        except Exception as e:
+            print(f"Could not delete bug cache for {key}: {e}")
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
+
+    def _fetch(self, key, fetch):
+        return self.flight.run(key, lambda: self.set(key, self.negative.guard(key, fetch))['data'])
+
+    def _refresh_later(self, key, fetch):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        self._executor.submit(self._refresh, key, fetch)
+
+    def _refresh(self, key, fetch):
+        try:
+            self._fetch(key, fetch)
+        except Exception as e:
+            print(f"Could not refresh {key}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _get_local(self, key, now):
+        with self._lock:
+            item = self._local.get(key)
+            if item is None:
+                return None
+            if item[0] < now:
+                del self._local[key]
+                return None
+            self._local.move_to_end(key)
+            return item[1]
+
+    def _set_local(self, key, entry, now):
+        with self._lock:
+            # Short local lifetime so workers pick up refreshes made elsewhere
+            self._local[key] = (now + self.local_timeout, entry)
+            self._local.move_to_end(key)
+            while len(self._local) > self.local_entries:
+                self._local.popitem(last=False)
+
+    def _get_redis(self, key):
+        try:
+            # The negative entry comes along in the same round trip
+            cached_result, missing = redis_cache.get_many([key, self.negative.key(key)])
+        except Exception as e:
+            print(f"Could not read bug cache for {key}: {e}")
+            return None
+        if not cached_result:
+            self.negative.raise_cached(missing)
+            return None
+        entry = codec.loads(cached_result)
+        self._set_local(key, entry, time.time())
+        return entry
+
+
+bug_cache = BugCache(
+    open_timeout=getattr(settings, 'BUG_CACHE_OPEN_TIMEOUT', 15 * 60),
+    closed_timeout=getattr(settings, 'BUG_CACHE_CLOSED_TIMEOUT', 24 * 3600),
+    stale_timeout=getattr(settings, 'BUG_CACHE_STALE_TIMEOUT', 3600),
+    local_entries=getattr(settings, 'BUG_CACHE_LOCAL_ENTRIES', 512),
+    local_timeout=getattr(settings, 'BUG_CACHE_LOCAL_TIMEOUT', 60),
+    not_found_timeout=getattr(settings, 'NEGATIVE_CACHE_NOT_FOUND_TIMEOUT', 300),
+    private_timeout=getattr(settings, 'NEGATIVE_CACHE_PRIVATE_TIMEOUT', 900),
+)
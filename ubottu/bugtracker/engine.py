@@ -0,0 +1,223 @@
+import asyncio
+import os
+import re
+import threading
+import urllib.error
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+from django.conf import settings
+from launchpad.http_client import http, ACCEPT_ENCODING
+from .trackers import defined_bugtrackers, CVE, BugNotFoundError, BugtrackerError
+
+# Trackers served by /bugtracker/api/<tracker>/<id>/: name -> (type, url, description, aliases)
+DEFAULT_BUGTRACKERS = {
+    'launchpad': ('launchpad', 'https://launchpad.net', 'Launchpad', ['lp', 'ubuntu', 'malone']),
+    'debian': ('debbugs', 'https://bugs.debian.org', 'Debian', ['deb']),
+    'mozilla': ('bugzilla', 'https://bugzilla.mozilla.org', 'Mozilla', ['moz']),
+    'redhat': ('bugzilla', 'https://bugzilla.redhat.com', 'Red Hat', ['rh', 'rhbz']),
+    'kde': ('bugzilla', 'https://bugs.kde.org', 'KDE', []),
+    'sourceware': ('bugzilla', 'https://sourceware.org/bugzilla', 'Sourceware', []),
+}
+
+# Trackers that need ?project=, with the host used when the project doesn't name one
+PROJECT_TRACKERS = {
+    'github': ('github.com', '{host}/{project}/issues'),
+    'gitlab': ('gitlab.com', '{host}/{project}/-/issues'),
+    'gitea': (None, '{host}/{project}/issues'),
+}
+
+# The only hosts a ?project= may point at, anything else is refused
+DEFAULT_PROJECT_HOSTS = {
+    'github': ['github.com'],
+    'gitlab': ['gitlab.com', 'gitlab.gnome.org', 'gitlab.freedesktop.org', 'salsa.debian.org', 'invent.kde.org'],
+    'gitea': ['codeberg.org', 'gitea.com'],
+}
+# owner/repo, or group/subgroup/repo on GitLab
+PROJECT_PATH = re.compile(r'^[\w.-]+(/[\w.-]+)+$')
+
+# The engine whose tracker call runs in the current thread, for getUrl
+_current = threading.local()
+
+def current_engine():
+    return getattr(_current, 'engine', None) or engine
+
+BUG_FIELDS = ('id', 'product', 'title', 'severity', 'status', 'assignee', 'url', 'extinfo', 'duplicates')
+
+class BugEngine:
+    """
+    Runs the tracker classes from trackers.py behind one asyncio event loop.
+
+    The loop lives in a background thread of each worker and owns a single
+    aiohttp session, so every tracker shares its connection pool, the per
+    host connection limit and the timeouts. The tracker classes themselves
+    are synchronous; they run in a bounded thread pool and their
+    utils.web.getUrl calls are handed back to the loop.
+    """
+    def __init__(self, trackers=None, timeout=15, connect_timeout=http.connect_timeout, read_timeout=http.read_timeout,
+                 connections=100, connections_per_host=4, workers=16, client=http, project_hosts=None,
+                 max_instances=256):
+        self.trackers = trackers or DEFAULT_BUGTRACKERS
+        self.project_hosts = {name: {host.lower() for host in hosts}
+                              for name, hosts in (project_hosts or DEFAULT_PROJECT_HOSTS).items()}
+        self.max_instances = max_instances
+        self.http = client
+        self.timeout = timeout
+        self.client_timeout = aiohttp.ClientTimeout(total=read_timeout + connect_timeout, connect=connect_timeout,
+                                                    sock_read=read_timeout)
+        self.connections = connections
+        self.connections_per_host = connections_per_host
+        self.workers = workers
+        self.loop = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._instances = OrderedDict()
+
+    def start(self):
+        """Start the event loop thread, once per process (uWSGI forks after import)."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self.loop = asyncio.new_event_loop()
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='bugtracker')
+            self.session = None
+            self._instances = OrderedDict()
+            self._thread = threading.Thread(target=self.loop.run_forever, name='bugtracker-loop', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def resolve_name(self, name):
+        name = name.lower()
+        for tracker, (trackertype, url, description, aliases) in self.trackers.items():
+            if name == tracker or name in aliases:
+                return tracker
+        if name in PROJECT_TRACKERS or name == 'cve':
+            return name
+        raise KeyError(name)
+
+    def project_location(self, name, project):
+        """
+        Split a ?project= of a per-project tracker into (host, path). Raises
+        ValueError when the host is not in the tracker's allowed hosts or
+        the path is not a plain owner/repo.
+        """
+        default_host, template = PROJECT_TRACKERS[name]
+        host, _, path = project.partition('/')
+        if '.' not in host:
+            if default_host is None:
+                raise ValueError(f'{name} projects must start with the host name')
+            host, path = default_host, project
+        host = host.lower()
+        if host not in self.project_hosts.get(name, ()):
+            raise ValueError(f'{host} is not a known {name} host')
+        if not PROJECT_PATH.match(path) or '..' in path.split('/'):
+            raise ValueError(f'{project} is not a {name} project')
+        return host, path
+
+    def tracker(self, name, project=None):
+        """
+        Return the tracker instance for a configured name or alias, raising
+        KeyError for unknown ones and ValueError for projects on hosts that
+        are not allowed.
+        """
+        name = self.resolve_name(name)
+        key = (name, project)
+        with self._lock:
+            if key in self._instances:
+                self._instances.move_to_end(key)
+                return self._instances[key]
+        # Trackers that set up their own client (SOAP) read its timeout from the current engine
+        previous, _current.engine = getattr(_current, 'engine', None), self
+        try:
+            instance = self._create(name, project)
+        finally:
+            _current.engine = previous
+        with self._lock:
+            # Projects come from users, keep only the most recently used instances
+            instance = self._instances.setdefault(key, instance)
+            while len(self._instances) > self.max_instances:
+                self._instances.popitem(last=False)
+            return instance
+
+    def _create(self, name, project):
+        if name == 'cve':
+            return CVE()
+        if name in PROJECT_TRACKERS:
+            if not project:
+                raise KeyError(f'{name} needs a project')
+            host, path = self.project_location(name, project)
+            desc = PROJECT_TRACKERS[name][1].format(host=host, project=path)
+            return defined_bugtrackers[name](desc.lower(), f'https://{desc}', desc, name)
+        trackertype, url, description, aliases = self.trackers[name]
+        return defined_bugtrackers[trackertype](name, url, description, trackertype, aliases)
+
+    def cache_name(self, name, project=None):
+        name = self.resolve_name(name)
+        if project and name in PROJECT_TRACKERS:
+            host, path = self.project_location(name, project)
+            return f'{name}:{host}/{path.lower()}'
+        return f'{name}:{project.lower()}' if project else name
+
+    async def _session(self):
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.connections, limit_per_host=self.connections_per_host)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.client_timeout,
+                                                 headers={'User-Agent': self.http.user_agent,
+                                                          'Accept-Encoding': ACCEPT_ENCODING})
+        return self.session
+
+    async def fetch(self, url):
+        """
+        GET url through the shared session, raising urllib's HTTPError for
+        error statuses like getUrl did. 5xx and 429 answers and connection
+        errors are retried with the shared HTTP client's backoff.
+        """
+        response = await self.http.aget(await self._session(), url)
+        if response.status_code >= 400:
+            raise urllib.error.HTTPError(url, response.status_code, response.reason, response.headers, None)
+        return response.content
+
+    async def lookup(self, name, bug_id, project=None, bugtype='bug'):
+        """Return the bug as a dict, raising BugNotFoundError, BugtrackerError or asyncio.TimeoutError."""
+        tracker = await self.loop.run_in_executor(self.executor, self.tracker, name, project)
+        def call():
+            _current.engine = self
+            try:
+                if isinstance(tracker, CVE):
+                    return tracker.get_bug('', bug_id, do_url=False)
+                return tracker.get_bug(bugtype, bug_id)
+            finally:
+                _current.engine = None
+        result = await asyncio.wait_for(self.loop.run_in_executor(self.executor, call), self.timeout)
+        if result is None:
+            raise BugtrackerError(f'No answer from {tracker}')
+        if isinstance(tracker, CVE):
+            return {'id': bug_id, 'title': result, 'url': f'https://www.cve.org/CVERecord?id=CVE-{bug_id}'}
+        return dict(zip(BUG_FIELDS, result))
+
+    def run(self, coroutine, timeout=None):
+        """Run a coroutine on the engine loop from synchronous code and wait for it."""
+        self.start()
+        if threading.current_thread() is self._thread:
+            raise RuntimeError('Cannot wait on the bugtracker loop from inside it')
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        return future.result(timeout)
+
+    def fetch_sync(self, url):
+        # Bounded by the session's own connect/read timeouts
+        return self.run(self.fetch(url))
+
+    def get_bug(self, name, bug_id, project=None, bugtype='bug', timeout=None):
+        """lookup() from synchronous code, waiting at most timeout seconds (the engine's timeout by default)."""
+        return self.run(self.lookup(name, bug_id, project, bugtype), min(timeout or self.timeout + 1, self.timeout + 1))
+
+
+engine = BugEngine(
+    trackers=getattr(settings, 'BUGTRACKERS', None),
+    timeout=getattr(settings, 'BUGTRACKER_TIMEOUT', 15),
+    connections_per_host=getattr(settings, 'BUGTRACKER_CONNECTIONS_PER_HOST', 4),
+    workers=getattr(settings, 'BUGTRACKER_WORKERS', 16),
+    project_hosts=getattr(settings, 'BUGTRACKER_PROJECT_HOSTS', None),
+)
@@ -0,0 +1,196 @@
+import threading
+import time
+from types import SimpleNamespace
+from django.conf import settings
+from launchpad import aio
+from launchpad.codec import codec
+from launchpad.errors import NotFoundError
+from launchpad.http_client import RETRY_STATUSES, http
+from launchpad.utils import cache as redis_cache
+
+API_URL = 'https://api.github.com'
+# A 429 is a rate limit, waiting it out inside the request would only hold the worker
+RETRY_STATUSES = RETRY_STATUSES - {429}
+# How long to leave a token alone after a secondary rate limit that gave no Retry-After
+SECONDARY_LIMIT_WAIT = 60
+
+class GitHubRateLimitError(Exception):
+    """Every token is out of quota and there is no stored copy to fall back on"""
+    def __init__(self, reset):
+        super().__init__(f'GitHub rate limit exhausted until {time.strftime("%H:%M:%S", time.gmtime(reset))} UTC')
+        self.reset = reset
+
+class _Quota:
+    """What GitHub last told us about one token's (or the anonymous) rate limit"""
+    def __init__(self, token):
+        self.token = token
+        self.remaining = None
+        self.reset = 0
+
+    def available(self, now):
+        return self.remaining is None or self.remaining > 0 or self.reset <= now
+
+    def left(self, now):
+        # Unknown or past its reset means a full quota as far as we know
+        return float('inf') if self.remaining is None or self.reset <= now else self.remaining
+
+class GitHubClient:
+    """
+    Fetches GitHub issues with conditional requests and a token pool.
+
+    Each issue is stored with its ETag for etag_timeout seconds, well past the
+    bug cache's own lifetime, and later fetches revalidate it with
+    If-None-Match; a 304 costs no quota. The rate limit headers of every
+    answer are tracked per token, requests go out with the token that has
+    the most quota left, and once that drops below min_remaining issues we
+    already hold are served from the store without asking. When every token
+    is exhausted stored issues are served stale and only unknown ones fail.
+    Secondary rate limits and 429s put the token aside until Retry-After
+    instead of being retried in the request.
+    """
+    def __init__(self, tokens=(), etag_timeout=7 * 24 * 3600, min_remaining=10, client=None):
+        self.quotas = [_Quota(token) for token in tokens] or [_Quota(None)]
+        self.etag_timeout = etag_timeout
+        self.min_remaining = min_remaining
+        self.client = client or http
+        self.revalidated = 0
+        self.stale = 0
+        self._lock = threading.Lock()
+
+    def key(self, owner, repo, issue_id):
+        return f"github_etag_{owner.lower()}/{repo.lower()}#{issue_id}"
+
+    def get_issue(self, owner, repo, issue_id):
+        """Return the issue's JSON, raising KeyError if it does not exist and GitHubRateLimitError if out of quota."""
+        request = self._prepare(owner, repo, issue_id)
+        if request.answer is not None:
+            return request.answer
+        return self._finish(request, self.client.get(request.url, headers=request.headers,
+                                                     retry_statuses=RETRY_STATUSES))
+
+    async def aget_issue(self, owner, repo, issue_id):
+        """get_issue() for async views, over aiohttp."""
+        request = await aio.run_blocking(self._prepare, owner, repo, issue_id)
+        if request.answer is not None:
+            return request.answer
+        response = await aio.get(request.url, headers=request.headers, retry_statuses=RETRY_STATUSES)
+        return await aio.run_blocking(self._finish, request, response)
+
+    def _prepare(self, owner, repo, issue_id):
+        """Decide how to get the issue: the stored copy as request.answer, or a request with its headers."""
+        request = SimpleNamespace(owner=owner, repo=repo, issue_id=issue_id, key=self.key(owner, repo, issue_id),
+                                  answer=None)
+        request.stored = stored = self._load(request.key)
+        now = time.time()
+        request.quota = quota = self._pick(now)
+        if quota is None or (stored and quota.left(now) < self.min_remaining):
+            if stored:
+                with self._lock:
+                    self.stale += 1
+                request.answer = stored['data']
+                return request
+            raise GitHubRateLimitError(min(q.reset for q in self.quotas))
+
+        request.url = f"{API_URL}/repos/{owner}/{repo}/issues/{issue_id}"
+        request.headers = {'Accept': 'application/vnd.github+json', 'X-GitHub-Api-Version': '2022-11-28'}
+        if quota.token:
+            request.headers['Authorization'] = f'Bearer {quota.token}'
+        if stored:
+            request.headers['If-None-Match'] = stored['etag']
+        return request
+
+    def _finish(self, request, response):
+        stored, quota = request.stored, request.quota
+        self._update(quota, response.headers)
+        if response.status_code == 304 and stored:
+            with self._lock:
+                self.revalidated += 1
+            self._store(request.key, stored['etag'], stored['data'])
+            return stored['data']
+        if response.status_code == 404:
+            if stored:
+                self._forget(request.key)
+            raise NotFoundError(f"{request.owner}/{request.repo}#{request.issue_id}")
+        retry_at = self._rate_limited(quota, response)
+        if retry_at is not None:
+            if stored:
+                with self._lock:
+                    self.stale += 1
+                return stored['data']
+            raise GitHubRateLimitError(retry_at)
+        response.raise_for_status()
+        data = response.json()
+        if response.headers.get('ETag'):
+            self._store(request.key, response.headers['ETag'], data)
+        return data
+
+    def _pick(self, now):
+        with self._lock:
+            usable = [quota for quota in self.quotas if quota.available(now)]
+            return max(usable, key=lambda quota: quota.left(now), default=None)
+
+    def _rate_limited(self, quota, response):
+        """
+        When response is a primary or secondary rate limit, mark quota as
+        exhausted and return when it may be used again, else None.
+        """
+        headers = response.headers
+        if response.status_code not in (403, 429):
+            return None
+        if response.status_code == 403 and headers.get('X-RateLimit-Remaining') != '0' \
+                and headers.get('Retry-After') is None \
+                and b'secondary rate limit' not in (response.content or b'').lower():
+            # Forbidden for another reason
+            return None
+        if headers.get('Retry-After', '').isdigit():
+            retry_at = int(time.time()) + int(headers['Retry-After'])
+        elif headers.get('X-RateLimit-Remaining') == '0' and quota.reset > time.time():
+            retry_at = quota.reset
+        else:
+            retry_at = int(time.time()) + SECONDARY_LIMIT_WAIT
+        with self._lock:
+            quota.remaining = 0
+            quota.reset = retry_at
+        return retry_at
+
+    def _update(self, quota, headers):
+        remaining, reset = headers.get('X-RateLimit-Remaining'), headers.get('X-RateLimit-Reset')
+        if remaining is None or reset is None:
+            return
+        with self._lock:
+            quota.remaining = int(remaining)
+            quota.reset = int(reset)
+
+    def _load(self, key):
+        try:
+            stored = redis_cache.get(key)
+        except Exception as e:
+            print(f"Could not read GitHub ETag for {key}: {e}")
+            return None
+        return codec.loads(stored) if stored else None
+
+    def _store(self, key, etag, data):
+        try:
+            redis_cache.setex(key, self.etag_timeout, codec.dumps({'etag': etag, 'data': data}))
+        except Exception as e:
+            print(f"Could not store GitHub ETag for {key}: {e}")
+
+    def _forget(self, key):
+        try:
+            redis_cache.delete(key)
+        except Exception as e:
+            print(f"Could not drop GitHub ETag for {key}: {e}")
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            return {'revalidated': self.revalidated, 'stale': self.stale,
+                    'quotas': [{'remaining': quota.remaining, 'reset': quota.reset, 'exhausted': not quota.available(now)}
+                               for quota in self.quotas]}
+
+
+github = GitHubClient(
+    tokens=getattr(settings, 'GITHUB_TOKENS', ()),
+    etag_timeout=getattr(settings, 'GITHUB_ETAG_TIMEOUT', 7 * 24 * 3600),
+    min_remaining=getattr(settings, 'GITHUB_MIN_REMAINING', 10),
+)
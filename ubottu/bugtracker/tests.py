@@ -1,3 +1,433 @@
-from django.test import TestCase
+import json
+import os
+import threading
+import time
+import requests
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from django.test import SimpleTestCase
+from rest_framework.test import APIClient
+from launchpad.http_client import HTTPClient
+from launchpad.cache_client import LocalCache
+from launchpad.errors import NotFoundError, PrivateError, UpstreamError
+from .cache import BugCache
+from .utils import fetch_launchpad_bug
+from .engine import BugEngine
+from .github import GitHubClient, GitHubRateLimitError
+from .trackers import BugtrackerError, BugNotFoundError, BugPrivateError, Launchpad as LaunchpadTracker
+from . import views
 
-# Create your tests here.
+
+class BugCacheTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch('bugtracker.cache.redis_cache', LocalCache())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = BugCache(open_timeout=60, closed_timeout=3600, stale_timeout=60, local_timeout=3600)
+        self.calls = 0
+
+    def fetch(self, status='New'):
+        def fetch():
+            self.calls += 1
+            return {'id': 1, 'status': status, 'version': self.calls}
+        return fetch
+
+    def test_keys_are_normalized(self):
+        self.assertEqual(self.cache.key('Launchpad', ' #123'), self.cache.key('launchpad', '123'))
+
+    def test_fresh_entry_does_not_fetch(self):
+        self.cache.get('launchpad', 1, self.fetch())
+        self.assertEqual(self.cache.get('launchpad', 1, self.fetch())['version'], 1)
+        self.assertEqual(self.calls, 1)
+
+    def test_closed_bugs_live_longer(self):
+        self.assertEqual(self.cache.timeout({'status': 'Fix Released'}), 3600)
+        self.assertEqual(self.cache.timeout({'state': 'open'}), 60)
+
+    def test_stale_entry_is_served_while_refreshing(self):
+        self.cache.get('launchpad', 1, self.fetch())
+        with mock.patch('bugtracker.cache.time.time', return_value=time.time() + 90):
+            self.assertEqual(self.cache.get('launchpad', 1, self.fetch())['version'], 1)
+            self.cache._executor.shutdown(wait=True)
+            self.assertEqual(self.calls, 2)
+            self.assertEqual(self.cache.get('launchpad', 1, self.fetch())['version'], 2)
+
+    def test_errors_are_not_cached(self):
+        def missing():
+            raise KeyError(1)
+        with self.assertRaises(KeyError):
+            self.cache.get('launchpad', 1, missing)
+        self.assertEqual(self.cache.get('launchpad', 1, self.fetch())['version'], 1)
+
+    def test_missing_and_private_bugs_are_remembered(self):
+        def missing():
+            self.calls += 1
+            raise BugNotFoundError
+        def private():
+            self.calls += 1
+            raise BugPrivateError('This bug is private')
+        for _ in range(3):
+            with self.assertRaises((BugNotFoundError, NotFoundError)):
+                self.cache.get('launchpad', 1, missing)
+            with self.assertRaises((BugPrivateError, PrivateError)):
+                self.cache.get('launchpad', 2, private)
+            with self.assertRaises(PrivateError):
+                self.cache.peek('launchpad', 2)
+        self.assertEqual(self.calls, 2)
+        # Deleting a bug's entry forgets the negative outcome too
+        self.cache.delete('launchpad', 1)
+        self.assertEqual(self.cache.get('launchpad', 1, self.fetch())['version'], 3)
+
+
+
+
+class RecordedLaunchpad:
+    """
+    Serves a recorded bug the way launchpadlib does: resources are loaded
+    lazily, one request each, and collections one request per page.
+    """
+    page_size = 75
+
+    def __init__(self, fixture):
+        with open(os.path.join(os.path.dirname(__file__), 'testdata', fixture)) as data:
+            self.data = json.load(data)
+        self.requests = []
+        self.bugs = self
+
+    def __getitem__(self, bug_id):
+        return LazyEntry(self, self.data['bug']['self_link'], lambda: self.data['bug'])
+
+    def get(self, url):
+        self.requests.append(url)
+
+class LazyEntry:
+    def __init__(self, launchpad, url, load, data=None):
+        self._launchpad = launchpad
+        self._url = url
+        self._load = load
+        self._data = data
+
+    def __getattr__(self, name):
+        if self._data is None:
+            self._launchpad.get(self._url)
+            self._data = self._load()
+        if name == 'bug_tasks':
+            return LazyCollection(self._launchpad, self._data['bug_tasks_collection_link'], self._launchpad.data['bug_tasks'])
+        if name == 'target':
+            targets = self._launchpad.data['targets']
+            return LazyEntry(self._launchpad, self._data['target_link'], lambda: targets[self._data['target_link']])
+        return self._data[name]
+
+class LazyCollection:
+    def __init__(self, launchpad, url, entries):
+        self._launchpad = launchpad
+        self._url = url
+        self._entries = entries
+
+    def __iter__(self):
+        for start in range(0, len(self._entries), self._launchpad.page_size):
+            self._launchpad.get(f'{self._url}?ws.start={start}')
+            for entry in self._entries[start:start + self._launchpad.page_size]:
+                yield LazyEntry(self._launchpad, entry['self_link'], None, entry)
+
+class LaunchpadRoundTripTests(SimpleTestCase):
+    fixture = 'launchpad_bug_2059145.json'
+
+    def test_request_count(self):
+        launchpad = RecordedLaunchpad(self.fixture)
+        with mock.patch('bugtracker.utils.launchpad_client', return_value=nullcontext(launchpad)):
+            bug = fetch_launchpad_bug(2059145)
+        # The bug plus one page of tasks, however many tasks there are
+        self.assertEqual(len(launchpad.requests), 2)
+        self.assertEqual(bug['status'], 'In Progress')
+        self.assertEqual(bug['package'], 'filament')
+        self.assertEqual(bug['target'], 'filament (Ubuntu)')
+
+    def test_package_comes_from_the_target_link(self):
+        launchpad = RecordedLaunchpad(self.fixture)
+        task = launchpad.data['bug_tasks'][0]
+        task.update(target_link='https://api.launchpad.net/devel/ubuntu', bug_target_name='Ubuntu',
+                    bug_target_display_name='Ubuntu')
+        with mock.patch('bugtracker.utils.launchpad_client', return_value=nullcontext(launchpad)):
+            bug = fetch_launchpad_bug(2059145)
+        self.assertEqual((bug['package'], bug['target']), ('ubuntu', 'Ubuntu'))
+
+    def test_bug_without_tasks(self):
+        launchpad = RecordedLaunchpad(self.fixture)
+        launchpad.data['bug_tasks'] = []
+        with mock.patch('bugtracker.utils.launchpad_client', return_value=nullcontext(launchpad)):
+            bug = fetch_launchpad_bug(2059145)
+        self.assertEqual(bug['id'], 2059145)
+        self.assertEqual((bug['package'], bug['target'], bug['status']), ('', '', None))
+
+    def test_request_count_compared_to_dereferencing_targets(self):
+        # What walking task.target for every task costs on the same fixture
+        launchpad = RecordedLaunchpad(self.fixture)
+        bug = launchpad.bugs[2059145]
+        for task in bug.bug_tasks:
+            task.target.name
+        self.assertEqual(len(launchpad.requests), 2 + len(launchpad.data['bug_tasks']))
+
+    def test_tracker_without_launchpad(self):
+        tracker = LaunchpadTracker('launchpad', 'https://launchpad.net', 'Launchpad', 'launchpad')
+        with mock.patch('bugtracker.trackers.launchpad_client', side_effect=UpstreamError('no route to host')), \
+                mock.patch.object(tracker, 'get_bug_old', return_value='from +text') as get_bug_old:
+            self.assertEqual(tracker.get_bug('launchpad', 2059145), 'from +text')
+        get_bug_old.assert_called_once_with('launchpad', 2059145)
+
+
+class FakeBugzilla(BaseHTTPRequestHandler):
+    bugs = {
+        '42': {'bugs': [{'status': 'RESOLVED', 'resolution': 'FIXED', 'assigned_to_detail': {'real_name': 'Jane'},
+                         'product': 'Firefox', 'summary': 'It crashes', 'severity': 'major'}]},
+    }
+
+    def do_GET(self):
+        bug = self.bugs.get(self.path.rsplit('/', 1)[-1])
+        if self.path.endswith('/slow'):
+            time.sleep(1)
+        self.send_response(200 if bug else 500)
+        self.end_headers()
+        self.wfile.write(json.dumps(bug or {}).encode())
+
+    def log_message(self, *args):
+        pass
+
+class FakeGitHubResponse:
+    def __init__(self, status_code, data=None, etag=None, remaining=59, reset=None, retry_after=None, content=b''):
+        self.status_code = status_code
+        self.data = data
+        self.content = content
+        self.headers = {'X-RateLimit-Remaining': str(remaining), 'X-RateLimit-Reset': str(reset or int(time.time()) + 3600)}
+        if etag:
+            self.headers['ETag'] = etag
+        if retry_after is not None:
+            self.headers['Retry-After'] = str(retry_after)
+
+    def json(self):
+        return self.data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(self.status_code)
+
+class FakeGitHub:
+    """Answers with the queued responses and records the headers it was sent"""
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.sent = []
+
+    def get(self, url, headers, retry_statuses):
+        self.sent.append(headers)
+        self.retry_statuses = retry_statuses
+        return self.responses.pop(0)
+
+class GitHubClientTests(SimpleTestCase):
+    issue = {'number': 81, 'title': 'No public key', 'state': 'open'}
+
+    def setUp(self):
+        patcher = mock.patch('bugtracker.github.redis_cache', LocalCache())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_revalidates_with_etag(self):
+        upstream = FakeGitHub(FakeGitHubResponse(200, self.issue, etag='"abc"'), FakeGitHubResponse(304))
+        client = GitHubClient(client=upstream)
+        self.assertEqual(client.get_issue('NVIDIA', 'toolkit', 81), self.issue)
+        self.assertEqual(client.get_issue('nvidia', 'toolkit', 81), self.issue)
+        self.assertEqual(upstream.sent[1]['If-None-Match'], '"abc"')
+        self.assertEqual(client.stats()['revalidated'], 1)
+
+    def test_serves_stored_issues_when_out_of_quota(self):
+        upstream = FakeGitHub(FakeGitHubResponse(200, self.issue, etag='"abc"', remaining=1),
+                              FakeGitHubResponse(403, remaining=0))
+        client = GitHubClient(client=upstream, min_remaining=0)
+        client.get_issue('o', 'r', 81)
+        self.assertEqual(client.get_issue('o', 'r', 81), self.issue)
+        # Exhausted: stored issues come back without asking, unknown ones fail
+        self.assertEqual(client.get_issue('o', 'r', 81), self.issue)
+        with self.assertRaises(GitHubRateLimitError):
+            client.get_issue('o', 'r', 82)
+        self.assertEqual(len(upstream.sent), 2)
+
+    def test_secondary_rate_limit_honours_retry_after(self):
+        upstream = FakeGitHub(FakeGitHubResponse(403, remaining=4000, retry_after=120),
+                              FakeGitHubResponse(403, remaining=4000, content=b'{"message": "You have exceeded a secondary rate limit."}'))
+        client = GitHubClient(tokens=['one', 'two'], client=upstream)
+        with self.assertRaises(GitHubRateLimitError) as raised:
+            client.get_issue('o', 'r', 81)
+        self.assertAlmostEqual(raised.exception.reset, time.time() + 120, delta=2)
+        with self.assertRaises(GitHubRateLimitError):
+            client.get_issue('o', 'r', 81)
+        # Both tokens are set aside, the next lookup does not ask
+        with self.assertRaises(GitHubRateLimitError):
+            client.get_issue('o', 'r', 81)
+        self.assertEqual([headers['Authorization'] for headers in upstream.sent], ['Bearer one', 'Bearer two'])
+
+    def test_too_many_requests_is_not_retried(self):
+        upstream = FakeGitHub(FakeGitHubResponse(429, remaining=10, retry_after=5))
+        client = GitHubClient(client=upstream)
+        with self.assertRaises(GitHubRateLimitError):
+            client.get_issue('o', 'r', 81)
+        self.assertNotIn(429, upstream.retry_statuses)
+        self.assertIn(503, upstream.retry_statuses)
+
+    def test_other_forbidden_answers_are_errors(self):
+        upstream = FakeGitHub(FakeGitHubResponse(403, remaining=4000, content=b'{"message": "Resource not accessible"}'))
+        with self.assertRaises(requests.HTTPError):
+            GitHubClient(client=upstream).get_issue('o', 'r', 81)
+
+    def test_backs_off_before_quota_runs_out(self):
+        upstream = FakeGitHub(FakeGitHubResponse(200, self.issue, etag='"abc"', remaining=5))
+        client = GitHubClient(client=upstream, min_remaining=10)
+        client.get_issue('o', 'r', 81)
+        self.assertEqual(client.get_issue('o', 'r', 81), self.issue)
+        self.assertEqual((len(upstream.sent), client.stats()['stale']), (1, 1))
+
+    def test_uses_the_token_with_most_quota(self):
+        upstream = FakeGitHub(FakeGitHubResponse(200, self.issue, remaining=100),
+                              FakeGitHubResponse(200, self.issue, remaining=4000),
+                              FakeGitHubResponse(200, self.issue, remaining=3999))
+        client = GitHubClient(tokens=['one', 'two'], client=upstream)
+        for issue_id in (1, 2, 3):
+            client.get_issue('o', 'r', issue_id)
+        self.assertEqual([headers['Authorization'] for headers in upstream.sent],
+                         ['Bearer one', 'Bearer two', 'Bearer two'])
+
+class BugEngineTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeBugzilla)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{cls.server.server_port}'
+        cls.engine = BugEngine(trackers={'test': ('bugzilla', url, 'Test', ['t'])}, timeout=0.5,
+                               client=HTTPClient(retries=0))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        super().tearDownClass()
+
+    def test_lookup_through_tracker_class(self):
+        bug = self.engine.get_bug('t', '42')
+        self.assertEqual(bug['title'], 'It crashes')
+        self.assertEqual(bug['status'], 'RESOLVED: FIXED')
+        self.assertEqual(bug['assignee'], 'Jane')
+
+    def test_upstream_errors(self):
+        with self.assertRaises(BugtrackerError):
+            self.engine.get_bug('test', '7')
+
+    def test_timeout(self):
+        with self.assertRaises(TimeoutError):
+            self.engine.get_bug('test', 'slow')
+
+    def test_unknown_tracker(self):
+        with self.assertRaises(KeyError):
+            self.engine.cache_name('nope')
+
+    def test_project_trackers(self):
+        tracker = self.engine.tracker('github', 'canonical/ubottu')
+        self.assertEqual(tracker.url, 'https://github.com/canonical/ubottu/issues')
+        tracker = self.engine.tracker('gitlab', 'gitlab.gnome.org/GNOME/gtk')
+        self.assertEqual(tracker.url, 'https://gitlab.gnome.org/GNOME/gtk/-/issues')
+
+    def test_project_hosts_are_allow_listed(self):
+        for name, project in (('github', '169.254.169.254/latest/meta-data'), ('gitea', '10.0.0.5:6379/a/b'),
+                              ('gitlab', 'intranet.corp/x/y'), ('gitlab', 'gitlab.com/../x'), ('github', 'a?b=/c')):
+            with self.assertRaises(ValueError):
+                self.engine.tracker(name, project)
+            with self.assertRaises(ValueError):
+                self.engine.cache_name(name, project)
+        response = APIClient().get('/bugtracker/api/gitea/1/', {'project': '10.0.0.5:6379/a/b'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_tracker_instances_are_bounded(self):
+        engine = BugEngine(max_instances=2)
+        for repo in ('a', 'b', 'c'):
+            engine.tracker('github', f'owner/{repo}')
+        self.assertEqual(list(engine._instances), [('github', 'owner/b'), ('github', 'owner/c')])
+
+    def test_soap_trackers_get_the_engine_timeout(self):
+        soap = mock.Mock()
+        engine = BugEngine(trackers={'debian': ('debbugs', 'https://bugs.debian.org', 'Debian', [])},
+                           connect_timeout=2, read_timeout=3)
+        with mock.patch.dict('sys.modules', {'pysimplesoap': soap, 'pysimplesoap.client': soap}):
+            engine.tracker('debian')
+        self.assertEqual(soap.SoapClient.call_args.kwargs['timeout'], 5)
+
+    def test_batch_returns_partial_results_in_order(self):
+        cache = BugCache(local_timeout=3600)
+        cache.set(cache.key('tracker:test', '1'), {'id': 1, 'title': 'Cached', 'status': 'New'})
+        bugs = [{'tracker': 'test', 'id': '42'}, {'tracker': 'test', 'id': 'slow'}, {'tracker': 'test', 'id': '7'},
+                {'tracker': 'nope', 'id': '1'}, {'tracker': 'github', 'id': '1'}, {'tracker': 'test', 'id': '1'}]
+        with mock.patch.object(views, 'engine', self.engine), mock.patch.object(views, 'bug_cache', cache), \
+                mock.patch.object(views, 'BATCH_TIMEOUT', 0.3):
+            started = time.monotonic()
+            response = APIClient().post('/bugtracker/api/bugs/batch/', {'bugs': bugs}, format='json')
+            self.assertLess(time.monotonic() - started, 0.9)
+        results = response.json()['results']
+        self.assertEqual([r['id'] for r in results], ['42', 'slow', '7', '1', '1', '1'])
+        self.assertEqual([r['status'] for r in results], [200, 504, 502, 404, 400, 200])
+        self.assertEqual(results[0]['bug']['title'], 'It crashes')
+        self.assertEqual(results[5]['bug']['title'], 'Cached')
+
+    def test_batch_rejects_malformed_items_alone(self):
+        cache = BugCache(local_timeout=3600)
+        bugs = [{'tracker': 'test', 'id': None}, {'tracker': 'github', 'id': '1', 'project': 5},
+                {'tracker': ['test'], 'id': '1'}, {'tracker': 'test', 'id': '1', 'type': []}, {'tracker': 'test', 'id': 42}]
+        with mock.patch.object(views, 'engine', self.engine), mock.patch.object(views, 'bug_cache', cache):
+            response = APIClient().post('/bugtracker/api/bugs/batch/', {'bugs': bugs}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['status'] for r in response.json()['results']], [400, 400, 400, 400, 200])
+
+    def test_batch_lookups_stop_waiting_at_the_deadline(self):
+        cache = BugCache(local_timeout=3600)
+        started = time.monotonic()
+        with mock.patch.object(views, 'engine', self.engine), mock.patch.object(views, 'bug_cache', cache), \
+                self.assertRaises(TimeoutError):
+            views.batch_lookup(started + 0.1, 'tracker:test', 'test', 'slow')
+        self.assertLess(time.monotonic() - started, 0.4)
+
+    def test_batch_size_is_limited(self):
+        bugs = [{'tracker': 'test', 'id': str(i)} for i in range(views.BATCH_MAX_BUGS + 1)]
+        response = APIClient().post('/bugtracker/api/bugs/batch/', {'bugs': bugs}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+class AsyncViewTests(SimpleTestCase):
+    bug = {'id': 1, 'title': 'A bug', 'status': 'New'}
+
+    def setUp(self):
+        self.bug_cache = mock.Mock()
+        for patcher in (mock.patch.object(views, 'bug_cache', self.bug_cache),
+                        mock.patch.object(views, 'prefetcher', mock.Mock())):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def test_launchpad_bug(self):
+        self.bug_cache.get.return_value = self.bug
+        response = await self.async_client.get('/bugtracker/async/api/bugtracker/launchpad/1/')
+        self.assertEqual((response.status_code, response.json()['title']), (200, 'A bug'))
+        self.bug_cache.get.side_effect = NotFoundError('1')
+        response = await self.async_client.get('/bugtracker/async/api/bugtracker/launchpad/1/')
+        self.assertEqual(response.status_code, 404)
+        self.bug_cache.get.side_effect = UpstreamError('Launchpad is down')
+        response = await self.async_client.get('/bugtracker/async/api/bugtracker/launchpad/1/')
+        self.assertEqual(response.status_code, 502)
+
+    async def test_github_bug(self):
+        self.bug_cache.peek.return_value = None
+        with mock.patch.object(views, 'afetch_github_bug', mock.AsyncMock(return_value=self.bug)):
+            response = await self.async_client.get('/bugtracker/async/api/bugtracker/github/o/r/1/')
+        self.assertEqual((response.status_code, response.json()['title']), (200, 'A bug'))
+        self.bug_cache.set.assert_called_once_with(self.bug_cache.key.return_value, self.bug)
+
+    async def test_github_rate_limit(self):
+        self.bug_cache.peek.return_value = None
+        error = GitHubRateLimitError(time.time() + 30)
+        with mock.patch.object(views, 'afetch_github_bug', mock.AsyncMock(side_effect=error)):
+            response = await self.async_client.get('/bugtracker/async/api/bugtracker/github/o/r/1/')
+        self.assertEqual(response.status_code, 503)
+        self.assertLessEqual(int(response['Retry-After']), 30)
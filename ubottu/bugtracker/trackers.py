@@ -16,10 +16,17 @@
 ###
 
 
-import sys, os, re, json, base64
+import sys, os, re, json, base64, logging
 import xml.dom.minidom as minidom
 from email.parser import FeedParser
-from pysimplesoap.client import SoapClient
+from types import SimpleNamespace
+from . import web
+from launchpad.errors import UpstreamError
+from launchpad.launchpad_singleton import launchpad_client
+
+# The Supybot helpers these trackers expect
+utils = SimpleNamespace(web=web)
+supylog = logging.getLogger('bugtracker')
 
 def _getnodetxt(node):
     L = []
@@ -65,6 +72,10 @@ class BugNotFoundError(Exception):
     """Pity, bug isn't there"""
     pass
 
+class BugPrivateError(BugtrackerError):
+    """The bug exists, but we may not see it"""
+    pass
+
 cvere = re.compile(r'<th[^>]*>Description</th>.*?<td[^>]*>\s*(?P<cve>.*?)\s*</td>', re.I | re.DOTALL)
 cverre = re.compile(r'<h2[^>]*>\s*(?P<cverr>.*?)\s*</h2>', re.I | re.DOTALL)
 # Define CVE tracker
@@ -197,7 +208,6 @@ class Launchpad(IBugtracker):
 
     def __init__(self, *args, **kwargs):
         IBugtracker.__init__(self, *args, **kwargs)
-        self.lp = None
 
         # A word to the wise:
         # The Launchpad API is much better than the /+text interface we currently use,
@@ -206,16 +216,6 @@ class Launchpad(IBugtracker):
         # or all, of the Launchpad developers hate it. For this reason, we are dropping
         # support for /+text in the future in favour of launchpadlib.
         # Terence Simpson (tsimpson) 2010-04-20
-        
-        try:
-            from launchpadlib.launchpad import Launchpad
-            cachedir = os.path.join('/tmp/', 'launchpadlib')
-            self.lp = Launchpad.login_anonymously("Ubuntu Matrix Bots - Bugtracker", 'production', cachedir, version='devel')
-        except ImportError:
-            print("Please install python-launchpadlib, the old interface is deprecated")
-        except Exception:
-            self.lp = None
-            print("Unknown exception while accessing the Launchpad API")
 
     def _parse(self, task): # Deprecated
         parser = FeedParser()
@@ -271,15 +271,20 @@ class Launchpad(IBugtracker):
         return 0
 
     def get_bug(self, bugtype, bugid): #TODO: Remove this method and rename 'get_bug_new' to 'get_bug'
-        if self.lp:
-            return self.get_bug_new(bugtype, bugid)
+        # A client checked out of the site's pool for this lookup, so trackers
+        # used from several threads never share a connection
+        try:
+            with launchpad_client() as lp:
+                return self.get_bug_new(bugtype, bugid, lp)
+        except UpstreamError as e:
+            print(f"Unknown exception while accessing the Launchpad API: {e}")
         return self.get_bug_old(bugtype, bugid)
 
-    def get_bug_new(self, bugtype, bugid): #TODO: Rename this method to 'get_bug'
+    def get_bug_new(self, bugtype, bugid, lp): #TODO: Rename this method to 'get_bug'
         try:
-            bugdata = self.lp.bugs[int(bugid)]
+            bugdata = lp.bugs[int(bugid)]
             if bugdata.private:
-                raise BugtrackerError("This bug is private")
+                raise BugPrivateError("This bug is private")
             duplicate = []
             dup = bugdata.duplicate_of
             while dup:
@@ -305,12 +310,14 @@ class Launchpad(IBugtracker):
             else:
                 assignee = ''
 
+        except BugPrivateError:
+            raise
         except Exception as e:
             if type(e).__name__ == 'HTTPError': # messy, but saves trying to import lazr.restfulclient.errors.HTPError
                 if e.response.status == 404:
                     bugNo = e.content.split()[-1][2:-1] # extract the real bug number
                     if bugNo != bugid: # A duplicate of a private bug, at least we know it exists
-                        raise BugtrackerError('Bug #%s is a duplicate of bug #%s, but it is private (%s/bugs/%s)' % (bugid, bugNo, self.url, bugNo))
+                        raise BugPrivateError('Bug #%s is a duplicate of bug #%s, but it is private (%s/bugs/%s)' % (bugid, bugNo, self.url, bugNo))
                     raise BugtrackerError("Bug #%s is private or does not exist (%s/bugs/%s)" % (bugid, self.url, bugid)) # Could be private, could just not exist
                 raise BugtrackerError(self.errget % (self.description, e, '%s/bugs/%s' % (self.url, bugid)))
             elif isinstance(e, KeyError):
@@ -327,7 +334,7 @@ class Launchpad(IBugtracker):
         except Exception as e:
             if 'HTTP Error 404' in str(e):
                 if duplicate:
-                    raise BugtrackerError('Bug #%s is a duplicate of bug #%s, but it is private (%s/bugs/%s)' % (duplicate, bugid, self.url, bugid))
+                    raise BugPrivateError('Bug #%s is a duplicate of bug #%s, but it is private (%s/bugs/%s)' % (duplicate, bugid, self.url, bugid))
                 else:
                     raise BugNotFoundError
             raise BugtrackerError(self.errget % (self.description, e, url))
@@ -371,7 +378,11 @@ class Launchpad(IBugtracker):
 class Debbugs(IBugtracker):
     def __init__(self, *args, **kwargs):
         IBugtracker.__init__(self, *args, **kwargs)
-        self.soap_client = SoapClient("%s/cgi-bin/soap.cgi" % self.url, namespace="Debbugs/SOAP")
+        # Imported here so the rest of the module loads without PySimpleSOAP
+        from pysimplesoap.client import SoapClient
+        # PySimpleSOAP makes its own requests, bound them like the engine's (its default is 60 seconds)
+        self.soap_client = SoapClient("%s/cgi-bin/soap.cgi" % self.url, namespace="Debbugs/SOAP",
+                                      timeout=utils.web.timeout())
 
     def get_bug(self, bugtype, bugid):
         url = "%s/cgi-bin/bugreport.cgi?bug=%s" % (self.url, bugid)
@@ -647,7 +658,9 @@ class CGit(IBugtracker):
 class Mantis(IBugtracker):
     def __init__(self, *args, **kwargs):
         IBugtracker.__init__(self, *args, **kwargs)
-        self.soap_client = SoapClient("%s/api/soap/mantisconnect.php" % self.url, namespace="http://futureware.biz/mantisconnect")
+        from pysimplesoap.client import SoapClient
+        self.soap_client = SoapClient("%s/api/soap/mantisconnect.php" % self.url, namespace="http://futureware.biz/mantisconnect",
+                                      timeout=utils.web.timeout())
 
     def get_tracker(self, url):
         try:
@@ -4,5 +4,11 @@ from . import views
 urlpatterns = [
     #path('', views.list_facts, name='facts-list'),
     path('api/bugtracker/launchpad/<int:bug_id>/', views.get_launchpad_bug, name='get_launchpad_bug'),
+    path('api/bugtracker/stats/', views.upstream_stats, name='upstream_stats'),
     path('api/bugtracker/github/<str:owner>/<str:repo>/<int:bug_id>/', views.get_github_bug, name='get_github_bug'),
+    path('async/api/bugtracker/launchpad/<int:bug_id>/', views.get_launchpad_bug_async, name='get_launchpad_bug_async'),
+    path('async/api/bugtracker/github/<str:owner>/<str:repo>/<int:bug_id>/', views.get_github_bug_async,
+         name='get_github_bug_async'),
+    path('api/bugs/batch/', views.get_bugs_batch, name='get_bugs_batch'),
+    path('api/<str:tracker>/<str:bug_id>/', views.get_bug, name='get_bug'),
 ]
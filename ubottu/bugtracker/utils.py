@@ -0,0 +1,42 @@
+from launchpad.errors import launchpad_errors
+from launchpad.launchpad_singleton import launchpad_client
+from .github import github
+from .trackers import Launchpad as LaunchpadTracker
+
+def fetch_launchpad_bug(bug_id):
+    #Bug 2059145 in filament (Ubuntu) "please remove filament from noble" [Undecided, In Progress] https://launchpad.net/bugs/2059145
+    with launchpad_client() as launchpad, launchpad_errors(bug_id):
+        # One request for the bug itself
+        bug = launchpad.bugs[int(bug_id)]
+        bug_link = bug.self_link
+        # and one per page of tasks. The task collection already carries the
+        # status, importance and target, so task.target (a request per task)
+        # is never dereferenced.
+        tasks = list(bug.bug_tasks)
+        result = {'id': bug.id, 'title': bug.title, 'self_link': bug_link, 'link': bug.web_link, 'target_link': None,
+                  'status': None, 'importance': None, 'package': '', 'target': ''}
+    if not tasks:
+        return result
+
+    # Report the most relevant task, the same one the bot's tracker picks
+    task = max(tasks, key=LaunchpadTracker._rank)
+    result.update({'target_link': task.target_link, 'status': task.status, 'importance': task.importance,
+                   'package': target_name(task.target_link), 'target': task.bug_target_display_name})
+    return result
+
+def target_name(target_link):
+    # The name of the target is the last segment of its link: .../ubuntu/+source/<package>,
+    # .../<project> or .../<distribution>, the same as task.target.name
+    return target_link.rstrip('/').rsplit('/', 1)[-1] if target_link else ''
+
+def fetch_github_bug(owner, repo, bug_id):
+    #Issue 81 in NVIDIA/nvidia-container-toolkit "Can't install due to no public key being available for Ubuntu" [Open]
+    return github_bug_data(github.get_issue(owner, repo, bug_id))
+
+async def afetch_github_bug(owner, repo, bug_id):
+    return github_bug_data(await github.aget_issue(owner, repo, bug_id))
+
+def github_bug_data(bug):
+    issue_id = bug['number']  # GitHub API uses 'number' as the issue ID in the repository
+    owner_repo = bug['repository_url'].split('/')[-2:]  # Extracts owner and repo from the URL
+    return {'id': issue_id, 'description': bug['title'], 'state': bug['state'], 'project': '/'.join(owner_repo)}
@@ -1,46 +1,54 @@
-from django.http import HttpResponse, Http404
+from django.http import HttpResponse, Http404, JsonResponse
 from rest_framework.views import APIView
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from django.shortcuts import render
-from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
-from geopy.geocoders import Nominatim
-from timezonefinder import TimezoneFinder
+from django.conf import settings
 from datetime import datetime
 from rest_framework import status
-from launchpad.launchpad_singleton import get_launchpad
+from .cache import bug_cache
+from .utils import fetch_launchpad_bug, fetch_github_bug, afetch_github_bug
+from .github import github, GitHubRateLimitError
+from .engine import engine, PROJECT_TRACKERS
+from .trackers import BugNotFoundError, BugPrivateError, BugtrackerError
+from launchpad import aio, singleflight
+from launchpad.errors import NotFoundError, PrivateError, UpstreamError
+from launchpad.http_client import http
+from launchpad.launchpad_singleton import launchpad_clients
+from launchpad.prefetch import prefetcher
+from launchpad.utils import cache as redis_cache, negative_cache
 import pytz
 import json
-import requests
+import asyncio
+import concurrent.futures
+import functools
+import time
+
+# What a timed out lookup raises, depending on where it timed out
+TIMEOUT_ERRORS = (TimeoutError, asyncio.TimeoutError, concurrent.futures.TimeoutError)
+
+BATCH_MAX_BUGS = getattr(settings, 'BUGTRACKER_BATCH_MAX_BUGS', 50)
+BATCH_TIMEOUT = getattr(settings, 'BUGTRACKER_BATCH_TIMEOUT', 10)
+# Waits on the engine for batch lookups; the engine itself bounds the network side
+batch_executor = concurrent.futures.ThreadPoolExecutor(max_workers=getattr(settings, 'BUGTRACKER_WORKERS', 16),
+                                                       thread_name_prefix='bug-batch')
 
 @api_view(['GET'])
-@cache_page(60 * 15)  # Cache for 15 minutes
 def get_launchpad_bug(request, bug_id):
-    #Bug 2059145 in filament (Ubuntu) "please remove filament from noble" [Undecided, In Progress] https://launchpad.net/bugs/2059145
-    package = ''
-    release_name = ''
-    target_link = ''
-    target_name = ''
-    series = ''
-    series_display_name = ''
-    cachedir = "~/.launchpadlib/cache/"
     try:
-        launchpad = get_launchpad()
-        bug = launchpad.bugs[int(bug_id)]
-        for task in bug.bug_tasks:
-            if task.target.name:
-                package=task.target.name
-            if task.target_link:
-                target_link = task.target_link
-        
-        return Response({'id': bug.id, 'title': bug.title, 'target_link': target_link, 'status': task.status, \
-                         'importance': task.importance, 'self_link': bug.self_link, 'link': bug.web_link, 'target_link': target_link, 'package': package})
-
+        # Only the cache talks to Launchpad
+        bug = bug_cache.get('launchpad', bug_id, lambda: fetch_launchpad_bug(bug_id))
+        prefetcher.record('launchpad_bug', bug_id)
+        return Response(bug)
     except KeyError as e:
         # Handle the case where the bug is not found
         print(f"Bug with ID {bug_id} was not found. Error: {e}")
         return Response({'error': 'Bug not found'}, status=status.HTTP_404_NOT_FOUND)
+    except PrivateError:
+        return Response({'error': 'Bug is private'}, status=status.HTTP_403_FORBIDDEN)
+    except UpstreamError as e:
+        print(f"Error processing request for launchpad bug {bug_id}: {e}")
+        return Response({'error': str(e)}, status=status.HTTP_502_BAD_GATEWAY)
     except Exception as e:
         # Handle other potential exceptions
         print(f"An error occurred: {e}")
@@ -48,28 +56,244 @@ def get_launchpad_bug(request, bug_id):
         return Response({'error': 'An error occurred processing your request'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
 @api_view(['GET'])
-@cache_page(60 * 15)  # Cache for 15 minutes
 def get_github_bug(request, owner, repo, bug_id):
-    #Issue 81 in NVIDIA/nvidia-container-toolkit "Can't install due to no public key being available for Ubuntu" [Open]
     try:
-        url = f"https://api.github.com/repos/{owner}/{repo}/issues/{bug_id}"
-        response = requests.get(url)
-        if response.status_code == 404:
-            # If the GitHub API returns a 404 status code, return an appropriate response
-            return Response({'error': 'GitHub bug not found'}, status=status.HTTP_404_NOT_FOUND)
-        bug = response.json()
-        issue_id = bug['number']  # GitHub API uses 'number' as the issue ID in the repository
-        owner_repo = bug['repository_url'].split('/')[-2:]  # Extracts owner and repo from the URL
-        description = bug['title']
-        state = bug['state']
-        return Response({'id':issue_id, 'description': description, 'state': state, 'project': '/'.join(owner_repo)})
+        bug = bug_cache.get(f'github:{owner}/{repo}', bug_id, lambda: fetch_github_bug(owner, repo, bug_id))
+        prefetcher.record('github_bug', owner, repo, bug_id)
+        return Response(bug)
     except KeyError as e:
         # Handle the case where the bug is not found
         print(f"Bug with ID {bug_id} was not found. Error: {e}")
-        return Response({'error': 'Bug not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'error': 'GitHub bug not found'}, status=status.HTTP_404_NOT_FOUND)
+    except PrivateError:
+        return Response({'error': 'GitHub bug is private'}, status=status.HTTP_403_FORBIDDEN)
+    except GitHubRateLimitError as e:
+        print(f"Error processing request for GitHub bug {owner}/{repo}#{bug_id}: {e}")
+        return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                        headers={'Retry-After': str(max(int(e.reset - time.time()), 1))})
     except Exception as e:
         # Handle other potential exceptions
         print(f"An error occurred: {e}")
         print(f"Error processing request for launchpad bug {bug_id}: {str(e)}")
         return Response({'error': 'An error occurred processing your request'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-    
\ No newline at end of file
+
+async def get_launchpad_bug_async(request, bug_id):
+    # get_launchpad_bug for ASGI servers, launchpadlib runs in the bounded blocking pool
+    try:
+        bug = await aio.run_blocking(bug_cache.get, 'launchpad', bug_id, functools.partial(fetch_launchpad_bug, bug_id))
+        await aio.run_blocking(prefetcher.record, 'launchpad_bug', bug_id)
+        return JsonResponse(bug)
+    except KeyError as e:
+        print(f"Bug with ID {bug_id} was not found. Error: {e}")
+        return JsonResponse({'error': 'Bug not found'}, status=status.HTTP_404_NOT_FOUND)
+    except PrivateError:
+        return JsonResponse({'error': 'Bug is private'}, status=status.HTTP_403_FORBIDDEN)
+    except UpstreamError as e:
+        print(f"Error processing request for launchpad bug {bug_id}: {e}")
+        return JsonResponse({'error': str(e)}, status=status.HTTP_502_BAD_GATEWAY)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        print(f"Error processing request for launchpad bug {bug_id}: {str(e)}")
+        return JsonResponse({'error': 'An error occurred processing your request'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+async def get_github_bug_async(request, owner, repo, bug_id):
+    # get_github_bug for ASGI servers, misses are fetched over aiohttp
+    name = f'github:{owner}/{repo}'
+    try:
+        bug = await aio.run_blocking(bug_cache.peek, name, bug_id, functools.partial(fetch_github_bug, owner, repo, bug_id))
+        if bug is None:
+            try:
+                bug = await afetch_github_bug(owner, repo, bug_id)
+            except NotFoundError as e:
+                await aio.run_blocking(bug_cache.negative.remember, bug_cache.key(name, bug_id), e)
+                raise
+            await aio.run_blocking(bug_cache.set, bug_cache.key(name, bug_id), bug)
+        await aio.run_blocking(prefetcher.record, 'github_bug', owner, repo, bug_id)
+        return JsonResponse(bug)
+    except KeyError as e:
+        print(f"Bug with ID {bug_id} was not found. Error: {e}")
+        return JsonResponse({'error': 'GitHub bug not found'}, status=status.HTTP_404_NOT_FOUND)
+    except PrivateError:
+        return JsonResponse({'error': 'GitHub bug is private'}, status=status.HTTP_403_FORBIDDEN)
+    except GitHubRateLimitError as e:
+        print(f"Error processing request for GitHub bug {owner}/{repo}#{bug_id}: {e}")
+        return JsonResponse({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            headers={'Retry-After': str(max(int(e.reset - time.time()), 1))})
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        print(f"Error processing request for GitHub bug {owner}/{repo}#{bug_id}: {str(e)}")
+        return JsonResponse({'error': 'An error occurred processing your request'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+def bug_cache_name(tracker, project, bugtype):
+    """
+    The bug cache name for a tracker reference. Raises KeyError for unknown
+    trackers and ValueError when a per-project tracker has no project.
+    """
+    # Prefixed to keep apart from the launchpad and github routes, whose data differs
+    name = 'tracker:' + engine.cache_name(tracker, project)
+    if tracker.lower() in PROJECT_TRACKERS and not project:
+        raise ValueError(f'{tracker} needs a project')
+    return name if bugtype == 'bug' else f'{name}:{bugtype}'
+
+def bug_name_error(e, tracker):
+    if isinstance(e, KeyError):
+        return f'Unknown bug tracker {tracker}', status.HTTP_404_NOT_FOUND
+    return str(e), status.HTTP_400_BAD_REQUEST
+
+def lookup_bug(name, tracker, bug_id, project=None, bugtype='bug', timeout=None):
+    return bug_cache.get(name, bug_id, functools.partial(engine.get_bug, tracker, bug_id, project, bugtype, timeout))
+
+def batch_lookup(deadline, *args):
+    # Waits on the engine no longer than the batch does, so a slow tracker
+    # cannot keep holding a batch_executor thread after the batch answered
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError('Batch deadline passed before the lookup started')
+    return lookup_bug(*args, timeout=remaining)
+
+def batch_ref(ref):
+    """(tracker, bug id, project, type) of one batch item, raising ValueError when a field has the wrong type."""
+    tracker, bug_id, project, bugtype = ref.get('tracker'), ref.get('id'), ref.get('project'), ref.get('type', 'bug')
+    if not isinstance(tracker, str) or not tracker:
+        raise ValueError('tracker must be a string')
+    if isinstance(bug_id, bool) or not isinstance(bug_id, (str, int)) or bug_id == '':
+        raise ValueError('id must be a string or an integer')
+    if project is not None and not isinstance(project, str):
+        raise ValueError('project must be a string')
+    if not isinstance(bugtype, str):
+        raise ValueError('type must be a string')
+    return tracker, str(bug_id), project or None, bugtype
+
+def bug_error(e, tracker, bug_id):
+    """Map a lookup exception to an (error message, HTTP status) pair."""
+    if isinstance(e, (BugNotFoundError, NotFoundError)):
+        return 'Bug not found', status.HTTP_404_NOT_FOUND
+    if isinstance(e, (BugPrivateError, PrivateError)):
+        return str(e) or 'Bug is private', status.HTTP_403_FORBIDDEN
+    if isinstance(e, TIMEOUT_ERRORS):
+        print(f"Timed out looking up {tracker} bug {bug_id}")
+        return 'The bug tracker did not answer in time', status.HTTP_504_GATEWAY_TIMEOUT
+    if isinstance(e, (BugtrackerError, UpstreamError)):
+        print(f"Error processing request for {tracker} bug {bug_id}: {e}")
+        return str(e), status.HTTP_502_BAD_GATEWAY
+    print(f"An error occurred: {e}")
+    print(f"Error processing request for {tracker} bug {bug_id}: {str(e)}")
+    return 'An error occurred processing your request', status.HTTP_500_INTERNAL_SERVER_ERROR
+
+@api_view(['GET'])
+def get_bug(request, tracker, bug_id):
+    """
+    Look up a bug in any tracker known to the bug engine.
+
+    Trackers hosted per project (github, gitlab, gitea) need ?project=, e.g.
+    owner/repo or gitlab.gnome.org/GNOME/gtk. ?type= picks issue, pull or
+    commit where the tracker has them.
+    """
+    project = request.query_params.get('project') or None
+    bugtype = request.query_params.get('type', 'bug')
+    try:
+        name = bug_cache_name(tracker, project, bugtype)
+    except (KeyError, ValueError) as e:
+        error, error_status = bug_name_error(e, tracker)
+        return Response({'error': error}, status=error_status)
+    try:
+        bug = lookup_bug(name, tracker, bug_id, project, bugtype)
+        prefetcher.record('bug', tracker, bug_id, project, bugtype)
+        return Response(bug)
+    except Exception as e:
+        error, error_status = bug_error(e, tracker, bug_id)
+        return Response({'error': error}, status=error_status)
+
+@api_view(['POST'])
+def get_bugs_batch(request):
+    """
+    Look up several bugs, possibly in different trackers, in one request.
+
+    Expects {"bugs": [{"tracker": "lp", "id": "123"}, ...]}, each item may
+    also carry "project" and "type" like the single lookup. Cached bugs are
+    answered right away, the rest are looked up concurrently until
+    BUGTRACKER_BATCH_TIMEOUT runs out. Results come back in request order,
+    each with either a "bug" or an "error" and its HTTP "status"; an item
+    whose fields have the wrong type gets a 400 of its own.
+    """
+    data = request.data if isinstance(request.data, dict) else {}
+    refs = data.get('bugs')
+    if not isinstance(refs, list) or not all(isinstance(ref, dict) for ref in refs):
+        return Response({'error': 'bugs must be a list of {"tracker": ..., "id": ...} objects'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(refs) > BATCH_MAX_BUGS:
+        return Response({'error': f'At most {BATCH_MAX_BUGS} bugs per request'}, status=status.HTTP_400_BAD_REQUEST)
+
+    results = []
+    pending = {}
+    deadline = time.monotonic() + BATCH_TIMEOUT
+    for ref in refs:
+        try:
+            tracker, bug_id, project, bugtype = batch_ref(ref)
+        except ValueError as e:
+            results.append({'tracker': ref.get('tracker'), 'id': ref.get('id'), 'error': str(e),
+                            'status': status.HTTP_400_BAD_REQUEST})
+            continue
+        result = {'tracker': tracker, 'id': bug_id, 'project': project, 'type': bugtype}
+        results.append(result)
+        try:
+            name = bug_cache_name(tracker, project, bugtype)
+        except (KeyError, ValueError) as e:
+            error, error_status = bug_name_error(e, tracker)
+            result.update(error=error, status=error_status)
+            continue
+        try:
+            cached = bug_cache.peek(name, bug_id, functools.partial(engine.get_bug, tracker, bug_id, project, bugtype))
+        except (NotFoundError, PrivateError) as e:
+            # Remembered as missing or private, no need to ask again
+            error, error_status = bug_error(e, tracker, bug_id)
+            result.update(error=error, status=error_status)
+            continue
+        if cached is not None:
+            result.update(bug=cached, status=status.HTTP_200_OK)
+        else:
+            pending[batch_executor.submit(batch_lookup, deadline, name, tracker, bug_id, project, bugtype)] = result
+
+    # Lookups still queued at the deadline are dropped, running ones give up on their own
+    done, not_done = concurrent.futures.wait(pending, timeout=max(deadline - time.monotonic(), 0))
+    found = []
+    for future, result in pending.items():
+        if future in not_done:
+            future.cancel()
+            result.update(error='The bug tracker did not answer in time', status=status.HTTP_504_GATEWAY_TIMEOUT)
+        elif future.exception() is not None:
+            error, error_status = bug_error(future.exception(), result['tracker'], result['id'])
+            result.update(error=error, status=error_status)
+        else:
+            result.update(bug=future.result(), status=status.HTTP_200_OK)
+    for result in results:
+        if 'bug' in result:
+            found.append(('bug', result['tracker'], result['id'], result['project'], result['type']))
+    for result in results:
+        result.pop('project', None)
+        result.pop('type', None)
+    prefetcher.record_many(found)
+    return Response({'results': results})
+
+# How the prefetch command re-fetches hot bugs for each route above
+prefetcher.register(
+    'launchpad_bug',
+    lambda bug_id: bug_cache.expires_in('launchpad', bug_id),
+    lambda bug_id: bug_cache.refresh('launchpad', bug_id, functools.partial(fetch_launchpad_bug, bug_id)))
+prefetcher.register(
+    'github_bug',
+    lambda owner, repo, bug_id: bug_cache.expires_in(f'github:{owner}/{repo}', bug_id),
+    lambda owner, repo, bug_id: bug_cache.refresh(f'github:{owner}/{repo}', bug_id,
+                                                  functools.partial(fetch_github_bug, owner, repo, bug_id)))
+prefetcher.register(
+    'bug',
+    lambda tracker, bug_id, project, bugtype: bug_cache.expires_in(bug_cache_name(tracker, project, bugtype), bug_id),
+    lambda tracker, bug_id, project, bugtype: bug_cache.refresh(
+        bug_cache_name(tracker, project, bugtype), bug_id,
+        functools.partial(engine.get_bug, tracker, bug_id, project, bugtype)))
+
+@api_view(['GET'])
+def upstream_stats(request):
+    # Upstream calls made and requests coalesced in this worker, and its outbound HTTP latency per host
+    return Response({**singleflight.stats(), 'http': http.stats(), 'github': github.stats(),
+                     'redis': redis_cache.stats(), 'launchpad_clients': launchpad_clients.stats(),
+                     'negative': {'bugs': bug_cache.negative.stats(), 'launchpad': negative_cache.stats()}})
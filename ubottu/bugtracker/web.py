@@ -0,0 +1,20 @@
+import html
+import re
+
+# Stand-ins for supybot's utils.web, which the classes in trackers.py were
+# written against. Requests go through the bug engine's shared HTTP session.
+
+def getUrl(url):
+    from .engine import current_engine
+    return current_engine().fetch_sync(url)
+
+def timeout():
+    """Seconds a request the shared session does not make, like a SOAP call, may take."""
+    from .engine import current_engine
+    return current_engine().client_timeout.total
+
+_tags = re.compile(r'<[^>]+>')
+
+def htmlToText(s, tagReplace=' '):
+    """Strip tags (replacing each with tagReplace) and resolve entities."""
+    return html.unescape(_tags.sub(tagReplace, s)).strip()
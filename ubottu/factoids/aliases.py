@@ -0,0 +1,138 @@
+import threading
+import time
+from django.conf import settings
+from django.db.models import Q
+from .models import Fact
+from .cache import fact_cache
+
+class AliasError(Exception):
+    """An alias chain could not be resolved"""
+    pass
+
+class AliasLoopError(AliasError):
+    """The alias chain points back at itself"""
+    pass
+
+class AliasDepthError(AliasError):
+    """The alias chain is longer than allowed"""
+    pass
+
+def alias_target(fact):
+    # ALIAS facts hold the name of the fact they point to
+    return fact.value.strip()
+
+class AliasGraph:
+    """
+    Per-process map of (alias name, room) -> target name.
+
+    Room-specific facts that are not aliases are kept too, mapped to None,
+    because they hide a global alias of the same name in their room. Every
+    hop is resolved like a fact lookup: the room's fact first, then the
+    global one.
+
+    The map is built from the database and then kept current one fact at
+    a time: local saves/deletes update it directly, changes reported by
+    other workers mark the fact dirty and it is re-read on the next lookup.
+    Those reports can be lost, so the whole map is also rebuilt every
+    timeout seconds and whenever the invalidation channel was lost.
+    """
+    def __init__(self, max_depth=8, timeout=300):
+        self.max_depth = max_depth
+        self.timeout = timeout
+        self._targets = {}
+        self._names = {}  # fact id -> (name, room)
+        self._dirty = set()
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        targets, names = {}, {}
+        facts = Fact.objects.filter(Q(ftype='ALIAS') | Q(room__isnull=False)).only('id', 'name', 'value', 'ftype', 'room')
+        for fact in facts:
+            key = (fact.name, fact.room or None)
+            targets[key] = alias_target(fact) if fact.ftype == 'ALIAS' else None
+            names[fact.id] = key
+        with self._lock:
+            self._targets, self._names = targets, names
+            self._dirty.clear()
+            self._loaded_at = time.monotonic()
+
+    def clear(self):
+        with self._lock:
+            self._targets, self._names = {}, {}
+            self._dirty.clear()
+            self._loaded_at = None
+
+    def update(self, fact):
+        with self._lock:
+            self._remove(fact.id)
+            key = (fact.name, fact.room or None)
+            if fact.ftype == 'ALIAS' or key[1] is not None:
+                self._targets[key] = alias_target(fact) if fact.ftype == 'ALIAS' else None
+                self._names[fact.id] = key
+
+    def remove(self, fact_id):
+        with self._lock:
+            self._remove(fact_id)
+
+    def mark_dirty(self, name, fact_id):
+        with self._lock:
+            if fact_id is not None:
+                self._dirty.add(fact_id)
+            elif name is None:
+                # Changes may have been missed, rebuild on the next lookup
+                self._loaded_at = None
+
+    def _remove(self, fact_id):
+        key = self._names.pop(fact_id, None)
+        if key is not None:
+            self._targets.pop(key, None)
+
+    def _refresh(self):
+        loaded_at = self._loaded_at
+        if loaded_at is None or time.monotonic() - loaded_at > self.timeout:
+            self.load()
+            return
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        if not dirty:
+            return
+        facts = {fact.id: fact for fact in Fact.objects.filter(id__in=dirty).only('id', 'name', 'value', 'ftype', 'room')}
+        for fact_id in dirty:
+            if fact_id in facts:
+                self.update(facts[fact_id])
+            else:
+                self.remove(fact_id)
+
+    def _target(self, name, room):
+        # What name points to as seen from room, None when it is not an alias there
+        if room is not None and (name, room) in self._targets:
+            return self._targets[(name, room)]
+        return self._targets.get((name, None))
+
+    def resolve(self, name, room=None):
+        """
+        Follow the aliases starting at name, as seen from room.
+
+        Returns the list of names walked, ending with the fact that is not an
+        alias. Raises AliasLoopError on cycles and AliasDepthError when the
+        chain is longer than max_depth.
+        """
+        self._refresh()
+        chain = [name]
+        with self._lock:
+            while (target := self._target(name, room)) is not None:
+                name = target
+                if name in chain:
+                    raise AliasLoopError(f"Alias loop: {' -> '.join(chain + [name])}")
+                chain.append(name)
+                if len(chain) > self.max_depth + 1:
+                    raise AliasDepthError(f"Alias chain longer than {self.max_depth}: {' -> '.join(chain)}")
+        return chain
+
+
+alias_graph = AliasGraph(
+    max_depth=getattr(settings, 'FACTOID_ALIAS_MAX_DEPTH', 8),
+    timeout=getattr(settings, 'FACTOID_ALIAS_RELOAD_INTERVAL', 300),
+)
+fact_cache.subscribe(alias_graph.mark_dirty)
@@ -3,4 +3,8 @@ from django.apps import AppConfig
 
 class FactoidsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'factoids'
\ No newline at end of file
+    name = 'factoids'
+
+    def ready(self):
+        # Hook up cache invalidation for Fact changes
+        from . import signals
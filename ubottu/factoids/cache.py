@@ -0,0 +1,186 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.db.models import F, Q
+from launchpad.utils import cache as redis_cache
+from .models import Fact
+
+# Channel used to tell the other uWSGI workers that a fact changed
+INVALIDATION_CHANNEL = 'factoids:invalidate'
+# Seconds between attempts to subscribe to it while Redis is unreachable
+LISTENER_RETRY = 30
+
+class FactCache:
+    """
+    Per-process cache of Fact rows keyed by (name, room).
+
+    Entries are dropped by the post_save/post_delete signals of Fact, which
+    also publish the change on a Redis channel so every worker drops it too.
+    The timeout only bounds staleness when that channel is unavailable. A
+    listener that loses its connection drops every entry, since changes
+    may have been missed, and is subscribed again on a later lookup.
+    """
+    def __init__(self, max_entries=1024, timeout=300):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._listener = None
+        self._listener_pid = None
+        self._listener_retry_at = 0
+        self._subscribers = []
+        # Bumped by every invalidation, a load that raced with one is not cached
+        self._generation = 0
+
+    def get(self, name, room=None):
+        """Return the Fact for name/room, raising Fact.DoesNotExist if there is none."""
+        facts = self.get_many([name], room)
+        if name not in facts:
+            raise Fact.DoesNotExist(f"Fact {name} not found")
+        return facts[name]
+
+    def get_many(self, names, room=None):
+        """Return {name: Fact} for the names that exist, loading all misses in one query."""
+        self._ensure_listener()
+        now = time.monotonic()
+        found, missing = {}, []
+        with self._lock:
+            generation = self._generation
+            for name in names:
+                entry = self._entries.get((name, room))
+                if entry is not None and entry[1] > now:
+                    self._entries.move_to_end((name, room))
+                    self.hits += 1
+                    found[name] = entry[0]
+                else:
+                    self.misses += 1
+                    missing.append(name)
+        if not missing:
+            return found
+
+        loaded = self.load_many(missing, room)
+        with self._lock:
+            if generation != self._generation:
+                # Something changed while we read, what we got may already be stale
+                found.update(loaded)
+                return found
+            for name, fact in loaded.items():
+                self._entries[(name, room)] = (fact, now + self.timeout)
+                self._entries.move_to_end((name, room))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        found.update(loaded)
+        return found
+
+    def load_many(self, names, room=None):
+        """
+        Load the most specific fact for each name in one query: the room's
+        own fact if there is one, otherwise the global fact.
+        """
+        # The author is joined in so serializing a cached fact needs no query
+        facts = Fact.objects.select_related('author').filter(name__in=names)
+        if room:
+            facts = facts.filter(Q(room=room) | Q(room__isnull=True)).order_by('name', F('room').asc(nulls_last=True))
+        else:
+            # Without a room only global facts apply, never another room's
+            facts = facts.filter(room__isnull=True)
+        best = {}
+        for fact in facts:
+            best.setdefault(fact.name, fact)
+        return best
+
+    def invalidate(self, name=None, fact_id=None):
+        """Drop every entry for a name (in any room) or holding the given fact id."""
+        with self._lock:
+            self._generation += 1
+            for key, (fact, expires) in list(self._entries.items()):
+                if key[0] == name or (fact_id is not None and fact.id == fact_id):
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
+
+    def subscribe(self, callback):
+        """Call callback(name, fact_id) whenever another worker reports a change."""
+        self._subscribers.append(callback)
+
+    def publish(self, name, fact_id=None):
+        """Tell the other workers to drop name/fact_id from their caches."""
+        try:
+            redis_cache.publish(INVALIDATION_CHANNEL, json.dumps({'name': name, 'id': fact_id, 'pid': os.getpid()}))
+        except Exception as e:
+            print(f"Could not publish factoid invalidation for {name}: {e}")
+
+    def _on_message(self, message):
+        try:
+            data = json.loads(message['data'])
+        except (TypeError, ValueError):
+            return
+        if data.get('pid') == os.getpid():
+            return
+        self.invalidate(data.get('name'), data.get('id'))
+        for callback in self._subscribers:
+            callback(data.get('name'), data.get('id'))
+
+    def _on_listener_error(self, error, pubsub, thread):
+        # Without this the listener thread dies on the first connection error
+        # and invalidations silently stop. Messages sent while disconnected
+        # are lost, so everything cached may be stale; the next lookup
+        # subscribes again.
+        print(f"Lost the factoid invalidation channel, dropping cached facts: {error}")
+        thread.stop()
+        with self._lock:
+            self._listener = None
+            self._listener_pid = None
+            self._listener_retry_at = time.monotonic() + LISTENER_RETRY
+            self._generation += 1
+            self._entries.clear()
+        for callback in self._subscribers:
+            callback(None, None)
+
+    def _ensure_listener(self):
+        # uWSGI forks workers after import, so the listener thread is started
+        # lazily and restarted whenever we find ourselves in a new process,
+        # or after it lost its connection.
+        if self._listener_pid == os.getpid() or time.monotonic() < self._listener_retry_at:
+            return
+        with self._lock:
+            if self._listener_pid == os.getpid() or time.monotonic() < self._listener_retry_at:
+                return
+            if self._listener_pid is not None:
+                # Inherited from the parent, its thread did not survive the fork
+                self._entries.clear()
+            try:
+                pubsub = redis_cache.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(**{INVALIDATION_CHANNEL: self._on_message})
+                self._listener = pubsub.run_in_thread(sleep_time=1, daemon=True,
+                                                      exception_handler=self._on_listener_error)
+                self._listener_pid = os.getpid()
+            except Exception as e:
+                self._listener = None
+                self._listener_retry_at = time.monotonic() + LISTENER_RETRY
+                print(f"Could not subscribe to factoid invalidations, relying on timeout: {e}")
+
+fact_cache = FactCache(
+    max_entries=getattr(settings, 'FACTOID_CACHE_MAX_ENTRIES', 1024),
+    timeout=getattr(settings, 'FACTOID_CACHE_TIMEOUT', 300),
+)
@@ -0,0 +1,170 @@
+import bisect
+import difflib
+import mmap
+import os
+import struct
+import threading
+import unicodedata
+
+MAGIC = b'UBGZ'
+VERSION = 1
+HEADER = struct.Struct('<4sHI')    # magic, version, entry count
+ENTRY = struct.Struct('<I')        # offset of the entry's key in the file
+COORDS = struct.Struct('<ddI')     # latitude, longitude, population
+
+# GeoNames cities*.txt columns we use
+GEONAMES_NAME = 1
+GEONAMES_ASCIINAME = 2
+GEONAMES_LATITUDE = 4
+GEONAMES_LONGITUDE = 5
+GEONAMES_COUNTRY = 8
+GEONAMES_POPULATION = 14
+GEONAMES_TIMEZONE = 17
+
+def normalize_city(name):
+    # 'New  York', 'new york' and 'NEW YORK' are the same place
+    return ' '.join(unicodedata.normalize('NFKC', name).casefold().split())
+
+def read_geonames(lines):
+    """Yield (keys, location, latitude, longitude, population, timezone) for each GeoNames row."""
+    for line in lines:
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) <= GEONAMES_TIMEZONE or not fields[GEONAMES_TIMEZONE]:
+            continue
+        name = fields[GEONAMES_NAME]
+        country = fields[GEONAMES_COUNTRY]
+        keys = {name, fields[GEONAMES_ASCIINAME], f'{name}, {country}', f'{name} {country}'}
+        yield (keys, f'{name}, {country}', float(fields[GEONAMES_LATITUDE]), float(fields[GEONAMES_LONGITUDE]),
+               int(fields[GEONAMES_POPULATION] or 0), fields[GEONAMES_TIMEZONE])
+
+def build(places, path):
+    """
+    Write a gazetteer index to path from (keys, location, latitude, longitude, population, timezone) tuples.
+
+    When several places share a name the most populous one wins. Returns
+    the number of names written.
+    """
+    best = {}
+    for keys, location, latitude, longitude, population, timezone in places:
+        for key in keys:
+            key = normalize_city(key)
+            if key and (key not in best or population > best[key][3]):
+                best[key] = (location, latitude, longitude, population, timezone)
+
+    keys = sorted(best)
+    data = bytearray()
+    offsets = []
+    data_start = HEADER.size + ENTRY.size * len(keys)
+    for key in keys:
+        location, latitude, longitude, population, timezone = best[key]
+        offsets.append(data_start + len(data))
+        data += key.encode('utf-8') + b'\0'
+        data += COORDS.pack(latitude, longitude, population)
+        data += location.encode('utf-8') + b'\0' + timezone.encode('utf-8') + b'\0'
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as index:
+        index.write(HEADER.pack(MAGIC, VERSION, len(keys)))
+        for offset in offsets:
+            index.write(ENTRY.pack(offset))
+        index.write(data)
+    os.replace(tmp_path, path)
+    return len(keys)
+
+class _Keys:
+    """Sequence view of the sorted keys in the index, for bisect"""
+    def __init__(self, gazetteer):
+        self.gazetteer = gazetteer
+
+    def __len__(self):
+        return self.gazetteer.count
+
+    def __getitem__(self, i):
+        return self.gazetteer.key_at(i)
+
+class Gazetteer:
+    """
+    Memory-mapped, sorted index of place name -> (location, latitude, longitude, timezone).
+
+    Lookups are a binary search over the mapped file, so the index costs no
+    heap memory and the pages are shared between uWSGI workers.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as index:
+            self.mmap = mmap.mmap(index.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count = HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not a gazetteer index (version {VERSION})')
+        self.keys = _Keys(self)
+
+    def _offset(self, i):
+        return ENTRY.unpack_from(self.mmap, HEADER.size + ENTRY.size * i)[0]
+
+    def _string_at(self, offset):
+        end = self.mmap.find(b'\0', offset)
+        return self.mmap[offset:end].decode('utf-8'), end + 1
+
+    def key_at(self, i):
+        return self._string_at(self._offset(i))[0]
+
+    def record_at(self, i):
+        """Return (key, location, latitude, longitude, population, timezone) of entry i."""
+        key, offset = self._string_at(self._offset(i))
+        latitude, longitude, population = COORDS.unpack_from(self.mmap, offset)
+        location, offset = self._string_at(offset + COORDS.size)
+        timezone, offset = self._string_at(offset)
+        return (key, location, latitude, longitude, population, timezone)
+
+    def lookup(self, name):
+        """Exact match on the normalized name, (location, latitude, longitude, timezone) or None."""
+        key = normalize_city(name)
+        i = bisect.bisect_left(self.keys, key)
+        if i < self.count and self.key_at(i) == key:
+            return self._place(self.record_at(i))
+        return None
+
+    def _place(self, record):
+        key, location, latitude, longitude, population, timezone = record
+        return (location, latitude, longitude, timezone)
+
+    def prefix(self, name, limit=50):
+        """The most populous place whose name starts with name, looking at up to limit candidates."""
+        key = normalize_city(name)
+        if not key:
+            return None
+        best = None
+        i = bisect.bisect_left(self.keys, key)
+        for i in range(i, min(i + limit, self.count)):
+            record = self.record_at(i)
+            if not record[0].startswith(key):
+                break
+            if best is None or record[4] > best[4]:
+                best = record
+        return self._place(best) if best else None
+
+    def fuzzy(self, name, cutoff=0.8):
+        """Closest spelling among names sharing the first two letters, for typos."""
+        key = normalize_city(name)
+        if len(key) < 3:
+            return None
+        start = bisect.bisect_left(self.keys, key[:2])
+        end = bisect.bisect_left(self.keys, key[:2] + '\uffff', lo=start)
+        candidates = [self.key_at(i) for i in range(start, end)]
+        matches = difflib.get_close_matches(key, candidates, n=1, cutoff=cutoff)
+        return self.lookup(matches[0]) if matches else None
+
+    def search(self, name):
+        return self.lookup(name) or self.prefix(name) or self.fuzzy(name)
+
+
+_gazetteer = None
+_gazetteer_lock = threading.Lock()
+
+def get_gazetteer(path):
+    """Return the process wide Gazetteer for path, or None if no index has been built."""
+    global _gazetteer
+    if _gazetteer is None and path and os.path.exists(path):
+        with _gazetteer_lock:
+            if _gazetteer is None:
+                _gazetteer = Gazetteer(path)
+    return _gazetteer
@@ -0,0 +1,212 @@
+import json
+import threading
+from collections import namedtuple
+from django.conf import settings
+from django.utils.module_loading import import_string
+from geopy.geocoders import Nominatim
+from timezonefinder import TimezoneFinder
+from launchpad.utils import cache as redis_cache, async_cache
+from launchpad import aio
+from .gazetteer import get_gazetteer, normalize_city
+
+# A resolved place: the geocoder's address line, coordinates and timezone name,
+# approximate when it is the gazetteer's guess for a name nothing matched exactly
+Place = namedtuple('Place', ['location', 'latitude', 'longitude', 'timezone', 'approximate'], defaults=(False,))
+
+class Geocoder:
+    """Turns a free form place name into (location, latitude, longitude), or None if unknown."""
+    def geocode(self, query):
+        raise NotImplementedError
+
+    async def ageocode(self, query):
+        # Geocoders without an async client run in the blocking pool
+        return await aio.run_blocking(self.geocode, query)
+
+class NominatimGeocoder(Geocoder):
+    SEARCH_URL = 'https://nominatim.openstreetmap.org/search'
+
+    def __init__(self, user_agent='Ubottu', timeout=10):
+        self.user_agent = user_agent
+        self.geolocator = Nominatim(user_agent=user_agent, timeout=timeout)
+
+    def geocode(self, query):
+        location = self.geolocator.geocode(query, exactly_one=True, language='en')
+        if location is None:
+            return None
+        return (str(location), location.latitude, location.longitude)
+
+    async def ageocode(self, query):
+        # The same search geopy makes, over the async views' aiohttp session
+        params = {'q': query, 'format': 'json', 'limit': 1, 'accept-language': 'en'}
+        response = await aio.get(self.SEARCH_URL, params=params, headers={'User-Agent': self.user_agent})
+        response.raise_for_status()
+        results = response.json()
+        if not results:
+            return None
+        return (results[0]['display_name'], float(results[0]['lat']), float(results[0]['lon']))
+
+class StubGeocoder(Geocoder):
+    """Answers from a fixed {name: (location, latitude, longitude)} table, for tests and offline use."""
+    def __init__(self, places=None):
+        self.places = {normalize_city(name): place for name, place in (places or {}).items()}
+        self.queries = []
+
+    def geocode(self, query):
+        self.queries.append(query)
+        return self.places.get(normalize_city(query))
+
+_timezone_finder = None
+_timezone_finder_lock = threading.Lock()
+
+def get_timezone_finder():
+    """Return the process wide TimezoneFinder, loading its polygon data on first use."""
+    global _timezone_finder
+    if _timezone_finder is None:
+        with _timezone_finder_lock:
+            if _timezone_finder is None:
+                _timezone_finder = TimezoneFinder(in_memory=True)
+    return _timezone_finder
+
+class CityResolver:
+    """
+    Resolves city names to a Place.
+
+    Names found in the local gazetteer index are answered without any
+    network access. Everything else goes to the geocoder, whose results are
+    cached in Redis under the normalized name; places that could not be
+    found are cached for a shorter time so repeated typos don't go to the
+    geocoder either. When the geocoder has no answer (or fails) the
+    gazetteer's prefix and fuzzy matches are tried as a last resort; such
+    a guess is marked approximate and cached for approximate_timeout only.
+    """
+    def __init__(self, geocoder, timeout=30 * 24 * 3600, negative_timeout=24 * 3600, approximate_timeout=3600,
+                 gazetteer_path=None):
+        self.geocoder = geocoder
+        self.timeout = timeout
+        self.negative_timeout = negative_timeout
+        self.approximate_timeout = approximate_timeout
+        self.gazetteer_path = gazetteer_path
+
+    def cache_key(self, name):
+        return f"city_{normalize_city(name)}"
+
+    def resolve(self, name):
+        found, place = self.cached(name)
+        if found:
+            return place
+        try:
+            place = self.lookup(name)
+        except Exception as e:
+            return self.geocoder_failed(name, e)
+        return self.store(name, place)
+
+    async def aresolve(self, name):
+        """resolve() for async views: the geocoder and the cache are awaited."""
+        place = self.from_gazetteer(name)
+        if place is not None:
+            return place
+        try:
+            cached_result = await async_cache.get(self.cache_key(name))
+        except Exception as e:
+            print(f"Could not read city cache for {name}: {e}")
+            cached_result = None
+        found, place = self.decode(cached_result)
+        if found:
+            return place
+        try:
+            place = await self.alookup(name)
+        except Exception as e:
+            return self.geocoder_failed(name, e)
+        place, timeout = self.cache_entry(name, place)
+        try:
+            await async_cache.setex(self.cache_key(name), timeout, json.dumps(place))
+        except Exception as e:
+            print(f"Could not write city cache for {name}: {e}")
+        return place
+
+    def cached(self, name):
+        """Return (True, place) when the gazetteer or the cache knows name, place being None for known misses."""
+        place = self.from_gazetteer(name)
+        if place is not None:
+            return True, place
+        try:
+            cached_result = redis_cache.get(self.cache_key(name))
+        except Exception as e:
+            print(f"Could not read city cache for {name}: {e}")
+            cached_result = None
+        return self.decode(cached_result)
+
+    def from_gazetteer(self, name):
+        gazetteer = get_gazetteer(self.gazetteer_path)
+        if gazetteer is not None:
+            place = gazetteer.lookup(name)
+            if place is not None:
+                return Place(*place)
+        return None
+
+    def decode(self, cached_result):
+        if cached_result:
+            try:
+                cached_result = json.loads(cached_result)
+                return True, Place(*cached_result) if cached_result else None
+            except (TypeError, ValueError) as e:
+                # Unreadable, treated as a miss and overwritten
+                print(f"Could not decode city cache entry: {e}")
+        return False, None
+
+    def store(self, name, place):
+        """Cache the geocoder's answer, or the gazetteer's best guess when it had none, and return it."""
+        place, timeout = self.cache_entry(name, place)
+        try:
+            redis_cache.setex(self.cache_key(name), timeout, json.dumps(place))
+        except Exception as e:
+            print(f"Could not write city cache for {name}: {e}")
+        return place
+
+    def cache_entry(self, name, place):
+        """The place to cache for name and for how long: misses get the gazetteer's guess or a short negative entry."""
+        gazetteer = get_gazetteer(self.gazetteer_path)
+        if place is None and gazetteer is not None:
+            place = self.approximate(gazetteer, name)
+        if place is None:
+            return place, self.negative_timeout
+        return place, self.approximate_timeout if place.approximate else self.timeout
+
+    def geocoder_failed(self, name, error):
+        gazetteer = get_gazetteer(self.gazetteer_path)
+        if gazetteer is None:
+            raise error
+        print(f"Geocoder failed for {name}, using the gazetteer: {error}")
+        return self.approximate(gazetteer, name)
+
+    def approximate(self, gazetteer, name):
+        place = gazetteer.prefix(name) or gazetteer.fuzzy(name)
+        return Place(*place, approximate=True) if place else None
+
+    def lookup(self, name):
+        return self.place(self.geocoder.geocode(name))
+
+    async def alookup(self, name):
+        # Finding the timezone is CPU bound, it runs in the blocking pool
+        return await aio.run_blocking(self.place, await self.geocoder.ageocode(name))
+
+    def place(self, result):
+        if result is None:
+            return None
+        location, latitude, longitude = result
+        # timezone is None for places outside any timezone polygon
+        timezone_name = get_timezone_finder().timezone_at(lat=latitude, lng=longitude)
+        return Place(location, latitude, longitude, timezone_name)
+
+
+def get_geocoder():
+    geocoder = getattr(settings, 'CITYTIME_GEOCODER', 'factoids.geo.NominatimGeocoder')
+    return import_string(geocoder)() if isinstance(geocoder, str) else geocoder
+
+city_resolver = CityResolver(
+    get_geocoder(),
+    timeout=getattr(settings, 'CITYTIME_CACHE_TIMEOUT', 30 * 24 * 3600),
+    negative_timeout=getattr(settings, 'CITYTIME_NEGATIVE_CACHE_TIMEOUT', 24 * 3600),
+    approximate_timeout=getattr(settings, 'CITYTIME_APPROXIMATE_CACHE_TIMEOUT', 3600),
+    gazetteer_path=getattr(settings, 'CITYTIME_GAZETTEER', None),
+)
@@ -0,0 +1,43 @@
+import io
+import tempfile
+import zipfile
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from factoids import gazetteer
+from launchpad.http_client import http
+
+GEONAMES_CITIES = 'https://download.geonames.org/export/dump/cities15000.zip'
+
+class Command(BaseCommand):
+    help = 'Build the offline gazetteer used by the city time API from a GeoNames cities dump'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', nargs='?', default=GEONAMES_CITIES,
+                            help='GeoNames cities*.txt or .zip, as a path or URL (default: %(default)s)')
+        parser.add_argument('--output', default=getattr(settings, 'CITYTIME_GAZETTEER', None),
+                            help='Where to write the index (default: CITYTIME_GAZETTEER)')
+
+    def handle(self, *args, **options):
+        if not options['output']:
+            raise CommandError('No --output given and CITYTIME_GAZETTEER is not set')
+        with self.open_source(options['source']) as lines:
+            count = gazetteer.build(gazetteer.read_geonames(lines), options['output'])
+        self.stdout.write(f"Wrote {count} place names to {options['output']}")
+
+    def open_source(self, source):
+        if source.startswith(('http://', 'https://')):
+            response = http.get(source, timeout=(http.connect_timeout, 60))
+            response.raise_for_status()
+            data = tempfile.TemporaryFile()
+            data.write(response.content)
+            data.seek(0)
+        else:
+            data = open(source, 'rb')
+        if zipfile.is_zipfile(data):
+            archive = zipfile.ZipFile(data)
+            member = next((name for name in archive.namelist() if name.endswith('.txt')), None)
+            if member is None:
+                raise CommandError(f'{source} has no .txt file in it')
+            return io.TextIOWrapper(archive.open(member), encoding='utf-8')
+        data.seek(0)
+        return io.TextIOWrapper(data, encoding='utf-8')
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from factoids.popularity import popularity
+
+class Command(BaseCommand):
+    help = 'Write buffered factoid popularity increments to the database'
+
+    def handle(self, *args, **options):
+        pending = popularity.pending()
+        updated = popularity.flush()
+        self.stdout.write(f"Flushed {sum(pending.values())} increments, updated {updated} factoids")
@@ -0,0 +1,24 @@
+# Generated by Django 5.1 on 2026-10-18 15:29
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('factoids', '0003_author_fact_room_alter_fact_author_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='fact',
+            name='room',
+            field=models.CharField(blank=True, default=None, max_length=128, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='fact',
+            index=models.Index(fields=['name', 'room'], name='factoids_fact_name_room_idx'),
+        ),
+    ]
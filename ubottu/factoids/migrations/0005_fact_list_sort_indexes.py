@@ -0,0 +1,23 @@
+# Generated by Django 5.1 on 2026-10-18 15:29
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('factoids', '0004_fact_name_room_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='fact',
+            index=models.Index(fields=['-popularity', 'name'], name='factoids_fact_popularity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fact',
+            index=models.Index(fields=['ftype', 'name'], name='factoids_fact_ftype_name_idx'),
+        ),
+    ]
@@ -28,8 +28,28 @@ class Fact(models.Model):
     create_date = models.DateTimeField("date published", default=timezone.now)
     change_date = models.DateTimeField("date changed", default=timezone.now)
     popularity = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Room-aware lookups: WHERE name = ... AND (room = ... OR room IS NULL)
+            models.Index(fields=['name', 'room'], name='factoids_fact_name_room_idx'),
+            # Orderings offered by the facts list
+            models.Index(fields=['-popularity', 'name'], name='factoids_fact_popularity_idx'),
+            models.Index(fields=['ftype', 'name'], name='factoids_fact_ftype_name_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # Keep change_date current so clients can sync only what changed
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            self.change_date = timezone.now()
+        elif set(update_fields) != {'popularity'}:
+            self.change_date = timezone.now()
+            kwargs['update_fields'] = set(update_fields) | {'change_date'}
+        super().save(*args, **kwargs)
+
     def was_published_recently(self):
         return self.create_date >= timezone.now() - datetime.timedelta(days=7)
@@ -0,0 +1,91 @@
+import re
+import threading
+from collections import OrderedDict
+
+LAUNCHPAD_GROUP_PATTERN = re.compile(r'\{launchpad_group\.([^}]+)\}')
+MENTIONS_SUFFIX = '.mentions'
+
+class GroupPlaceholder:
+    """A {launchpad_group.X} or {launchpad_group.X.mentions} placeholder"""
+    __slots__ = ('text', 'group', 'mentions_only')
+
+    def __init__(self, text, name):
+        self.text = text
+        self.mentions_only = name.endswith(MENTIONS_SUFFIX)
+        self.group = name[:-len(MENTIONS_SUFFIX)] if self.mentions_only else name
+
+class Template:
+    """
+    A factoid value split into literal text and placeholders.
+
+    {launchpad_group.X} is replaced by the Matrix IDs of the group members,
+    {launchpad_group.X.mentions} is dropped from the text but still adds the
+    members to the user ids to mention.
+    """
+    def __init__(self, value):
+        self.tokens = []
+        self.groups = []
+        position = 0
+        for match in LAUNCHPAD_GROUP_PATTERN.finditer(value):
+            if match.start() > position:
+                self.tokens.append(value[position:match.start()])
+            placeholder = GroupPlaceholder(match.group(0), match.group(1))
+            self.tokens.append(placeholder)
+            if placeholder.group not in self.groups:
+                self.groups.append(placeholder.group)
+            position = match.end()
+        if position < len(value):
+            self.tokens.append(value[position:])
+
+    def render(self, members):
+        """Fill in the placeholders from members, a {group name: fetch_group_members() result} dict."""
+        parts = []
+        for token in self.tokens:
+            if isinstance(token, str):
+                parts.append(token)
+            elif token.mentions_only:
+                continue
+            elif isinstance(members.get(token.group), dict):
+                parts.append(' '.join(members[token.group].get('mxids', [])))
+            else:
+                # Leave the placeholder alone if the group could not be fetched
+                parts.append(token.text)
+        return ''.join(parts)
+
+    def user_ids(self, members):
+        # In order of first appearance, each once even if a group lists it twice
+        mxids = {}
+        for group in self.groups:
+            if isinstance(members.get(group), dict):
+                mxids.update(dict.fromkeys(members[group].get('mxids', [])))
+        return list(mxids)
+
+class TemplateCache:
+    """Parsed templates keyed by fact id, reparsed when the fact's change_date moves."""
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, fact):
+        if fact.id is None:
+            return Template(fact.value)
+        with self._lock:
+            entry = self._entries.get(fact.id)
+            if entry is not None and entry[0] == fact.change_date:
+                self._entries.move_to_end(fact.id)
+                return entry[1]
+        template = Template(fact.value)
+        with self._lock:
+            self._entries[fact.id] = (fact.change_date, template)
+            self._entries.move_to_end(fact.id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return template
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+templates = TemplateCache()
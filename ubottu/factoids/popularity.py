@@ -0,0 +1,130 @@
+import atexit
+import os
+import threading
+from collections import Counter
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from launchpad.utils import cache as redis_cache
+from .models import Fact
+
+PENDING_KEY = 'factoids:popularity'
+FLUSHING_KEY = 'factoids:popularity:flushing'
+LOCK_KEY = 'factoids:popularity:lock'
+
+class PopularityCounter:
+    """
+    Accumulates factoid popularity increments and applies them in bulk.
+
+    Increments go into a Redis hash (fact id -> count) so they survive a
+    worker restart; if Redis is unreachable they are kept in memory instead.
+    flush() turns everything pending into one UPDATE per factoid.
+    """
+    def __init__(self, interval=60):
+        self.interval = interval
+        self._local = Counter()
+        self._lock = threading.Lock()
+        self._thread_pid = None
+
+    def record(self, fact_id, count=1):
+        self.record_many({fact_id: count})
+
+    def record_many(self, counts):
+        """Add several increments at once, e.g. {fact_id: count}."""
+        counts = {fact_id: count for fact_id, count in counts.items() if count}
+        if not counts:
+            return
+        self._ensure_thread()
+        try:
+            pipe = redis_cache.pipeline()
+            for fact_id, count in counts.items():
+                pipe.hincrby(PENDING_KEY, fact_id, count)
+            pipe.execute()
+        except Exception as e:
+            print(f"Could not buffer popularity in Redis, keeping it in memory: {e}")
+            with self._lock:
+                self._local.update(counts)
+
+    def pending(self):
+        """Return the increments that have not been written to the database yet."""
+        with self._lock:
+            counts = Counter(self._local)
+        try:
+            for key in (FLUSHING_KEY, PENDING_KEY):
+                for fact_id, count in redis_cache.hgetall(key).items():
+                    counts[int(fact_id)] += int(count)
+        except Exception as e:
+            print(f"Could not read buffered popularity from Redis: {e}")
+        return counts
+
+    def flush(self):
+        """Write all pending increments to the database, returning how many rows were updated."""
+        with self._lock:
+            counts = self._local
+            self._local = Counter()
+        try:
+            updated = self._apply(counts)
+        except Exception:
+            with self._lock:
+                self._local.update(counts)
+            raise
+        try:
+            updated += self._flush_redis()
+        except Exception as e:
+            print(f"Could not flush buffered popularity from Redis: {e}")
+        return updated
+
+    def _flush_redis(self):
+        lock = redis_cache.lock(LOCK_KEY, timeout=max(self.interval, 60))
+        if not lock.acquire(blocking=False):
+            # Another worker is flushing right now
+            return 0
+        try:
+            updated = 0
+            # A leftover flushing hash means a previous flush died half way,
+            # apply that one first instead of renaming over it.
+            while redis_cache.exists(FLUSHING_KEY) or (redis_cache.exists(PENDING_KEY) and redis_cache.renamenx(PENDING_KEY, FLUSHING_KEY)):
+                counts = Counter({int(fact_id): int(count) for fact_id, count in redis_cache.hgetall(FLUSHING_KEY).items()})
+                updated += self._apply(counts)
+                redis_cache.delete(FLUSHING_KEY)
+            return updated
+        finally:
+            lock.release()
+
+    def _apply(self, counts):
+        updated = 0
+        with transaction.atomic():
+            for fact_id, count in counts.items():
+                if count:
+                    updated += Fact.objects.filter(id=fact_id).update(popularity=F('popularity') + count)
+        return updated
+
+    def _run(self):
+        event = threading.Event()
+        while not event.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing factoid popularity: {e}")
+
+    def _ensure_thread(self):
+        # Started lazily so it runs in the forked uWSGI worker, not the master
+        if not self.interval or self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread_pid == os.getpid():
+                return
+            self._thread_pid = os.getpid()
+            threading.Thread(target=self._run, name='popularity-flush', daemon=True).start()
+
+
+popularity = PopularityCounter(interval=getattr(settings, 'FACTOID_POPULARITY_FLUSH_INTERVAL', 60))
+
+@atexit.register
+def _flush_local():
+    # In-memory increments would be lost on shutdown, try to write them out
+    if popularity._local:
+        try:
+            popularity.flush()
+        except Exception as e:
+            print(f"Could not flush factoid popularity on exit: {e}")
@@ -1,8 +1,15 @@
-import re
-import json
 from rest_framework import serializers
 from .models import Fact
-from launchpad.utils import fetch_group_members
+from .placeholders import templates
+from launchpad.utils import fetch_many_group_members
+
+class FactListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        # Resolve every group used by the batch with one cache round trip
+        facts = list(data.all() if hasattr(data, 'all') else data)
+        groups = [group for fact in facts for group in templates.get(fact).groups]
+        self.context.setdefault('group_members', {}).update(fetch_many_group_members(groups))
+        return super().to_representation(facts)
 
 class FactSerializer(serializers.ModelSerializer):
     author_name = serializers.SerializerMethodField()
@@ -11,40 +18,28 @@ class FactSerializer(serializers.ModelSerializer):
     class Meta:
         model = Fact
         fields = ['id', 'name', 'user_ids', 'value', 'ftype', 'room', 'author_name', 'create_date', 'change_date', 'popularity']
+        list_serializer_class = FactListSerializer
 
     def get_author_name(self, obj):
         # Assuming the author field can be null
         return obj.author.username if obj.author else None
 
+    def get_group_members(self, template):
+        # Shared between fields and facts of one serialization through the context
+        members = self.context.setdefault('group_members', {})
+        missing = [group for group in template.groups if group not in members]
+        if missing:
+            members.update(fetch_many_group_members(missing))
+        return members
+
     def get_value(self, obj):
-        value = obj.value  # The original text with placeholders
-        launchpad_group_pattern = r'\{launchpad_group\.([^}]+)\}'
-        matches = re.findall(launchpad_group_pattern, obj.value)
-        if not matches:
-            return value
-        group_name = matches[0]
-        if group_name.endswith('.mentions'):
-            return value.replace('{launchpad_group.' + group_name + '}', '')
-        members = fetch_group_members(group_name)
-        if not isinstance(members, dict):
-            return value
-        if 'mxids' in members:
-            return value.replace( '{launchpad_group.' + group_name + '}', ' '.join(members['mxids']))
-        return False
-    
+        template = templates.get(obj)
+        if not template.groups:
+            return obj.value
+        return template.render(self.get_group_members(template))
 
     def get_user_ids(self, obj):
-        value = obj.value.replace('.mentions', '')
-        launchpad_group_pattern = r'\{launchpad_group\.([^}]+)\}'
-        matches = re.findall(launchpad_group_pattern, value)
-        if not matches:
+        template = templates.get(obj)
+        if not template.groups:
             return {}
-        group_name = matches[0]
-        members = fetch_group_members(group_name)
-        if not members:
-            return {}
-        if 'mxids' in members:
-            return members['mxids']
-
-        return {}
-            
+        return template.user_ids(self.get_group_members(template)) or {}
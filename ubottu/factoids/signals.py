@@ -0,0 +1,22 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Fact
+from .cache import fact_cache
+from .aliases import alias_graph
+
+@receiver(post_save, sender=Fact)
+@receiver(post_delete, sender=Fact)
+def invalidate_fact(sender, instance, update_fields=None, **kwargs):
+    # Popularity bumps don't change what we serve from the cache
+    if update_fields is not None and set(update_fields) == {'popularity'}:
+        return
+    fact_cache.invalidate(instance.name, instance.id)
+    fact_cache.publish(instance.name, instance.id)
+
+@receiver(post_save, sender=Fact)
+def update_alias(sender, instance, **kwargs):
+    alias_graph.update(instance)
+
+@receiver(post_delete, sender=Fact)
+def remove_alias(sender, instance, **kwargs):
+    alias_graph.remove(instance.id)
@@ -1,3 +1,494 @@
+import json
+import os
+import tempfile
+import time
+import zipfile
+from unittest import mock
+from datetime import timedelta
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.test import TestCase
+from django.utils import timezone
+from django.utils.http import http_date
+from django.contrib.auth.models import User
+from .models import Fact
+from .cache import FactCache, fact_cache
+from .popularity import popularity
+from .placeholders import Template
+from .serializers import FactSerializer
+from .geo import city_resolver, StubGeocoder
+from .gazetteer import Gazetteer, build, read_geonames
+from .aliases import alias_graph, AliasLoopError, AliasDepthError
+from launchpad.cache_client import LocalCache
 
-# Create your tests here.
+class AsyncLocalCache:
+    """The awaitable calls of AsyncCacheClient over a LocalCache"""
+    def __init__(self, cache):
+        self.cache = cache
+
+    async def get(self, name):
+        return self.cache.get(name)
+
+    async def setex(self, name, timeout, value):
+        return self.cache.setex(name, timeout, value)
+
+
+class LocalRedisMixin:
+    """
+    Points the factoid modules at a LocalCache instead of the Redis on
+    localhost, so tests neither depend on it nor touch its keys. LocalCache
+    has no pub/sub or hashes: invalidations go unpublished and popularity
+    is buffered in memory, as when Redis is down.
+    """
+    def setUp(self):
+        self.redis = LocalCache()
+        for patcher in (mock.patch('factoids.cache.redis_cache', self.redis),
+                        mock.patch('factoids.popularity.redis_cache', self.redis),
+                        mock.patch('factoids.geo.redis_cache', self.redis),
+                        mock.patch('factoids.geo.async_cache', AsyncLocalCache(self.redis))):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        super().setUp()
+
+
+class FactCacheTests(LocalRedisMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        fact_cache.clear()
+        popularity.flush()
+        self.author = User.objects.create(username='ubottu')
+        self.fact = Fact.objects.create(name='hello', value='Hello world', author=self.author)
+
+    def test_warm_lookup_runs_no_queries(self):
+        fact_cache.get('hello')
+        with self.assertNumQueries(0):
+            fact = fact_cache.get('hello')
+            self.assertEqual(fact.author.username, 'ubottu')
+        self.assertEqual(fact_cache.stats()['hits'], 1)
+        self.assertEqual(fact_cache.stats()['misses'], 1)
+
+    def test_save_invalidates(self):
+        fact_cache.get('hello')
+        self.fact.value = 'Hi there'
+        self.fact.save()
+        self.assertEqual(fact_cache.get('hello').value, 'Hi there')
+
+    def test_delete_invalidates(self):
+        fact_cache.get('hello')
+        self.fact.delete()
+        with self.assertRaises(Fact.DoesNotExist):
+            fact_cache.get('hello')
+
+    def test_rename_drops_old_name(self):
+        fact_cache.get('hello')
+        self.fact.name = 'hi'
+        self.fact.save()
+        with self.assertRaises(Fact.DoesNotExist):
+            fact_cache.get('hello')
+
+    def test_listener_is_retried_after_a_failed_subscribe(self):
+        cache = FactCache()
+        pubsub = mock.Mock()
+        with mock.patch('factoids.cache.redis_cache') as redis_cache:
+            redis_cache.pubsub.side_effect = [ConnectionError('Redis is down'), pubsub]
+            cache.get('hello')
+            self.assertIsNone(cache._listener)
+            cache._listener_retry_at = 0
+            cache.get('hello')
+        self.assertIs(cache._listener, pubsub.run_in_thread.return_value)
+        self.assertEqual(pubsub.run_in_thread.call_args.kwargs['exception_handler'], cache._on_listener_error)
+
+    def test_lost_listener_drops_entries(self):
+        cache = FactCache()
+        notified = []
+        cache.subscribe(lambda name, fact_id: notified.append((name, fact_id)))
+        cache.get('hello')
+        thread = mock.Mock()
+        cache._on_listener_error(ConnectionError('Connection reset'), None, thread)
+        thread.stop.assert_called_once_with()
+        self.assertEqual((cache.stats()['entries'], notified), (0, [(None, None)]))
+        self.assertIsNone(cache._listener_pid)
+
+    def test_load_racing_an_invalidation_is_not_cached(self):
+        cache = FactCache()
+        load_many = cache.load_many
+        def load_then_change(names, room):
+            loaded = load_many(names, room)
+            cache.invalidate('hello', self.fact.id)
+            return loaded
+        with mock.patch.object(cache, 'load_many', load_then_change):
+            self.assertEqual(cache.get('hello').value, 'Hello world')
+        self.assertEqual(cache.stats()['entries'], 0)
+
+    def test_api_lookup_counts_popularity(self):
+        response = self.client.get('/factoids/api/facts/hello/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['value'], 'Hello world')
+        self.client.get('/factoids/api/facts/hello/')
+        self.assertEqual(popularity.pending()[self.fact.id], 2)
+        popularity.flush()
+        self.fact.refresh_from_db()
+        self.assertEqual(self.fact.popularity, 2)
+        self.assertEqual(popularity.pending()[self.fact.id], 0)
+
+    def test_popularity_bulk_flush_runs_one_update_per_fact(self):
+        other = Fact.objects.create(name='other', value='Other')
+        popularity.record_many({self.fact.id: 3, other.id: 1})
+        popularity.record(self.fact.id)
+        with self.assertNumQueries(2 + 2):  # savepoint + release around the two updates
+            popularity.flush()
+        self.fact.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((self.fact.popularity, other.popularity), (4, 1))
+
+
+class FactExportTests(LocalRedisMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.facts = [Fact.objects.create(name=f'fact{i}', value=f'Value {i}') for i in range(5)]
+
+    def test_keyset_pagination(self):
+        response = self.client.get('/factoids/api/facts/', {'limit': 2})
+        self.assertEqual([f['name'] for f in response.json()], ['fact0', 'fact1'])
+        cursor = response['X-Next-Cursor']
+        response = self.client.get('/factoids/api/facts/', {'limit': 2, 'after': cursor})
+        self.assertEqual([f['name'] for f in response.json()], ['fact2', 'fact3'])
+
+    def test_stream_is_ndjson(self):
+        response = self.client.get('/factoids/api/facts/', {'stream': 1})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['name'] for line in lines], [f'fact{i}' for i in range(5)])
+
+    def test_changed_since(self):
+        since = timezone.now()
+        Fact.objects.filter(id=self.facts[0].id).update(change_date=since - timedelta(days=1))
+        self.facts[3].value = 'Changed'
+        self.facts[3].save()
+        response = self.client.get('/factoids/api/facts/', {'since': since.isoformat()})
+        self.assertEqual([f['name'] for f in response.json()], ['fact3'])
+
+    def test_last_modified_round_trip(self):
+        second = timezone.now().replace(microsecond=0) - timedelta(minutes=1)
+        Fact.objects.update(change_date=second - timedelta(hours=1))
+        Fact.objects.filter(id=self.facts[0].id).update(change_date=second + timedelta(milliseconds=300))
+        response = self.client.get('/factoids/api/facts/')
+        self.assertEqual(response['Last-Modified'], http_date(second.timestamp()))
+        # Saved later within the second Last-Modified stops at
+        Fact.objects.filter(id=self.facts[1].id).update(change_date=second + timedelta(milliseconds=800))
+        response = self.client.get('/factoids/api/facts/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual([f['name'] for f in response.json()], ['fact0', 'fact1'])
+
+    def test_since_without_changes_is_an_empty_list(self):
+        future = timezone.now() + timedelta(days=1)
+        response = self.client.get('/factoids/api/facts/', {'since': future.isoformat()})
+        self.assertEqual((response.status_code, response.json()), (200, []))
+
+    def test_stream_pages_have_a_cursor(self):
+        response = self.client.get('/factoids/api/facts/', {'stream': 1, 'limit': 2})
+        self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 2)
+        self.assertEqual(response['X-Next-Cursor'], str(self.facts[1].id))
+
+    def test_not_modified(self):
+        future = timezone.now() + timedelta(days=1)
+        response = self.client.get('/factoids/api/facts/', HTTP_IF_MODIFIED_SINCE=http_date(future.timestamp()))
+        self.assertEqual(response.status_code, 304)
+
+
+class AliasTests(LocalRedisMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        fact_cache.clear()
+        alias_graph.clear()
+        Fact.objects.create(name='hello', value='Hello world')
+        Fact.objects.create(name='hi', value='hello', ftype='ALIAS')
+        Fact.objects.create(name='hey', value='hi', ftype='ALIAS')
+
+    def test_resolve_chain(self):
+        response = self.client.get('/factoids/api/facts/hey/', {'resolve': 1})
+        self.assertEqual(response.json()['value'], 'Hello world')
+        self.assertEqual(response.json()['alias_chain'], ['hey', 'hi', 'hello'])
+
+    def test_without_resolve_returns_alias(self):
+        response = self.client.get('/factoids/api/facts/hey/')
+        self.assertEqual(response.json()['value'], 'hi')
+
+    def test_graph_follows_changes(self):
+        alias_graph.resolve('hey')
+        fact = Fact.objects.get(name='hi')
+        fact.ftype = 'REPLY'
+        fact.save()
+        self.assertEqual(alias_graph.resolve('hey'), ['hey', 'hi'])
+        fact.delete()
+        self.assertEqual(alias_graph.resolve('hey'), ['hey', 'hi'])
+        self.assertEqual(alias_graph.resolve('hi'), ['hi'])
+
+    def test_loop(self):
+        fact = Fact.objects.get(name='hello')
+        fact.ftype = 'ALIAS'
+        fact.value = 'hey'
+        fact.save()
+        with self.assertRaises(AliasLoopError):
+            alias_graph.resolve('hey')
+        response = self.client.get('/factoids/api/facts/hey/', {'resolve': 1})
+        self.assertEqual((response.status_code, response.json()['code']), (508, 'alias_loop'))
+
+    def test_room_aliases_stay_in_their_room(self):
+        Fact.objects.create(name='bye', value='Bye')
+        room_alias = Fact.objects.create(name='hi', value='bye', ftype='ALIAS', room='!room:example.org')
+        self.assertEqual(alias_graph.resolve('hey', '!room:example.org'), ['hey', 'hi', 'bye'])
+        response = self.client.get('/factoids/api/facts/hi/', {'resolve': 1})
+        self.assertEqual(response.json()['value'], 'Hello world')
+        room_alias.delete()
+        self.assertEqual(alias_graph.resolve('hi'), ['hi', 'hello'])
+        self.assertEqual(alias_graph.resolve('hi', '!room:example.org'), ['hi', 'hello'])
+
+    def test_room_fact_hides_global_alias(self):
+        Fact.objects.create(name='hi', value='Hi there', room='!room:example.org')
+        self.assertEqual(alias_graph.resolve('hey', '!room:example.org'), ['hey', 'hi'])
+        self.assertEqual(alias_graph.resolve('hey'), ['hey', 'hi', 'hello'])
+
+    def test_depth_limit(self):
+        for i in range(alias_graph.max_depth + 1):
+            Fact.objects.create(name=f'a{i}', value=f'a{i + 1}', ftype='ALIAS')
+        with self.assertRaises(AliasDepthError):
+            alias_graph.resolve('a0')
+        response = self.client.get('/factoids/api/facts/a0/', {'resolve': 1})
+        self.assertEqual((response.status_code, response.json()['code']), (422, 'alias_too_deep'))
+
+    def test_reloads_changes_it_was_not_told_about(self):
+        self.assertEqual(alias_graph.resolve('hey'), ['hey', 'hi', 'hello'])
+        # Another worker's change whose invalidation never arrived
+        Fact.objects.filter(name='hey').update(value='hello')
+        self.assertEqual(alias_graph.resolve('hey'), ['hey', 'hi', 'hello'])
+        with mock.patch('factoids.aliases.time.monotonic', return_value=time.monotonic() + alias_graph.timeout + 1):
+            self.assertEqual(alias_graph.resolve('hey'), ['hey', 'hello'])
+
+    def test_lost_channel_forces_a_reload(self):
+        alias_graph.resolve('hey')
+        Fact.objects.filter(name='hey').update(value='hello')
+        alias_graph.mark_dirty(None, None)
+        self.assertEqual(alias_graph.resolve('hey'), ['hey', 'hello'])
+
+
+class FactBatchTests(LocalRedisMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        fact_cache.clear()
+        popularity.flush()
+        author = User.objects.create(username='ubottu')
+        self.hello = Fact.objects.create(name='hello', value='Hello world', author=author)
+        Fact.objects.create(name='bye', value='Goodbye', author=author)
+        self.room_hello = Fact.objects.create(name='hello', value='Hello room', room='!room:ubuntu.com')
+
+    def test_batch_lookup(self):
+        with self.assertNumQueries(1):
+            response = self.client.post('/factoids/api/facts-batch/', {'names': ['hello', 'bye', 'nope']}, content_type='application/json')
+        self.assertEqual(response.json()['facts']['hello']['value'], 'Hello world')
+        self.assertEqual(response.json()['facts']['bye']['value'], 'Goodbye')
+        self.assertEqual(response.json()['missing'], ['nope'])
+        self.assertEqual(popularity.pending()[self.hello.id], 1)
+
+    def test_batch_prefers_room_fact(self):
+        response = self.client.post('/factoids/api/facts-batch/', {'names': ['hello', 'bye'], 'room': '!room:ubuntu.com'}, content_type='application/json')
+        self.assertEqual(response.json()['facts']['hello']['value'], 'Hello room')
+        self.assertEqual(response.json()['facts']['bye']['value'], 'Goodbye')
+
+    def test_fact_named_batch_is_reachable(self):
+        Fact.objects.create(name='batch', value='One at a time')
+        response = self.client.get('/factoids/api/facts/batch/')
+        self.assertEqual(response.json()['value'], 'One at a time')
+
+    def test_batch_rejects_bad_input(self):
+        response = self.client.post('/factoids/api/facts-batch/', {'names': 'hello'}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class RoomLookupTests(LocalRedisMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        fact_cache.clear()
+        Fact.objects.create(name='rules', value='Global rules')
+        Fact.objects.create(name='rules', value='Room rules', room='!room:ubuntu.com')
+
+    def test_room_fact_wins(self):
+        response = self.client.get('/factoids/api/facts/rules/', {'room': '!room:ubuntu.com'})
+        self.assertEqual(response.json()['value'], 'Room rules')
+
+    def test_falls_back_to_global(self):
+        response = self.client.get('/factoids/api/facts/rules/', {'room': '!other:ubuntu.com'})
+        self.assertEqual(response.json()['value'], 'Global rules')
+        response = self.client.get('/factoids/api/facts/rules/')
+        self.assertEqual(response.json()['value'], 'Global rules')
+
+    def test_single_query(self):
+        with self.assertNumQueries(1):
+            fact_cache.get('rules', '!room:ubuntu.com')
+
+    def test_room_fact_needs_its_room(self):
+        Fact.objects.create(name='topic', value='Room topic', room='!room:ubuntu.com')
+        self.assertEqual(self.client.get('/factoids/api/facts/topic/').status_code, 404)
+        response = self.client.post('/factoids/api/facts-batch/', {'names': ['topic']}, content_type='application/json')
+        self.assertEqual(response.json()['missing'], ['topic'])
+
+
+class FactListQueryTests(LocalRedisMixin, TestCase):
+    def create_facts(self, count):
+        for i in range(count):
+            author = User.objects.create(username=f'author{Fact.objects.count()}')
+            Fact.objects.create(name=f'fact{Fact.objects.count()}', value='Value', author=author)
+
+    def test_html_list_queries_do_not_grow_with_facts(self):
+        for count in (3, 10):
+            self.create_facts(count)
+            # COUNT for the paginator plus one joined SELECT
+            with self.assertNumQueries(2):
+                response = self.client.get('/factoids/', {'sort': 'popularity'})
+            self.assertContains(response, 'author0')
+
+    def test_api_list_queries_do_not_grow_with_facts(self):
+        for count in (3, 10):
+            self.create_facts(count)
+            # One joined SELECT, Last-Modified is taken from the page
+            with self.assertNumQueries(1):
+                response = self.client.get('/factoids/api/facts/')
+            self.assertEqual(len(response.json()), Fact.objects.count())
+            self.assertEqual(response.json()[0]['author_name'], 'author0')
+
+    def test_html_list_is_paginated(self):
+        self.create_facts(3)
+        with mock.patch('factoids.views.LIST_PAGE_SIZE', 2):
+            response = self.client.get('/factoids/', {'page': 2})
+        self.assertEqual(response.context['page'].number, 2)
+        self.assertEqual([fact.name for fact in response.context['facts']], ['fact2'])
+
+
+class PlaceholderTests(LocalRedisMixin, TestCase):
+    members = {
+        'ubuntu-irc': {'group_name': 'ubuntu-irc', 'group_members': ['a', 'b'], 'mxids': ['@a:ubuntu.com', '@b:ubuntu.com']},
+        'ubuntu-ops': {'group_name': 'ubuntu-ops', 'group_members': ['b', 'c'], 'mxids': ['@b:ubuntu.com', '@c:ubuntu.com']},
+    }
+
+    def test_multiple_placeholders(self):
+        template = Template('Ping {launchpad_group.ubuntu-irc} and {launchpad_group.ubuntu-ops.mentions}!')
+        self.assertEqual(template.groups, ['ubuntu-irc', 'ubuntu-ops'])
+        self.assertEqual(template.render(self.members), 'Ping @a:ubuntu.com @b:ubuntu.com and !')
+        self.assertEqual(template.user_ids(self.members), ['@a:ubuntu.com', '@b:ubuntu.com', '@c:ubuntu.com'])
+
+    def test_user_ids_are_listed_once(self):
+        template = Template('{launchpad_group.ubuntu-ops} {launchpad_group.ubuntu-irc}')
+        members = {**self.members, 'ubuntu-ops': {'mxids': ['@c:ubuntu.com', '@b:ubuntu.com', '@c:ubuntu.com']}}
+        self.assertEqual(template.user_ids(members), ['@c:ubuntu.com', '@b:ubuntu.com', '@a:ubuntu.com'])
+
+    def test_unknown_group_is_left_alone(self):
+        template = Template('Ping {launchpad_group.missing}')
+        self.assertEqual(template.render({'missing': False}), 'Ping {launchpad_group.missing}')
+        self.assertEqual(template.user_ids({'missing': False}), [])
+
+    def test_list_fetches_all_groups_at_once(self):
+        Fact.objects.create(name='irc', value='{launchpad_group.ubuntu-irc}')
+        Fact.objects.create(name='ops', value='{launchpad_group.ubuntu-ops.mentions}Ops')
+        Fact.objects.create(name='plain', value='Plain')
+        with mock.patch('factoids.serializers.fetch_many_group_members', side_effect=lambda groups: {g: self.members[g] for g in groups}) as fetch:
+            data = FactSerializer(Fact.objects.order_by('name'), many=True).data
+        fetch.assert_called_once_with(['ubuntu-irc', 'ubuntu-ops'])
+        self.assertEqual(data[0]['value'], '@a:ubuntu.com @b:ubuntu.com')
+        self.assertEqual(data[1]['value'], 'Ops')
+        self.assertEqual(data[1]['user_ids'], ['@b:ubuntu.com', '@c:ubuntu.com'])
+        self.assertEqual(data[2]['user_ids'], {})
+
+
+class CityTimeTests(LocalRedisMixin, TestCase):
+    geocoder = StubGeocoder({'Berlin': ('Berlin, Germany', 52.52, 13.405)})
+
+    def test_city_time(self):
+        with mock.patch.object(city_resolver, 'geocoder', self.geocoder):
+            response = self.client.get('/factoids/api/citytime/ BERLIN /')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['city'], 'Berlin')
+        self.assertIn(response.json()['utc_offset'], ('UTC+01:00', 'UTC+02:00'))
+
+    def test_unknown_city(self):
+        with mock.patch.object(city_resolver, 'geocoder', self.geocoder):
+            response = self.client.get('/factoids/api/citytime/Atlantis/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_utc_skips_geocoder(self):
+        with mock.patch.object(city_resolver, 'geocoder', StubGeocoder()) as geocoder:
+            response = self.client.get('/factoids/api/citytime/utc/')
+        self.assertEqual(response.json()['utc_offset'], 'UTC+00:00')
+        self.assertEqual(geocoder.queries, [])
+
+    async def test_async_view(self):
+        with mock.patch.object(city_resolver, 'geocoder', self.geocoder):
+            response = await self.async_client.get('/factoids/async/api/citytime/Berlin/')
+            missing = await self.async_client.get('/factoids/async/api/citytime/Atlantis/')
+        self.assertEqual(response.json()['location'], 'Berlin, Germany')
+        self.assertEqual(missing.status_code, 404)
+
+    async def test_async_view_survives_cache_errors(self):
+        broken = mock.Mock(get=mock.AsyncMock(side_effect=ValueError('Bad value')),
+                           setex=mock.AsyncMock(side_effect=ValueError('Bad value')))
+        with mock.patch.object(city_resolver, 'geocoder', self.geocoder), mock.patch('factoids.geo.async_cache', broken):
+            response = await self.async_client.get('/factoids/async/api/citytime/Berlin/')
+        self.assertEqual(response.json()['location'], 'Berlin, Germany')
+
+    def test_unreadable_cache_entry_is_a_miss(self):
+        self.redis.set(city_resolver.cache_key('Berlin'), b'not json')
+        with mock.patch.object(city_resolver, 'geocoder', self.geocoder):
+            response = self.client.get('/factoids/api/citytime/Berlin/')
+        self.assertEqual(response.json()['location'], 'Berlin, Germany')
+
+
+class GazetteerTests(LocalRedisMixin, TestCase):
+    geonames = [
+        '2950159\tBerlin\tBerlin\t\t52.52437\t13.41053\tP\tPPLC\tDE\t\t16\t\t\t\t3426354\t74\t43\tEurope/Berlin\t2022-12-02\n',
+        '5083330\tBerlin\tBerlin\t\t44.46867\t-71.18508\tP\tPPL\tUS\t\tNH\t\t\t\t10051\t311\t319\tAmerica/New_York\t2017-05-23\n',
+        '2643743\tLondon\tLondon\t\t51.50853\t-0.12574\tP\tPPLC\tGB\t\tENG\t\t\t\t8961989\t\t25\tEurope/London\t2023-01-12\n',
+        '3117735\tMadrid\tMadrid\t\t40.4165\t-3.70256\tP\tPPLC\tES\t\t29\t\t\t\t3255944\t\t659\tEurope/Madrid\t2022-07-04\n',
+    ]
+
+    def setUp(self):
+        super().setUp()
+        handle, self.path = tempfile.mkstemp(suffix='.idx')
+        os.close(handle)
+        build(read_geonames(self.geonames), self.path)
+        self.gazetteer = Gazetteer(self.path)
+
+    def tearDown(self):
+        self.gazetteer.mmap.close()
+        os.remove(self.path)
+
+    def test_exact_prefers_most_populous(self):
+        self.assertEqual(self.gazetteer.lookup('  berlin'), ('Berlin, DE', 52.52437, 13.41053, 'Europe/Berlin'))
+        self.assertEqual(self.gazetteer.lookup('Berlin, US')[3], 'America/New_York')
+        self.assertIsNone(self.gazetteer.lookup('Paris'))
+
+    def test_prefix_and_fuzzy(self):
+        self.assertEqual(self.gazetteer.prefix('Lond')[0], 'London, GB')
+        self.assertEqual(self.gazetteer.fuzzy('Madird')[0], 'Madrid, ES')
+        self.assertIsNone(self.gazetteer.search('Atlantis'))
+
+    def test_city_time_uses_gazetteer_without_geocoder(self):
+        geocoder = StubGeocoder()
+        with mock.patch.object(city_resolver, 'geocoder', geocoder), \
+             mock.patch('factoids.geo.get_gazetteer', return_value=self.gazetteer):
+            response = self.client.get('/factoids/api/citytime/London/')
+        self.assertEqual(response.json()['location'], 'London, GB')
+        self.assertEqual(geocoder.queries, [])
+
+    def test_guesses_are_marked_and_cached_briefly(self):
+        with mock.patch.object(city_resolver, 'geocoder', StubGeocoder()), \
+             mock.patch('factoids.geo.get_gazetteer', return_value=self.gazetteer):
+            response = self.client.get('/factoids/api/citytime/Madird/')
+        self.assertEqual(response.json()['location'], 'Madrid, ES')
+        self.assertTrue(response.json()['approximate'])
+        self.assertLessEqual(self.redis.ttl(city_resolver.cache_key('Madird')), city_resolver.approximate_timeout)
+
+    def test_build_rejects_zip_without_cities(self):
+        handle, path = tempfile.mkstemp(suffix='.zip')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        with zipfile.ZipFile(path, 'w') as archive:
+            archive.writestr('readme.md', 'Nothing here')
+        with self.assertRaises(CommandError):
+            call_command('build_gazetteer', path, output=self.path)
@@ -1,11 +1,14 @@
 from django.urls import path
-from .views import FactList
+from .views import FactList, FactBatch
 from . import views
 
 urlpatterns = [
     path('', views.list_facts, name='facts-list'),
     path('api/citytime/<str:city_name>/', views.city_time, name='citytime'),
+    path('async/api/citytime/<str:city_name>/', views.city_time_async, name='citytime-async'),
+    path('api/cache/stats/', views.cache_stats, name='fact-cache-stats'),
     path('api/facts/', FactList.as_view(), name='fact-list'),  # For listing all facts
+    path('api/facts-batch/', FactBatch.as_view(), name='fact-batch'),  # For fetching several by name, not under api/facts/ so no fact is shadowed
     path('api/facts/<int:id>/', FactList.as_view(), name='fact-detail-by-id'),  # For fetching by id
     path('api/facts/<slug:name>/', FactList.as_view(), name='fact-detail-by-name'),  # For fetching by name
 ]
@@ -1,4 +1,11 @@
-from django.http import HttpResponse, Http404
+from django.http import HttpResponse, Http404, JsonResponse, StreamingHttpResponse
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db.models import Max
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date, parse_http_date_safe
+from django.utils.timezone import is_naive, make_aware
+from rest_framework.utils.encoders import JSONEncoder
 from rest_framework.views import APIView
 from rest_framework.decorators import api_view
 from django.utils.decorators import method_decorator
@@ -6,49 +13,29 @@ from django.views.decorators.cache import cache_page
 from rest_framework.response import Response
 from .models import Fact
 from .serializers import FactSerializer
+from .cache import fact_cache
+from .popularity import popularity
+from .aliases import alias_graph, AliasLoopError, AliasDepthError
 from django.shortcuts import render
-from geopy.geocoders import Nominatim
-from timezonefinder import TimezoneFinder
+from .geo import city_resolver
 from datetime import datetime
 from rest_framework import status
 import pytz
 import json
 
+EXPORT_CHUNK_SIZE = getattr(settings, 'FACTOID_EXPORT_CHUNK_SIZE', 500)
+LIST_PAGE_SIZE = getattr(settings, 'FACTOID_LIST_PAGE_SIZE', 100)
+
 def index(request):
     return HttpResponse("Hello, world. You're at the factoids index.")
 
 @api_view(['GET'])
 def city_time(request, city_name):
     try:
-        if city_name.upper() == 'UTC':
-            city_name = 'UTC'
-            datetime_obj = datetime.now(pytz.utc)
-            local_time = datetime_obj.strftime('%A, %d %B %Y, %H:%M')
-            data = {'location': '', 'city': city_name, 'local_time': local_time, 'utc_offset': 'UTC+00:00'}
-            return Response(data)
-        else:
-            geolocator = Nominatim(user_agent="Ubottu", timeout=10)
-            location = geolocator.geocode(city_name, exactly_one=True, language='en')
-            if location is None:
-                # If the location wasn't found, return an appropriate response
-                return Response({'error': 'Location not found'}, status=status.HTTP_404_NOT_FOUND)
-
-            tf = TimezoneFinder()
-            timezone_str = tf.timezone_at(lat=location.latitude, lng=location.longitude)  # Get the timezone name
-            
-            if timezone_str is None:
-                # If the timezone wasn't found, return an appropriate response
-                return Response({'error': 'Timezone not found for the given location'}, status=status.HTTP_404_NOT_FOUND)
-        
-            timezone = pytz.timezone(timezone_str)
-
-        datetime_obj = datetime.now(timezone)
-        local_time = datetime_obj.strftime('%A, %d %B %Y, %H:%M')
-        city_name = str(location).split(',')[0]
-        utc_offset = datetime_obj.strftime('%z')
-        formatted_offset = f"UTC{utc_offset[:3]}:{utc_offset[3:]}"
-        data = {'location': str(location), 'city': city_name, 'local_time': local_time, 'utc_offset': formatted_offset}
-        return Response(data)
+        # Cached per normalized city name, only misses reach the geocoder
+        location = None if city_name.upper() == 'UTC' else city_resolver.resolve(city_name)
+        data, status_code = city_time_data(city_name, location)
+        return Response(data, status=status_code)
     except Exception as e:
         # Log the exception if needed
         print(f"Error processing request for city {city_name}: {str(e)}")
@@ -56,22 +43,70 @@ def city_time(request, city_name):
         # Returning False directly is not recommended for API responses
         return Response({'error': 'An error occurred processing your request'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+async def city_time_async(request, city_name):
+    # city_time for ASGI servers, the geocoder call doesn't hold a thread
+    try:
+        location = None if city_name.upper() == 'UTC' else await city_resolver.aresolve(city_name)
+        data, status_code = city_time_data(city_name, location)
+        return JsonResponse(data, status=status_code)
+    except Exception as e:
+        print(f"Error processing request for city {city_name}: {str(e)}")
+        return JsonResponse({'error': 'An error occurred processing your request'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+def city_time_data(city_name, location):
+    """The city time answer for a resolved Place (None if not found) as (data, HTTP status)."""
+    if city_name.upper() == 'UTC':
+        city_name = 'UTC'
+        datetime_obj = datetime.now(pytz.utc)
+        local_time = datetime_obj.strftime('%A, %d %B %Y, %H:%M')
+        data = {'location': '', 'city': city_name, 'local_time': local_time, 'utc_offset': 'UTC+00:00'}
+        return data, status.HTTP_200_OK
+    if location is None:
+        # If the location wasn't found, return an appropriate response
+        return {'error': 'Location not found'}, status.HTTP_404_NOT_FOUND
+
+    if location.timezone is None:
+        # If the timezone wasn't found, return an appropriate response
+        return {'error': 'Timezone not found for the given location'}, status.HTTP_404_NOT_FOUND
+
+    timezone = pytz.timezone(location.timezone)
+    datetime_obj = datetime.now(timezone)
+    local_time = datetime_obj.strftime('%A, %d %B %Y, %H:%M')
+    city_name = location.location.split(',')[0]
+    utc_offset = datetime_obj.strftime('%z')
+    formatted_offset = f"UTC{utc_offset[:3]}:{utc_offset[3:]}"
+    data = {'location': location.location, 'city': city_name, 'local_time': local_time, 'utc_offset': formatted_offset}
+    if location.approximate:
+        # A guess at what a name nothing matched meant
+        data['approximate'] = True
+    return data, status.HTTP_200_OK
+
 
 def list_facts(request):
-    #facts = Fact.objects.all()
     sort_by = request.GET.get('sort', 'name')  # Default sort by 'name'
-    allowed_sorts = ['name', 'ftype', 'popularity']
-    if sort_by not in allowed_sorts:
+    # Each ordering is backed by an index on Fact, name breaks ties so pages are stable
+    orderings = {
+        'name': ('name', 'room'),
+        'ftype': ('ftype', 'name'),
+        'popularity': ('-popularity', 'name'),
+    }
+    if sort_by not in orderings:
         sort_by = 'name'  # Fallback to a safe default
-    if sort_by == 'popularity':
-        facts = Fact.objects.order_by('-popularity', 'name')
-    else:
-        facts = Fact.objects.order_by(sort_by)
-    return render(request, 'factoids/list_facts.html', {'facts': facts})
+    facts = Fact.objects.select_related('author').order_by(*orderings[sort_by])
+    page = Paginator(facts, LIST_PAGE_SIZE).get_page(request.GET.get('page'))
+    return render(request, 'factoids/list_facts.html', {'facts': page, 'page': page, 'sort': sort_by})
+
+@api_view(['GET'])
+def cache_stats(request):
+    # Counters are per worker process
+    return Response(fact_cache.stats())
 
 class FactList(APIView):
     """
     List all Fact items or retrieve a single Fact item by name or id.
+
+    Lookups by name take an optional ?room= and return the fact set for that
+    room if there is one, otherwise the global fact.
     """
     def get(self, request, *args, **kwargs):
         # Check if an 'id' parameter is provided in the URL.
@@ -82,24 +117,156 @@ class FactList(APIView):
         if fact_id:
             # Fetching the Fact item by id.
             try:
-                fact = Fact.objects.get(id=fact_id)
+                fact = Fact.objects.select_related('author').get(id=fact_id)
             except Fact.DoesNotExist:
                 raise Http404("Fact not found")
         elif name:
             # Fetching the Fact item by name.
             try:
-                fact = Fact.objects.get(name=name)
-                fact.popularity += 1  # Increment popularity
-                fact.save(update_fields=['popularity'])  # Save the change
+                # A fact set for the room wins over the global one
+                fact = fact_cache.get(name, request.query_params.get('room') or None)
+                # Buffered, written to the database in bulk by the flusher
+                popularity.record(fact.id)
             except Fact.DoesNotExist:
                 raise Http404("Fact not found")
+            if fact.ftype == 'ALIAS' and request.query_params.get('resolve') in ('1', 'true'):
+                return self.resolve(fact, request.query_params.get('room') or None)
         else:
-            # If neither 'id' nor 'name' is provided, you might want to list all facts
-            # or handle the situation differently (e.g., return an error response).
-            facts = Fact.objects.all()
-            serializer = FactSerializer(facts, many=True)
-            return Response(serializer.data)
+            # If neither 'id' nor 'name' is provided, list (or export) all facts.
+            return self.list(request)
 
         # Serializing the retrieved Fact item.
         serializer = FactSerializer(fact)
-        return Response(serializer.data)
\ No newline at end of file
+        return Response(serializer.data)
+
+    def resolve(self, fact, room=None):
+        """Return the fact an alias finally points to, along with the chain followed."""
+        try:
+            chain = alias_graph.resolve(fact.name, room)
+        except AliasLoopError as e:
+            return Response({'error': str(e), 'code': 'alias_loop'}, status=status.HTTP_508_LOOP_DETECTED)
+        except AliasDepthError as e:
+            return Response({'error': str(e), 'code': 'alias_too_deep'},
+                            status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        try:
+            target = fact_cache.get(chain[-1], room)
+        except Fact.DoesNotExist:
+            return Response({'error': f"Alias target {chain[-1]} not found", 'alias_chain': chain}, status=status.HTTP_404_NOT_FOUND)
+        popularity.record(target.id)
+        data = FactSerializer(target).data
+        data['alias_chain'] = chain
+        return Response(data)
+
+    def list(self, request):
+        """
+        List facts ordered by id.
+
+        ?after=<id>&limit=<n> pages through the table by id, the id to continue
+        from is returned in the X-Next-Cursor header. ?since=<iso date> only
+        returns facts changed after that time. Last-Modified holds the latest
+        change in the page; sent back as If-Modified-Since, whose precision
+        is one second, it returns the facts changed during or after that
+        second, so clients see some facts twice and must dedupe by id. A
+        conditional request with nothing to send gets 304. ?stream=1 sends
+        newline-delimited JSON, one fact per line, without building the
+        whole list in memory.
+
+        Deleted facts are not reported by the delta sync, clients that need
+        to notice deletions have to do a full export now and then.
+        """
+        try:
+            after = int(request.query_params.get('after', 0))
+            limit = int(request.query_params.get('limit', 0))
+        except ValueError:
+            return Response({'error': 'after and limit must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        if after < 0 or limit < 0:
+            return Response({'error': 'after and limit must not be negative'}, status=status.HTTP_400_BAD_REQUEST)
+
+        since = None
+        conditional = False
+        if 'since' in request.query_params:
+            since = parse_datetime(request.query_params['since'])
+            if since is None:
+                return Response({'error': 'since must be an ISO 8601 date'}, status=status.HTTP_400_BAD_REQUEST)
+            if is_naive(since):
+                since = make_aware(since, pytz.utc)
+        elif 'HTTP_IF_MODIFIED_SINCE' in request.META:
+            timestamp = parse_http_date_safe(request.META['HTTP_IF_MODIFIED_SINCE'])
+            if timestamp is not None:
+                conditional = True
+                since = datetime.fromtimestamp(timestamp, pytz.utc)
+
+        facts = Fact.objects.select_related('author').order_by('id')
+        if conditional:
+            # HTTP dates drop the fraction of a second, a fact saved later in
+            # that same second must not be skipped
+            facts = facts.filter(change_date__gte=since)
+        elif since is not None:
+            facts = facts.filter(change_date__gt=since)
+        if after:
+            facts = facts.filter(id__gt=after)
+
+        if limit:
+            facts = facts[:limit]
+        stream = request.query_params.get('stream') in ('1', 'true')
+        if not stream:
+            facts = list(facts)
+            keys = [(fact.id, fact.change_date) for fact in facts]
+        elif limit:
+            # Only the page's ids and dates up front, the facts themselves are streamed
+            keys = list(facts.values_list('id', 'change_date'))
+        else:
+            keys = None
+        if keys is None:
+            last_modified = facts.aggregate(Max('change_date'))['change_date__max']
+        else:
+            last_modified = max((change_date for _, change_date in keys), default=None)
+        if last_modified is None and conditional and not after:
+            # Nothing changed since the client's last sync
+            return HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+
+        if stream:
+            response = StreamingHttpResponse(self.stream(facts), content_type='application/x-ndjson')
+        else:
+            response = Response(FactSerializer(facts, many=True).data)
+        if limit and len(keys) == limit:
+            response['X-Next-Cursor'] = str(keys[-1][0])
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified.timestamp())
+        return response
+
+    def stream(self, facts):
+        encoder = JSONEncoder()
+        context = {}  # Shares resolved launchpad groups across the whole export
+        for fact in facts.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            yield encoder.encode(FactSerializer(fact, context=context).data) + '\n'
+
+class FactBatch(APIView):
+    """
+    Retrieve several Fact items by name in one request.
+
+    Expects {"names": [...], "room": optional room id} and answers with the
+    facts found, keyed by name, plus the names that were not found.
+    """
+    max_names = 100
+
+    def post(self, request, *args, **kwargs):
+        data = request.data if isinstance(request.data, dict) else {}
+        names = data.get('names')
+        room = data.get('room') or None
+        if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+            return Response({'error': 'names must be a list of strings'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(names) > self.max_names:
+            return Response({'error': f'At most {self.max_names} names per request'}, status=status.HTTP_400_BAD_REQUEST)
+        if room is not None and not isinstance(room, str):
+            return Response({'error': 'room must be a string'}, status=status.HTTP_400_BAD_REQUEST)
+
+        names = list(dict.fromkeys(names))  # Drop duplicates, keep order
+        facts = fact_cache.get_many(names, room)
+        popularity.record_many({fact.id: 1 for fact in facts.values()})
+        found = [facts[name] for name in names if name in facts]
+        serialized = FactSerializer(found, many=True).data
+        return Response({
+            'facts': {fact.name: data for fact, data in zip(found, serialized)},
+            'missing': [name for name in names if name not in facts],
+        })
@@ -0,0 +1,48 @@
+import asyncio
+import functools
+import os
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+from django.conf import settings
+from .http_client import http, ACCEPT_ENCODING
+
+# What the async views share: a bounded pool for the blocking libraries
+# (launchpadlib, the Redis client) and one aiohttp session per event loop.
+
+BLOCKING_THREADS = getattr(settings, 'ASYNC_BLOCKING_THREADS', 32)
+CONNECTIONS = getattr(settings, 'ASYNC_HTTP_CONNECTIONS', 200)
+
+_executor = None
+_executor_pid = None
+_sessions = weakref.WeakKeyDictionary()
+
+def blocking_pool():
+    """The bounded pool blocking calls run in, one per process (uWSGI and ASGI servers may fork after import)."""
+    global _executor, _executor_pid
+    if _executor_pid != os.getpid():
+        _executor = ThreadPoolExecutor(max_workers=BLOCKING_THREADS, thread_name_prefix='async-blocking')
+        _executor_pid = os.getpid()
+    return _executor
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking call in the bounded pool, at most ASYNC_BLOCKING_THREADS run at once."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(blocking_pool(), functools.partial(func, *args, **kwargs))
+
+def session():
+    """The aiohttp session of the running event loop, created on first use."""
+    loop = asyncio.get_running_loop()
+    client = _sessions.get(loop)
+    if client is None or client.closed:
+        connector = aiohttp.TCPConnector(limit=CONNECTIONS, limit_per_host=http.pool_size)
+        timeout = aiohttp.ClientTimeout(total=http.connect_timeout + http.read_timeout,
+                                        connect=http.connect_timeout, sock_read=http.read_timeout)
+        client = _sessions[loop] = aiohttp.ClientSession(
+            connector=connector, timeout=timeout,
+            headers={'User-Agent': http.user_agent, 'Accept-Encoding': ACCEPT_ENCODING})
+    return client
+
+async def get(url, **kwargs):
+    """GET url with the shared HTTP client's retries and histograms, returning an AsyncResponse."""
+    return await http.aget(session(), url, **kwargs)
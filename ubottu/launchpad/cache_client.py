@@ -0,0 +1,385 @@
+import asyncio
+import threading
+import time
+import weakref
+from collections import OrderedDict
+import redis
+import redis.asyncio
+
+# Errors that mean Redis is unreachable, as opposed to a bad command
+REDIS_ERRORS = (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError)
+
+class LocalCache:
+    """
+    An in-process stand-in for the key/value part of the Redis API.
+
+    Covers get, set, setex, mget, delete, exists, ttl, expire and pipeline()
+    with Redis' semantics (values come back as bytes, ttl answers -2 for
+    missing and -1 for persistent keys), plus CacheClient's get_many() and
+    set_many(), so it can replace the cache client in tests and serve as
+    its fallback. At most max_entries keys are kept,
+    the least recently used go first.
+    """
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _encode(value):
+        if isinstance(value, bytes):
+            return value
+        if isinstance(value, str):
+            return value.encode()
+        return str(value).encode()
+
+    def _live(self, name, now):
+        item = self._data.get(name)
+        if item is None:
+            return None
+        if item[1] is not None and item[1] <= now:
+            del self._data[name]
+            return None
+        self._data.move_to_end(name)
+        return item
+
+    def get(self, name):
+        with self._lock:
+            item = self._live(name, time.time())
+            return item[0] if item else None
+
+    def set(self, name, value, ex=None, px=None, nx=False, xx=False):
+        now = time.time()
+        expires = now + ex if ex is not None else now + px / 1000 if px is not None else None
+        with self._lock:
+            exists = self._live(name, now) is not None
+            if (nx and exists) or (xx and not exists):
+                return None
+            self._data[name] = (self._encode(value), expires)
+            self._data.move_to_end(name)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+        return True
+
+    def setex(self, name, timeout, value):
+        return self.set(name, value, ex=timeout)
+
+    def mget(self, keys, *args):
+        keys = [*keys, *args] if isinstance(keys, (list, tuple)) else [keys, *args]
+        return [self.get(key) for key in keys]
+
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+    def set_many(self, mapping, timeout):
+        for name, value in mapping.items():
+            self.setex(name, timeout, value)
+
+    def delete(self, *names):
+        with self._lock:
+            return sum(self._data.pop(name, None) is not None for name in names)
+
+    def exists(self, *names):
+        with self._lock:
+            now = time.time()
+            return sum(self._live(name, now) is not None for name in names)
+
+    def ttl(self, name):
+        with self._lock:
+            now = time.time()
+            item = self._live(name, now)
+        if item is None:
+            return -2
+        return -1 if item[1] is None else int(item[1] - now + 0.999)
+
+    def expire(self, name, timeout):
+        with self._lock:
+            item = self._live(name, time.time())
+            if item is None:
+                return False
+            self._data[name] = (item[0], time.time() + timeout)
+        return True
+
+    def flushall(self):
+        with self._lock:
+            self._data.clear()
+        return True
+
+    def pipeline(self, transaction=True):
+        return _LocalPipeline(self)
+
+class _LocalPipeline:
+    """Queues LocalCache commands and runs them on execute(), like a Redis pipeline"""
+    def __init__(self, cache):
+        self.cache = cache
+        self.commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self.cache, name)
+        def queue(*args, **kwargs):
+            self.commands.append((method, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        commands, self.commands = self.commands, []
+        return [method(*args, **kwargs) for method, args, kwargs in commands]
+
+class CircuitBreaker:
+    """
+    Stops calling Redis after failure_threshold consecutive connection
+    errors. Once reset_timeout seconds have passed one call is let through
+    again; if it succeeds the breaker closes, otherwise it stays open for
+    another reset_timeout.
+    """
+    def __init__(self, failure_threshold=3, reset_timeout=10):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trips = 0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'half-open' if time.monotonic() >= self.opened_at + self.reset_timeout else 'open'
+
+    def is_open(self):
+        return self.state == 'open'
+
+    def allow(self):
+        """Whether to try Redis now; in half-open state only one caller gets to."""
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def failure(self, error):
+        with self._lock:
+            self.failures += 1
+            if self._trial or (self.opened_at is None and self.failures >= self.failure_threshold):
+                if self.opened_at is None:
+                    print(f"Redis unreachable, using the in-process cache: {error}")
+                    self.trips += 1
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+    def release(self):
+        """Ends a trial call that neither succeeded nor failed with a connection error."""
+        with self._lock:
+            self._trial = False
+
+    def stats(self):
+        return {'state': self.state, 'failures': self.failures, 'trips': self.trips}
+
+class CacheClient:
+    """
+    The Redis connection shared by the caches in this project.
+
+    Connections come from one bounded pool per process. The plain key/value
+    commands (get, set, setex, mget, delete, exists, ttl) go through a
+    circuit breaker: while Redis is unreachable they are answered by an
+    in-process LocalCache instead of raising, with writes kept for at most
+    local_timeout seconds. get_many() and set_many() read and write many
+    keys in one round trip. Every other Redis command (locks, pipelines,
+    sorted sets, pub/sub) is passed through unchanged, but fails fast with
+    ConnectionError while the breaker is open.
+    """
+    def __init__(self, url='redis://localhost:6379/0', max_connections=50, socket_timeout=2, connect_timeout=1,
+                 failure_threshold=3, reset_timeout=10, local_timeout=300, local_entries=10000, client=None):
+        self.url = url
+        self.max_connections = max_connections
+        self.socket_timeout = socket_timeout
+        self.connect_timeout = connect_timeout
+        self.local_timeout = local_timeout
+        if client is None:
+            pool = redis.BlockingConnectionPool.from_url(
+                url, max_connections=max_connections, timeout=socket_timeout, socket_timeout=socket_timeout,
+                socket_connect_timeout=connect_timeout, health_check_interval=30)
+            client = redis.Redis(connection_pool=pool)
+        self.redis = client
+        self.local = LocalCache(local_entries)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+    def _call(self, command, *args, **kwargs):
+        if self.breaker.allow():
+            try:
+                result = getattr(self.redis, command)(*args, **kwargs)
+            except REDIS_ERRORS as e:
+                self.breaker.failure(e)
+            except BaseException:
+                self.breaker.release()
+                raise
+            else:
+                self.breaker.success()
+                return result
+        return self._local_call(command, *args, **kwargs)
+
+    def _local_call(self, command, *args, **kwargs):
+        # Local copies are only a stopgap, keep them short lived
+        if command == 'setex':
+            name, timeout, value = args
+            return self.local.setex(name, min(int(timeout), self.local_timeout), value)
+        if command == 'set':
+            kwargs['ex'] = min(kwargs.get('ex') or self.local_timeout, self.local_timeout)
+            kwargs.pop('px', None)
+        return getattr(self.local, command)(*args, **kwargs)
+
+    def get(self, name):
+        return self._call('get', name)
+
+    def set(self, name, value, **kwargs):
+        return self._call('set', name, value, **kwargs)
+
+    def setex(self, name, timeout, value):
+        return self._call('setex', name, timeout, value)
+
+    def mget(self, keys, *args):
+        return self._call('mget', keys, *args)
+
+    def delete(self, *names):
+        return self._call('delete', *names)
+
+    def exists(self, *names):
+        return self._call('exists', *names)
+
+    def ttl(self, name):
+        return self._call('ttl', name)
+
+    def get_many(self, keys):
+        """Values of keys in order, None for missing ones, in one round trip."""
+        keys = list(keys)
+        return self.mget(keys) if keys else []
+
+    def set_many(self, mapping, timeout):
+        """Store every key/value of mapping for timeout seconds in one pipelined round trip."""
+        if not mapping:
+            return
+        if self.breaker.allow():
+            try:
+                pipe = self.redis.pipeline(transaction=False)
+                for name, value in mapping.items():
+                    pipe.setex(name, timeout, value)
+                pipe.execute()
+            except REDIS_ERRORS as e:
+                self.breaker.failure(e)
+            except BaseException:
+                self.breaker.release()
+                raise
+            else:
+                self.breaker.success()
+                return
+        for name, value in mapping.items():
+            self._local_call('setex', name, timeout, value)
+
+    def __getattr__(self, name):
+        attribute = getattr(self.redis, name)
+        if not callable(attribute):
+            return attribute
+        def call(*args, **kwargs):
+            if self.breaker.is_open():
+                raise redis.exceptions.ConnectionError('Redis circuit breaker is open')
+            try:
+                return attribute(*args, **kwargs)
+            except REDIS_ERRORS as e:
+                self.breaker.failure(e)
+                raise
+        return call
+
+    def stats(self):
+        return {**self.breaker.stats(), 'local_keys': len(self.local._data)}
+
+class AsyncCacheClient:
+    """
+    CacheClient for async views, over redis.asyncio with one pool per event
+    loop. Shares the sync client's circuit breaker and in-process fallback,
+    so both see the same Redis health and the same stopgap values.
+    """
+    def __init__(self, client):
+        self.client = client
+        self._clients = weakref.WeakKeyDictionary()
+
+    @property
+    def redis(self):
+        loop = asyncio.get_running_loop()
+        connection = self._clients.get(loop)
+        if connection is None:
+            pool = redis.asyncio.BlockingConnectionPool.from_url(
+                self.client.url, max_connections=self.client.max_connections, timeout=self.client.socket_timeout,
+                socket_timeout=self.client.socket_timeout, socket_connect_timeout=self.client.connect_timeout)
+            connection = self._clients[loop] = redis.asyncio.Redis(connection_pool=pool)
+        return connection
+
+    async def _call(self, command, *args, **kwargs):
+        breaker = self.client.breaker
+        if breaker.allow():
+            try:
+                result = await getattr(self.redis, command)(*args, **kwargs)
+            except REDIS_ERRORS as e:
+                breaker.failure(e)
+            except BaseException:
+                breaker.release()
+                raise
+            else:
+                breaker.success()
+                return result
+        return self.client._local_call(command, *args, **kwargs)
+
+    async def get(self, name):
+        return await self._call('get', name)
+
+    async def set(self, name, value, **kwargs):
+        return await self._call('set', name, value, **kwargs)
+
+    async def setex(self, name, timeout, value):
+        return await self._call('setex', name, timeout, value)
+
+    async def mget(self, keys, *args):
+        return await self._call('mget', keys, *args)
+
+    async def delete(self, *names):
+        return await self._call('delete', *names)
+
+    async def exists(self, *names):
+        return await self._call('exists', *names)
+
+    async def ttl(self, name):
+        return await self._call('ttl', name)
+
+    async def get_many(self, keys):
+        keys = list(keys)
+        return await self.mget(keys) if keys else []
+
+    async def set_many(self, mapping, timeout):
+        if not mapping:
+            return
+        breaker = self.client.breaker
+        if breaker.allow():
+            try:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for name, value in mapping.items():
+                        pipe.setex(name, timeout, value)
+                    await pipe.execute()
+            except REDIS_ERRORS as e:
+                breaker.failure(e)
+            except BaseException:
+                breaker.release()
+                raise
+            else:
+                breaker.success()
+                return
+        for name, value in mapping.items():
+            self.client._local_call('setex', name, timeout, value)
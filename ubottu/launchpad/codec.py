@@ -0,0 +1,65 @@
+import json
+import zlib
+from django.conf import settings
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Encoded values start with MAGIC, a byte no JSON document starts with, so
+# entries written as plain JSON before this format are still readable.
+MAGIC = b'\xc1'
+VERSION = 1
+# Flags, the third header byte
+MSGPACK = 1
+ZLIB = 2
+
+class CacheCodec:
+    """
+    Serializes cached values compactly.
+
+    A value is written as MAGIC, a version byte and a flags byte, followed
+    by its msgpack encoding (JSON when msgpack is not installed). Bodies of
+    at least compress_min bytes are zlib compressed when that makes them
+    smaller. loads() reads all of these as well as plain JSON, so entries
+    cached before the switch stay valid until they expire.
+    """
+    def __init__(self, compress_min=1024, compress_level=6, use_msgpack=True):
+        self.compress_min = compress_min
+        self.compress_level = compress_level
+        self.use_msgpack = use_msgpack and msgpack is not None
+
+    def dumps(self, value):
+        if self.use_msgpack:
+            flags, body = MSGPACK, msgpack.packb(value, use_bin_type=True)
+        else:
+            flags, body = 0, json.dumps(value, separators=(',', ':')).encode()
+        if self.compress_min is not None and len(body) >= self.compress_min:
+            compressed = zlib.compress(body, self.compress_level)
+            if len(compressed) < len(body):
+                flags, body = flags | ZLIB, compressed
+        return MAGIC + bytes((VERSION, flags)) + body
+
+    def loads(self, raw):
+        if isinstance(raw, str):
+            raw = raw.encode()
+        if not raw.startswith(MAGIC):
+            return json.loads(raw)
+        version, flags = raw[1], raw[2]
+        if version != VERSION:
+            raise ValueError(f"Unknown cache encoding version {version}")
+        body = raw[3:]
+        if flags & ZLIB:
+            body = zlib.decompress(body)
+        if flags & MSGPACK:
+            if msgpack is None:
+                raise ValueError("Cached value is msgpack encoded but msgpack is not installed")
+            return msgpack.unpackb(body, raw=False)
+        return json.loads(body)
+
+
+codec = CacheCodec(
+    compress_min=getattr(settings, 'CACHE_COMPRESS_MIN_BYTES', 1024),
+    use_msgpack=getattr(settings, 'CACHE_MSGPACK', True),
+)
@@ -0,0 +1,25 @@
+from contextlib import contextmanager
+from lazr.restfulclient.errors import NotFound, ServerError, Unauthorized
+
+class NotFoundError(KeyError):
+    """The group, profile or bug does not exist upstream. A KeyError, which is what callers already catch."""
+
+class PrivateError(Exception):
+    """The resource exists but is not visible to us"""
+
+class UpstreamError(Exception):
+    """The upstream service failed to answer the lookup"""
+
+@contextmanager
+def launchpad_errors(name):
+    """Turn launchpadlib's errors for looking up name into NotFoundError, PrivateError and UpstreamError."""
+    try:
+        yield
+    except (NotFound, KeyError) as e:
+        if isinstance(e, NotFoundError):
+            raise
+        raise NotFoundError(name) from e
+    except Unauthorized as e:
+        raise PrivateError(f"{name} is private") from e
+    except ServerError as e:
+        raise UpstreamError(f"Launchpad failed looking up {name}: {e.response.status}") from e
@@ -0,0 +1,233 @@
+import asyncio
+import bisect
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+try:
+    import brotli  # noqa: F401, urllib3 decodes br responses when it is installed
+    ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+    ACCEPT_ENCODING = 'gzip, deflate'
+
+# Statuses worth asking again for, everything else is final
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+# Methods that are safe to send twice
+IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS'))
+
+class LatencyHistogram:
+    """Request durations of one host, bucketed by upper bound in seconds."""
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.total = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+
+    def observe(self, seconds, error=False):
+        self.counts[bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.requests += 1
+        self.errors += error
+
+    def snapshot(self):
+        buckets = {str(bound): count for bound, count in zip(self.BUCKETS, self.counts)}
+        buckets['+Inf'] = self.counts[-1]
+        return {'requests': self.requests, 'errors': self.errors, 'retries': self.retries,
+                'seconds_total': round(self.total, 3), 'buckets': buckets}
+
+class AsyncResponse:
+    """What aget() returns: the parts of requests.Response that callers use, with the body already read"""
+    def __init__(self, url, status_code, reason, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} {self.reason} for url: {self.url}", response=self)
+
+class HTTPClient:
+    """
+    The outbound HTTP layer shared by the bug trackers and Launchpad fetchers.
+
+    Every host gets its own keep-alive session and connection pool, so
+    repeated lookups skip DNS, TCP and TLS setup. Requests have separate
+    connect and read timeouts, idempotent ones are retried on 5xx and 429
+    with jittered exponential backoff (honouring Retry-After), and every
+    attempt lands in a per host latency histogram. Code that talks HTTP
+    itself, like the bug engine's aiohttp session, uses retry_delay(),
+    should_retry() and observe() to behave the same.
+    """
+    def __init__(self, connect_timeout=5, read_timeout=10, retries=2, backoff=0.5, max_backoff=10,
+                 pool_size=10, user_agent='Ubottu'):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.pool_size = pool_size
+        self.user_agent = user_agent
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._histograms = {}
+        self._pid = None
+        self._local = threading.local()
+
+    @property
+    def timeout(self):
+        return (self.connect_timeout, self.read_timeout)
+
+    def session(self, url):
+        """The pooled session for url's host, created once per process (uWSGI forks after import)."""
+        parts = urlsplit(url)
+        origin = f'{parts.scheme}://{parts.netloc}'
+        with self._lock:
+            if self._pid != os.getpid():
+                self._sessions = {}
+                self._pid = os.getpid()
+            session = self._sessions.get(origin)
+            if session is None:
+                session = self._sessions[origin] = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                session.mount(origin, adapter)
+                session.headers.update({'User-Agent': self.user_agent, 'Accept-Encoding': ACCEPT_ENCODING})
+            return session
+
+    def request(self, method, url, timeout=None, retry_statuses=RETRY_STATUSES, **kwargs):
+        """
+        Send a request through the host's session and return the final
+        requests.Response. Connection errors and timeouts raise once the
+        retries are used up; error statuses are returned for the caller,
+        after retrying those in retry_statuses.
+        """
+        session = self.session(url)
+        host = urlsplit(url).netloc
+        retries = self.retries if method.upper() in IDEMPOTENT_METHODS else 0
+        for attempt in range(retries + 1):
+            started = time.monotonic()
+            try:
+                response = session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+            except requests.RequestException:
+                self.observe(host, time.monotonic() - started, error=True)
+                if attempt == retries:
+                    raise
+                self._sleep(host, attempt)
+                continue
+            self.observe(host, time.monotonic() - started, error=response.status_code >= 500)
+            if attempt == retries or not self.should_retry(response.status_code, retry_statuses):
+                return response
+            response.close()
+            self._sleep(host, attempt, response.headers.get('Retry-After'))
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    async def aget(self, session, url, retry_statuses=RETRY_STATUSES, **kwargs):
+        """
+        GET url through an aiohttp session with the same retries and
+        histograms as request(), returning an AsyncResponse.
+        """
+        host = urlsplit(url).netloc
+        for attempt in range(self.retries + 1):
+            started = time.monotonic()
+            try:
+                async with session.get(url, **kwargs) as response:
+                    body = await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                self.observe(host, time.monotonic() - started, error=True)
+                if attempt == self.retries:
+                    raise
+                await self._asleep(host, attempt)
+                continue
+            self.observe(host, time.monotonic() - started, error=response.status >= 500)
+            if attempt == self.retries or not self.should_retry(response.status, retry_statuses):
+                return AsyncResponse(url, response.status, response.reason, response.headers, body)
+            await self._asleep(host, attempt, response.headers.get('Retry-After'))
+
+    def should_retry(self, status, retry_statuses=RETRY_STATUSES):
+        return status in retry_statuses
+
+    def retry_delay(self, attempt, retry_after=None):
+        """Seconds to wait before retry number attempt + 1: Retry-After if given, else full jitter backoff."""
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    @contextmanager
+    def counting(self):
+        """Count the requests made by this thread inside the block, as the count attribute of what it yields."""
+        counter = SimpleNamespace(count=0)
+        previous = getattr(self._local, 'counter', None)
+        self._local.counter = counter
+        try:
+            yield counter
+        finally:
+            self._local.counter = previous
+
+    def observe(self, host, seconds, error=False):
+        counter = getattr(self._local, 'counter', None)
+        if counter is not None:
+            counter.count += 1
+        with self._lock:
+            histogram = self._histograms.get(host)
+            if histogram is None:
+                histogram = self._histograms[host] = LatencyHistogram()
+            histogram.observe(seconds, error)
+
+    def _sleep(self, host, attempt, retry_after=None):
+        with self._lock:
+            self._histograms[host].retries += 1
+        time.sleep(self.retry_delay(attempt, retry_after))
+
+    async def _asleep(self, host, attempt, retry_after=None):
+        with self._lock:
+            self._histograms[host].retries += 1
+        await asyncio.sleep(self.retry_delay(attempt, retry_after))
+
+    def instrument(self, connection):
+        """Record the requests of an httplib2 connection (as used by launchpadlib) in the histograms."""
+        send = connection.request
+        def request(uri, *args, **kwargs):
+            started = time.monotonic()
+            try:
+                response, content = send(uri, *args, **kwargs)
+            except Exception:
+                self.observe(urlsplit(uri).netloc, time.monotonic() - started, error=True)
+                raise
+            self.observe(urlsplit(uri).netloc, time.monotonic() - started, error=response.status >= 500)
+            return response, content
+        connection.request = request
+        return connection
+
+    def stats(self):
+        with self._lock:
+            return {host: histogram.snapshot() for host, histogram in self._histograms.items()}
+
+
+http = HTTPClient(
+    connect_timeout=getattr(settings, 'HTTP_CONNECT_TIMEOUT', 5),
+    read_timeout=getattr(settings, 'HTTP_READ_TIMEOUT', 10),
+    retries=getattr(settings, 'HTTP_RETRIES', 2),
+    backoff=getattr(settings, 'HTTP_RETRY_BACKOFF', 0.5),
+    pool_size=getattr(settings, 'HTTP_POOL_SIZE', 10),
+)
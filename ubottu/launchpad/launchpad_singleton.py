@@ -1,10 +1,144 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
 from launchpadlib.launchpad import Launchpad
+from .errors import UpstreamError
+from .http_client import http
 
-launchpad_instance = None
-def get_launchpad():
-    global launchpad_instance
-    if launchpad_instance is None:
-        # Initialize Launchpad instance here.
-        # For example, login anonymously for public data access:
-        launchpad_instance = Launchpad.login_anonymously('Matrix Ubottu', 'production', version='devel')
-    return launchpad_instance
\ No newline at end of file
+class LaunchpadClients:
+    """
+    The anonymous launchpadlib clients used by everything that talks to Launchpad.
+
+    httplib2 connections are not thread safe, so a lookup checks a client
+    out with `with launchpad_client() as launchpad:` and hands it back when
+    done. At most size clients exist per process, created on demand and
+    again after a fork; a lookup that finds them all busy waits up to
+    wait_timeout seconds for one, then raises UpstreamError. All clients
+    share one launchpadlib directory, whose on-disk HTTP cache holds the
+    WADL and service root, so only the first client ever downloads them.
+    warm() creates clients ahead of the first request. When creating a
+    client fails, checking one out raises UpstreamError for retry_after
+    seconds instead of trying again on every call.
+    """
+    def __init__(self, size=8, consumer='Matrix Ubottu', service_root='production', version='devel', cache_dir=None,
+                 timeout=None, retry_after=60, wait_timeout=30):
+        self.size = size
+        self.consumer = consumer
+        self.service_root = service_root
+        self.version = version
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.wait_timeout = wait_timeout
+        self.created = 0
+        self.failures = 0
+        self.exhausted = 0
+        self._failed_until = 0
+        self._failed_pid = None
+        self._idle = []
+        # Clients of this process, idle or checked out
+        self._count = 0
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+
+    @contextmanager
+    def client(self):
+        """A client for the duration of the with block."""
+        pid = os.getpid()
+        client = self.checkout()
+        try:
+            yield client
+        finally:
+            self._checkin(client, pid)
+
+    def checkout(self):
+        """An idle client, a new one while there are fewer than size, or the next one handed back."""
+        deadline = time.monotonic() + self.wait_timeout
+        with self._available:
+            if self._pid != os.getpid():
+                # The parent's clients share its sockets, this process starts over
+                self._idle, self._count, self._pid = [], 0, os.getpid()
+            while not self._idle and self._count >= self.size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.exhausted += 1
+                    raise UpstreamError(f"All {self.size} Launchpad clients are busy")
+                self._available.wait(remaining)
+            if self._idle:
+                return self._idle.pop()
+            # A failure in the parent (uWSGI's master) says nothing about this process
+            if self._failed_pid == os.getpid() and time.monotonic() < self._failed_until:
+                raise UpstreamError("Launchpad is unavailable, not retrying yet")
+            self._count += 1
+        try:
+            return self._create()
+        except Exception:
+            with self._available:
+                self._count -= 1
+                self._available.notify()
+            raise
+
+    def _checkin(self, client, pid):
+        with self._available:
+            if pid == self._pid:
+                self._idle.append(client)
+                self._available.notify()
+
+    def _create(self):
+        try:
+            client = Launchpad.login_anonymously(self.consumer, self.service_root, self.cache_dir,
+                                                 timeout=self.timeout, version=self.version)
+        except Exception as e:
+            with self._lock:
+                self.failures += 1
+                self._failed_until = time.monotonic() + self.retry_after
+                self._failed_pid = os.getpid()
+            raise UpstreamError(f"Could not connect to Launchpad: {e}") from e
+        self.instrument(client)
+        with self._lock:
+            self.created += 1
+        return client
+
+    def instrument(self, client):
+        # launchpadlib keeps its own httplib2 connection (and retries 5xx itself),
+        # its requests still go into the shared latency histograms. The connection
+        # is not public API, without it the client just goes unmeasured.
+        connection = getattr(getattr(client, '_browser', None), '_connection', None)
+        if connection is None or not callable(getattr(connection, 'request', None)):
+            return
+        http.instrument(connection)
+
+    def warm(self, count=1):
+        """
+        Create up to count clients before requests need them. Errors are
+        printed, not raised, so a Launchpad outage does not stop a worker
+        from starting.
+        """
+        pid = os.getpid()
+        clients = []
+        try:
+            for _ in range(min(count, self.size)):
+                clients.append(self.checkout())
+        except UpstreamError as e:
+            print(f"Could not warm the Launchpad clients: {e}")
+        finally:
+            for client in clients:
+                self._checkin(client, pid)
+
+    def stats(self):
+        with self._lock:
+            return {'size': self.size, 'clients': self._count, 'idle': len(self._idle), 'created': self.created,
+                    'failures': self.failures, 'exhausted': self.exhausted}
+
+
+launchpad_clients = LaunchpadClients(
+    size=getattr(settings, 'LAUNCHPAD_CLIENTS', 8),
+    cache_dir=getattr(settings, 'LAUNCHPAD_CACHE_DIR', None),
+    timeout=http.read_timeout,
+)
+
+def launchpad_client():
+    return launchpad_clients.client()
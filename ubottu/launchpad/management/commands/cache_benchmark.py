@@ -0,0 +1,64 @@
+import json
+import time
+import uuid
+from django.core.management.base import BaseCommand
+from launchpad.codec import codec
+from launchpad.utils import cache, _dump_group, _load_group
+
+class Command(BaseCommand):
+    help = ('Compare the plain JSON cache format with the compact one: encoded size, encode and decode time and, '
+            'when Redis is reachable, the memory Redis reports for each. Uses synthetic group and bug payloads '
+            'shaped like the cached ones.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--members', type=int, nargs='+', default=[10, 100, 1000, 10000],
+                            help='Group sizes to try (default: %(default)s)')
+        parser.add_argument('--iterations', type=int, default=200,
+                            help='Encodes and decodes timed per payload (default: %(default)s)')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'payload':16} {'format':8} {'bytes':>9} {'redis':>9} {'encode us':>10} {'decode us':>10}")
+        for members in options['members']:
+            self.compare(f'group {members}', self.group(members), options['iterations'],
+                         json.dumps, json.loads, _dump_group, _load_group)
+        self.compare('bug', self.bug(), options['iterations'],
+                     json.dumps, json.loads, codec.dumps, codec.loads)
+
+    def group(self, members):
+        names = sorted(f'member-{n:05d}' for n in range(members))
+        return {'group_members': tuple(names), 'group_name': 'benchmark-team',
+                'mxids': [f"@{name}:ubuntu.com" for name in names],
+                'expansion': {'teams': 12, 'http_calls': 12, 'failed_teams': [], 'truncated': False}}
+
+    def bug(self):
+        data = {'id': 2059145, 'title': 'Package fails to install after upgrade to the new release', 'package':
+                'ubuntu-release-upgrader', 'status': 'Confirmed', 'importance': 'High', 'assignee': None,
+                'tags': ['noble', 'upgrade', 'regression-update'], 'heat': 120, 'duplicates': 4,
+                'url': 'https://bugs.launchpad.net/bugs/2059145'}
+        return {'data': data, 'fresh_until': time.time() + 900}
+
+    def compare(self, name, value, iterations, json_dumps, json_loads, dumps, loads):
+        for label, encode, decode in (('json', json_dumps, json_loads), ('compact', dumps, loads)):
+            encoded = encode(value)
+            started = time.perf_counter()
+            for _ in range(iterations):
+                encode(value)
+            encode_us = (time.perf_counter() - started) / iterations * 1e6
+            started = time.perf_counter()
+            for _ in range(iterations):
+                decode(encoded)
+            decode_us = (time.perf_counter() - started) / iterations * 1e6
+            size = len(encoded.encode() if isinstance(encoded, str) else encoded)
+            self.stdout.write(f"{name:16} {label:8} {size:9} {self.redis_memory(encoded):>9} "
+                              f"{encode_us:10.1f} {decode_us:10.1f}")
+
+    def redis_memory(self, encoded):
+        key = f'cache_benchmark_{uuid.uuid4().hex}'
+        try:
+            cache.redis.setex(key, 60, encoded)
+            try:
+                return str(cache.redis.memory_usage(key, samples=0))
+            finally:
+                cache.redis.delete(key)
+        except Exception:
+            return 'n/a'
@@ -0,0 +1,54 @@
+import asyncio
+import time
+from collections import Counter
+import aiohttp
+from django.core.management.base import BaseCommand
+
+class Command(BaseCommand):
+    help = ('Fire concurrent GET requests at one or more URLs and compare throughput and latency, e.g. the '
+            'WSGI view (uwsgi --http :8000 --module ubottu.wsgi) against its async twin under an ASGI server '
+            '(uvicorn ubottu.asgi:application --port 8001): '
+            'loadtest http://localhost:8000/factoids/api/citytime/Paris/ '
+            'http://localhost:8001/factoids/async/api/citytime/Paris/. '
+            'A {n} in a URL is replaced by the request number, to spread requests over uncached entries.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='+', help='URLs to load, tested one after the other')
+        parser.add_argument('--requests', type=int, default=1000, help='Requests per URL (default: %(default)s)')
+        parser.add_argument('--concurrency', type=int, default=200,
+                            help='Requests in flight at once (default: %(default)s)')
+        parser.add_argument('--timeout', type=float, default=30, help='Seconds per request (default: %(default)s)')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'url':60} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  statuses")
+        for url in options['urls']:
+            result = asyncio.run(self.load(url, options['requests'], options['concurrency'], options['timeout']))
+            self.stdout.write(self.format(url, *result))
+
+    async def load(self, url, requests, concurrency, timeout):
+        latencies = []
+        statuses = Counter()
+        semaphore = asyncio.Semaphore(concurrency)
+        connector = aiohttp.TCPConnector(limit=concurrency)
+        async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+            async def one(n):
+                async with semaphore:
+                    started = time.monotonic()
+                    try:
+                        async with session.get(url.replace('{n}', str(n))) as response:
+                            await response.read()
+                            statuses[response.status] += 1
+                    except Exception as e:
+                        statuses[type(e).__name__] += 1
+                    latencies.append(time.monotonic() - started)
+            started = time.monotonic()
+            await asyncio.gather(*(one(n) for n in range(requests)))
+            elapsed = time.monotonic() - started
+        return sorted(latencies), statuses, elapsed
+
+    def format(self, url, latencies, statuses, elapsed):
+        def percentile(p):
+            return latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000
+        codes = ' '.join(f"{status}:{count}" for status, count in sorted(statuses.items(), key=str))
+        return (f"{url[:60]:60} {len(latencies) / elapsed:8.1f} {percentile(0.5):8.1f} {percentile(0.95):8.1f} "
+                f"{percentile(0.99):8.1f}  {codes}")
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from launchpad.prefetch import prefetcher
+# Importing these registers how to re-fetch their lookups
+import bugtracker.views  # noqa: F401
+import launchpad.utils  # noqa: F401
+
+class Command(BaseCommand):
+    help = 'Re-fetch popular bugs and Launchpad groups shortly before their cached copies expire'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run a single pass instead of looping')
+        parser.add_argument('--interval', type=int, default=prefetcher.interval,
+                            help='Seconds between passes (default: PREFETCH_INTERVAL, %(default)s)')
+        parser.add_argument('--workers', type=int, default=prefetcher.workers,
+                            help='Concurrent fetches per pass (default: PREFETCH_WORKERS, %(default)s)')
+
+    def handle(self, *args, **options):
+        prefetcher.interval = options['interval']
+        prefetcher.workers = options['workers']
+        if options['once']:
+            try:
+                refreshed = prefetcher.run_once()
+            except Exception as e:
+                raise CommandError(f"Prefetch pass failed: {e}")
+            self.stdout.write(f"Refreshed {refreshed} hot entries")
+            return
+        self.stdout.write(f"Prefetching every {prefetcher.interval} seconds")
+        prefetcher.run_forever()
@@ -0,0 +1,84 @@
+from .codec import codec
+from .errors import NotFoundError, PrivateError
+
+class NegativeCache:
+    """
+    Remembers lookups that found nothing, so repeating them costs one Redis
+    read instead of an upstream round trip.
+
+    guard() runs a fetch and, when it raises one of the not_found or
+    private exception types, stores that outcome under negative:<key> for
+    not_found_timeout or private_timeout seconds before re-raising.
+    check(), or raise_cached() on a value read alongside the positive
+    entry, raise NotFoundError or PrivateError while the outcome is
+    remembered. Upstream failures are never remembered.
+    """
+    def __init__(self, client=None, not_found_timeout=300, private_timeout=900, not_found=(NotFoundError,),
+                 private=(PrivateError,)):
+        self._client = client
+        self.not_found_timeout = not_found_timeout
+        self.private_timeout = private_timeout
+        self.not_found = not_found
+        self.private = private
+        self.hits = 0
+        self.stored = 0
+
+    @property
+    def client(self):
+        # Resolved late, launchpad.utils creates the shared client
+        if self._client is None:
+            from .utils import cache
+            self._client = cache
+        return self._client
+
+    def key(self, key):
+        return f"negative:{key}"
+
+    def check(self, key):
+        try:
+            stored = self.client.get(self.key(key))
+        except Exception as e:
+            print(f"Could not read negative cache for {key}: {e}")
+            return
+        self.raise_cached(stored)
+
+    def raise_cached(self, stored):
+        """Raise the error remembered in stored, the value of a negative:<key> entry, if there is one."""
+        if not stored:
+            return
+        self.hits += 1
+        entry = codec.loads(stored)
+        if entry['kind'] == 'private':
+            raise PrivateError(entry['message'])
+        raise NotFoundError(entry['message'])
+
+    def guard(self, key, fetch):
+        """Return fetch(), remembering a not found or private outcome for key."""
+        try:
+            return fetch()
+        except self.private + self.not_found as e:
+            self.remember(key, e)
+            raise
+
+    def remember(self, key, error):
+        """Remember error, one of the not_found or private types, as the outcome of looking up key."""
+        if isinstance(error, self.private):
+            kind, message, timeout = 'private', str(error) or f"{key} is private", self.private_timeout
+        else:
+            # str() of a KeyError is the repr of its argument
+            message = error.args[0] if isinstance(error, KeyError) and error.args else str(error)
+            kind, message, timeout = 'not_found', str(message or key), self.not_found_timeout
+        try:
+            self.client.setex(self.key(key), timeout, codec.dumps({'kind': kind, 'message': message}))
+            self.stored += 1
+        except Exception as e:
+            print(f"Could not write negative cache for {key}: {e}")
+
+    def forget(self, key):
+        try:
+            self.client.delete(self.key(key))
+        except Exception as e:
+            print(f"Could not delete negative cache for {key}: {e}")
+
+    def stats(self):
+        return {'hits': self.hits, 'stored': self.stored}
@@ -0,0 +1,167 @@
+import json
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+
+class Prefetcher:
+    """
+    Keeps popular lookups warm so they never wait on a cold miss.
+
+    Lookups call record() with a kind ('bug', 'group', ...) and the
+    arguments needed to repeat them; hits are counted in memory and added
+    every flush_interval seconds to a Redis sorted set shared by all
+    workers, which is decayed on every pass so the scores follow recent
+    traffic. The prefetch management command calls run_once() every
+    interval seconds: it asks each hot entry how long its cached copy stays
+    fresh and re-fetches those expiring within lead_time (or already gone),
+    with at most workers fetches at a time.
+
+    Each kind is registered with expires_in(*args), returning seconds left
+    or None when nothing is cached, and refresh(*args), which fetches and
+    stores a new copy.
+    """
+    def __init__(self, client=None, key='prefetch:hits', top=200, min_hits=2, lead_time=300, interval=60,
+                 workers=4, decay=0.5, max_tracked=5000, flush_interval=5):
+        self._client = client
+        self.key = key
+        self.top = top
+        self.min_hits = min_hits
+        self.lead_time = lead_time
+        self.interval = interval
+        self.workers = workers
+        self.decay = decay
+        self.max_tracked = max_tracked
+        self.flush_interval = flush_interval
+        self.kinds = {}
+        self._pending = Counter()
+        self._lock = threading.Lock()
+        self._thread_pid = None
+
+    @property
+    def client(self):
+        # Resolved late, launchpad.utils registers itself while being imported
+        if self._client is None:
+            from .utils import cache
+            self._client = cache
+        return self._client
+
+    def register(self, kind, expires_in, refresh):
+        self.kinds[kind] = (expires_in, refresh)
+
+    def record(self, kind, *args):
+        self.record_many([(kind, *args)])
+
+    def record_many(self, lookups):
+        """Count one hit for each (kind, *args) lookup, written to Redis by the next flush()."""
+        if not lookups:
+            return
+        self._ensure_thread()
+        with self._lock:
+            self._pending.update(json.dumps(lookup) for lookup in lookups)
+
+    def flush(self):
+        """Add the hits counted since the last flush to Redis in one pipeline, returning how many lookups were written."""
+        with self._lock:
+            pending = self._pending
+            self._pending = Counter()
+        if not pending:
+            return 0
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for member, hits in pending.items():
+                pipe.zincrby(self.key, hits, member)
+            pipe.execute()
+        except Exception as e:
+            print(f"Could not record lookups for prefetching: {e}")
+            with self._lock:
+                # Keep them for the next flush, but only as many as Redis would track
+                pending.update(self._pending)
+                self._pending = Counter(dict(pending.most_common(self.max_tracked)))
+            return 0
+        return len(pending)
+
+    def _run(self):
+        event = threading.Event()
+        while not event.wait(self.flush_interval):
+            self.flush()
+
+    def _ensure_thread(self):
+        # Started lazily so it runs in the forked uWSGI worker, not the master
+        if not self.flush_interval or self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread_pid == os.getpid():
+                return
+            self._thread_pid = os.getpid()
+            threading.Thread(target=self._run, name='prefetch-record', daemon=True).start()
+
+    def hot(self):
+        """The most requested lookups as (kind, args, score), most popular first."""
+        entries = self.client.zrevrangebyscore(self.key, '+inf', self.min_hits, start=0, num=self.top,
+                                               withscores=True)
+        hot = []
+        for member, score in entries:
+            kind, *args = json.loads(member)
+            if kind in self.kinds:
+                hot.append((kind, args, score))
+        return hot
+
+    def due(self):
+        """The hot lookups whose cached copy expires within lead_time."""
+        due = []
+        for kind, args, score in self.hot():
+            expires_in, refresh = self.kinds[kind]
+            try:
+                remaining = expires_in(*args)
+            except Exception as e:
+                print(f"Could not check {kind} {args} for prefetching: {e}")
+                continue
+            if remaining is None or remaining < self.lead_time:
+                due.append((kind, args))
+        return due
+
+    def run_once(self):
+        """Refresh every hot lookup that is about to expire, then decay the hit counts; returns the refresh count."""
+        self.flush()
+        due = self.due()
+        refreshed = 0
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='prefetch') as executor:
+            futures = {executor.submit(self.kinds[kind][1], *args): (kind, args) for kind, args in due}
+            for future, (kind, args) in futures.items():
+                try:
+                    future.result()
+                    refreshed += 1
+                except Exception as e:
+                    print(f"Could not prefetch {kind} {args}: {e}")
+        self.age()
+        return refreshed
+
+    def age(self):
+        pipe = self.client.pipeline()
+        pipe.zunionstore(self.key, {self.key: self.decay})
+        pipe.zremrangebyscore(self.key, 0, self.decay / 2)
+        pipe.zremrangebyrank(self.key, 0, -self.max_tracked - 1)
+        pipe.execute()
+
+    def run_forever(self):
+        while True:
+            started = time.monotonic()
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Prefetch pass failed: {e}")
+            time.sleep(max(self.interval - (time.monotonic() - started), 0))
+
+
+prefetcher = Prefetcher(
+    top=getattr(settings, 'PREFETCH_TOP', 200),
+    min_hits=getattr(settings, 'PREFETCH_MIN_HITS', 2),
+    lead_time=getattr(settings, 'PREFETCH_LEAD_TIME', 300),
+    interval=getattr(settings, 'PREFETCH_INTERVAL', 60),
+    workers=getattr(settings, 'PREFETCH_WORKERS', 4),
+    decay=getattr(settings, 'PREFETCH_DECAY', 0.5),
+    flush_interval=getattr(settings, 'PREFETCH_RECORD_INTERVAL', 5),
+)
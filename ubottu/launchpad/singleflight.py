@@ -0,0 +1,163 @@
+import json
+import threading
+import time
+from .errors import NotFoundError, PrivateError
+
+class SingleFlight:
+    """
+    Makes sure only one upstream call per key is in flight at a time.
+
+    Callers in the same process wait on the first caller's result directly.
+    Across uWSGI workers the first caller takes a Redis lock for the key and
+    publishes its result under a short lived key; callers in other workers
+    wait for the lock to go away and pick the result up from there. A not
+    found or private outcome is published the same way, and raised in the
+    waiters as NotFoundError or PrivateError. If the leader fails any other
+    way one of the waiters takes over. Results must be JSON serializable.
+    """
+    def __init__(self, name, client=None, lock_timeout=30, wait_timeout=20, result_timeout=10, poll_interval=0.05,
+                 not_found=(NotFoundError,), private=(PrivateError,)):
+        self.name = name
+        if client is None:
+            from .utils import cache as client
+        self.client = client
+        self.lock_timeout = lock_timeout
+        self.wait_timeout = wait_timeout
+        self.result_timeout = result_timeout
+        self.poll_interval = poll_interval
+        self.not_found = not_found
+        self.private = private
+        self.calls = 0
+        self.leaders = 0
+        self.coalesced_local = 0
+        self.coalesced_remote = 0
+        self._lock = threading.Lock()
+        self._inflight = {}
+        flights[name] = self
+
+    def run(self, key, fetch):
+        """Return fetch() for key, sharing one call with every concurrent caller of the same key."""
+        with self._lock:
+            self.calls += 1
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+            elif call.owner == threading.get_ident():
+                # Waiting on ourselves would never return
+                raise RuntimeError(f"Recursive single flight call for {key}")
+            else:
+                self.coalesced_local += 1
+        if not leader:
+            return call.wait()
+        try:
+            call.result = self._run_shared(key, fetch)
+        except BaseException as e:
+            call.error = e
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            call.done.set()
+        return call.wait()
+
+    def _run_shared(self, key, fetch):
+        lock_key = f"singleflight:{self.name}:{key}"
+        result_key = f"{lock_key}:result"
+        deadline = time.monotonic() + self.wait_timeout
+        waited = False
+        while True:
+            try:
+                lock = self.client.lock(lock_key, timeout=self.lock_timeout)
+                acquired = lock.acquire(blocking=False)
+            except Exception as e:
+                # Without Redis we can still coalesce inside this process
+                print(f"Single flight lock unavailable for {key}: {e}")
+                with self._lock:
+                    self.leaders += 1
+                return fetch()
+
+            if acquired:
+                with self._lock:
+                    self.leaders += 1
+                try:
+                    try:
+                        result = fetch()
+                    except self.private + self.not_found as e:
+                        self._publish(key, result_key, self._error(key, e))
+                        raise
+                    self._publish(key, result_key, {'result': result})
+                    return result
+                finally:
+                    try:
+                        lock.release()
+                    except Exception:
+                        pass
+
+            # Someone in another worker is fetching, wait for their result
+            if not waited:
+                waited = True
+                with self._lock:
+                    self.coalesced_remote += 1
+            while time.monotonic() < deadline:
+                try:
+                    result = self.client.get(result_key)
+                    if result is None and not self.client.exists(lock_key):
+                        break
+                except Exception:
+                    break
+                if result is not None:
+                    return self._outcome(json.loads(result))
+                time.sleep(self.poll_interval)
+            else:
+                # Waited long enough, go upstream ourselves
+                return fetch()
+
+    def _publish(self, key, result_key, outcome):
+        try:
+            self.client.setex(result_key, self.result_timeout, json.dumps(outcome))
+        except Exception as e:
+            print(f"Could not publish single flight result for {key}: {e}")
+
+    def _error(self, key, error):
+        if isinstance(error, self.private):
+            return {'error': 'private', 'message': str(error) or f"{key} is private"}
+        # str() of a KeyError is the repr of its argument
+        message = error.args[0] if isinstance(error, KeyError) and error.args else str(error)
+        return {'error': 'not_found', 'message': str(message or key)}
+
+    @staticmethod
+    def _outcome(published):
+        if 'error' not in published:
+            return published['result']
+        if published['error'] == 'private':
+            raise PrivateError(published['message'])
+        raise NotFoundError(published['message'])
+
+    def stats(self):
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'upstream_calls': self.leaders,
+                'coalesced_local': self.coalesced_local,
+                'coalesced_remote': self.coalesced_remote,
+                'in_flight': len(self._inflight),
+            }
+
+class _Call:
+    def __init__(self):
+        self.owner = threading.get_ident()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+# Every SingleFlight by name, for reporting
+flights = {}
+
+def stats():
+    return {name: flight.stats() for name, flight in flights.items()}
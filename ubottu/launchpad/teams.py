@@ -0,0 +1,131 @@
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from .codec import codec
+from .errors import launchpad_errors
+from .http_client import http
+from .launchpad_singleton import launchpad_client
+from .singleflight import SingleFlight
+
+class TeamExpansion:
+    """The outcome of expanding one team: its people and what it took to find them"""
+    def __init__(self, team):
+        self.team = team
+        self.people = set()
+        self.teams = set()
+        self.failed = []
+        self.http_calls = 0
+        self.truncated = False
+
+    def as_dict(self):
+        return {'teams': len(self.teams), 'http_calls': self.http_calls, 'failed_teams': sorted(self.failed),
+                'truncated': self.truncated}
+
+class TeamExpander:
+    """
+    Expands Launchpad teams into the people in them.
+
+    The team graph is walked breadth first: every team of a level has its
+    direct members fetched concurrently by a pool of workers, and the
+    sub-teams found make up the next level. A visited set keeps shared
+    sub-teams and membership cycles from being fetched twice, and at most
+    max_teams teams are expanded. Each team's direct members are cached on
+    their own for timeout seconds, so teams shared by several groups cost
+    one fetch. A sub-team that fails is skipped and reported, only the
+    top level team failing is an error. expand(refresh=True) ignores those
+    cached entries and fetches every team again, for the prefetcher, whose
+    refreshes would otherwise re-store members cached alongside the group.
+    """
+    def __init__(self, cache, workers=8, max_teams=500, timeout=1800):
+        self.cache = cache
+        self.workers = workers
+        self.max_teams = max_teams
+        self.timeout = timeout
+        self.flight = SingleFlight('launchpad_teams', client=cache)
+        self._executor = None
+        self._pid = None
+
+    @property
+    def executor(self):
+        # Created per process, uWSGI forks after import
+        if self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='team-expansion')
+            self._pid = os.getpid()
+        return self._executor
+
+    def key(self, team):
+        return f"team_direct_{team}"
+
+    def expand(self, team, recurse=True, refresh=False):
+        """Return the TeamExpansion of team, raising NotFoundError if it does not exist."""
+        expansion = TeamExpansion(team)
+        expansion.teams.add(team)
+        people, subteams, calls = self.direct_members(team, refresh)
+        expansion.people.update(people)
+        expansion.http_calls += calls
+        level = [subteam for subteam in subteams if subteam not in expansion.teams] if recurse else []
+        while level:
+            if len(expansion.teams) + len(level) > self.max_teams:
+                level = level[:self.max_teams - len(expansion.teams)]
+                expansion.truncated = True
+            expansion.teams.update(level)
+            # The whole level's cached teams in one round trip, only the rest go to Launchpad
+            results = {} if refresh else self.cached_members(level)
+            futures = {subteam: self.executor.submit(self.flight.run, subteam,
+                                                     functools.partial(self._fetch_direct_members, subteam))
+                       for subteam in level if subteam not in results}
+            next_level = []
+            for subteam in level:
+                try:
+                    people, subteams, calls = results[subteam] if subteam in results else futures[subteam].result()
+                except Exception as e:
+                    print(f"Could not expand sub-team {subteam} of {team}: {e}")
+                    expansion.failed.append(subteam)
+                    continue
+                expansion.people.update(people)
+                expansion.http_calls += calls
+                next_level.extend(t for t in subteams if t not in expansion.teams and t not in next_level)
+            if expansion.truncated:
+                break
+            level = next_level
+        return expansion
+
+    def cached_members(self, teams):
+        """{team: (people, sub-teams, 0)} for those of teams whose direct members are cached."""
+        try:
+            cached = self.cache.get_many(self.key(team) for team in teams)
+        except Exception as e:
+            print(f"Could not read cached members of {', '.join(teams)}: {e}")
+            return {}
+        results = {}
+        for team, members in zip(teams, cached):
+            if members:
+                members = codec.loads(members)
+                results[team] = (members['people'], members['teams'], 0)
+        return results
+
+    def direct_members(self, team, refresh=False):
+        """Return (people, sub-teams, HTTP calls made) for the team's direct members."""
+        cached = None
+        try:
+            if not refresh:
+                cached = self.cache.get(self.key(team))
+        except Exception as e:
+            print(f"Could not read cached members of {team}: {e}")
+        if cached:
+            cached = codec.loads(cached)
+            return cached['people'], cached['teams'], 0
+        return self.flight.run(team, lambda: self._fetch_direct_members(team))
+
+    def _fetch_direct_members(self, team):
+        with http.counting() as calls:
+            people, teams = [], []
+            # The members collection carries name and is_team, no request per member
+            with launchpad_client() as launchpad, launchpad_errors(team):
+                for person in launchpad.people[team].members:
+                    (teams if person.is_team else people).append(person.name)
+        try:
+            self.cache.setex(self.key(team), self.timeout, codec.dumps({'people': people, 'teams': teams}))
+        except Exception as e:
+            print(f"Could not cache members of {team}: {e}")
+        return people, teams, calls.count
@@ -0,0 +1,550 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import aiohttp
+import redis
+from types import SimpleNamespace
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock, skipUnless
+from django.test import SimpleTestCase
+from rest_framework.test import APIClient
+from lazr.restfulclient.errors import NotFound
+from .singleflight import SingleFlight
+from .http_client import HTTPClient, http
+from .prefetch import Prefetcher
+from .teams import TeamExpander
+from .cache_client import CacheClient, LocalCache
+from .codec import CacheCodec, ZLIB
+from .errors import NotFoundError, PrivateError, UpstreamError
+from . import utils as launchpad_utils
+from .launchpad_singleton import LaunchpadClients
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+class UnavailableRedis:
+    def __getattr__(self, name):
+        def fail(*args, **kwargs):
+            raise ConnectionError('Redis is down')
+        return fail
+
+class FakeUpstream:
+    """A slow upstream that counts how often it is called"""
+    def __init__(self, delay=0.2):
+        self.delay = delay
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def fetch(self):
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        return {'id': 1, 'title': 'A bug'}
+
+def fire(count, target):
+    """Call target(i) from count threads at the same moment, returning their results"""
+    barrier = threading.Barrier(count)
+    results = [None] * count
+    def run(i):
+        barrier.wait()
+        results[i] = target(i)
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+class FlakyRedis(LocalCache):
+    """A LocalCache that can be taken down like a Redis server"""
+    def __init__(self):
+        super().__init__()
+        self.down = False
+        self.calls = 0
+
+    def __getattribute__(self, name):
+        attribute = super().__getattribute__(name)
+        if name in ('get', 'setex', 'mget', 'ttl', 'zincrby'):
+            self.calls += 1
+            if self.down:
+                raise redis.exceptions.ConnectionError('Redis is down')
+        return attribute
+
+    def zincrby(self, name, amount, value):
+        return amount
+
+class CacheClientTests(SimpleTestCase):
+    def setUp(self):
+        self.redis = FlakyRedis()
+        self.cache = CacheClient(client=self.redis, failure_threshold=2, reset_timeout=60, local_timeout=30)
+
+    def test_falls_back_to_local_cache_while_redis_is_down(self):
+        self.cache.setex('kept', 3600, 'in redis')
+        self.redis.down = True
+        self.assertIsNone(self.cache.get('kept'))
+        self.cache.setex('written', 3600, 'during the outage')
+        self.assertEqual(self.cache.breaker.state, 'open')
+        calls = self.redis.calls
+        # Served locally, without touching Redis again and kept only briefly
+        self.assertEqual(self.cache.get('written'), b'during the outage')
+        self.assertLessEqual(self.cache.ttl('written'), 30)
+        self.assertEqual(self.redis.calls, calls)
+        with self.assertRaises(redis.exceptions.ConnectionError):
+            self.cache.zincrby('hits', 1, 'bug')
+
+    def test_closes_again_once_redis_answers(self):
+        self.redis.down = True
+        self.cache.get('a')
+        self.cache.get('a')
+        self.assertEqual(self.cache.breaker.state, 'open')
+        self.redis.down = False
+        with mock.patch('launchpad.cache_client.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertEqual(self.cache.breaker.state, 'half-open')
+            self.cache.get('a')
+        self.assertEqual(self.cache.breaker.state, 'closed')
+
+    def test_other_errors_during_the_trial_do_not_keep_it_open(self):
+        self.redis.down = True
+        self.cache.get('a')
+        self.cache.get('a')
+        self.redis.down = False
+        with mock.patch('launchpad.cache_client.time.monotonic', return_value=time.monotonic() + 61), \
+                mock.patch.object(self.redis, 'get', side_effect=TypeError('bad reply')):
+            with self.assertRaises(TypeError):
+                self.cache.get('a')
+        with mock.patch('launchpad.cache_client.time.monotonic', return_value=time.monotonic() + 61):
+            self.cache.get('a')
+        self.assertEqual(self.cache.breaker.state, 'closed')
+
+    def test_batch_reads_and_writes(self):
+        self.cache.set_many({'a': '1', 'b': '2'}, 60)
+        self.assertEqual(self.cache.get_many(['a', 'missing', 'b']), [b'1', None, b'2'])
+        self.assertEqual(self.cache.get_many([]), [])
+
+class CacheCodecTests(SimpleTestCase):
+    def test_round_trips_and_compresses_large_values(self):
+        codec = CacheCodec(compress_min=100)
+        small, large = {'people': ['alice'], 'teams': []}, {'people': [f'member-{n}' for n in range(500)]}
+        self.assertEqual(codec.loads(codec.dumps(small)), small)
+        self.assertEqual(codec.loads(codec.dumps(large)), large)
+        self.assertEqual(codec.dumps(small)[2] & ZLIB, 0)
+        self.assertTrue(codec.dumps(large)[2] & ZLIB)
+        self.assertLess(len(codec.dumps(large)), len(json.dumps(large)) / 4)
+
+    def test_reads_plain_json_and_encodes_without_msgpack(self):
+        codec = CacheCodec(use_msgpack=False)
+        self.assertEqual(codec.loads(json.dumps({'a': [1, 2]}).encode()), {'a': [1, 2]})
+        self.assertEqual(codec.loads(codec.dumps({'a': [1, 2]})), {'a': [1, 2]})
+        self.assertEqual(CacheCodec().loads(codec.dumps(['x'])), ['x'])
+
+    def test_group_mxids_are_derived_not_stored(self):
+        redis_cache = LocalCache()
+        expansion = SimpleNamespace(people={'bob', 'alice'}, as_dict=lambda: {'teams': 1})
+        with mock.patch('launchpad.utils.cache', redis_cache), \
+                mock.patch.object(launchpad_utils.team_expander, 'expand', return_value=expansion):
+            fetched = launchpad_utils._fetch_group_members('motu', False)
+        stored = redis_cache.get('group_members_motu')
+        self.assertNotIn(b'ubuntu.com', stored)
+        self.assertEqual(launchpad_utils._load_group(stored), fetched)
+        self.assertEqual(fetched['mxids'], ['@alice:ubuntu.com', '@bob:ubuntu.com'])
+
+    def test_recursive_groups_are_cached_apart(self):
+        redis_cache = LocalCache()
+        expansion = SimpleNamespace(people={'bob'}, as_dict=lambda: {'teams': 2})
+        with mock.patch('launchpad.utils.cache', redis_cache), \
+                mock.patch.object(launchpad_utils.team_expander, 'expand', return_value=expansion):
+            launchpad_utils._fetch_group_members('motu', True)
+            self.assertIsNone(redis_cache.get('group_members_motu'))
+            self.assertIsNone(launchpad_utils._group_members_expire_in('motu'))
+            self.assertGreater(launchpad_utils._group_members_expire_in('motu', True), 0)
+
+class SingleFlightTests(SimpleTestCase):
+    def test_concurrent_calls_share_one_upstream_call(self):
+        upstream = FakeUpstream()
+        flight = SingleFlight('test-local', client=UnavailableRedis())
+        results = fire(10, lambda i: flight.run('bug_1', upstream.fetch))
+        self.assertEqual(upstream.calls, 1)
+        self.assertTrue(all(result == {'id': 1, 'title': 'A bug'} for result in results))
+        self.assertEqual(flight.stats()['coalesced_local'], 9)
+
+    def test_errors_reach_every_waiter(self):
+        def fail():
+            time.sleep(0.1)
+            raise KeyError('missing')
+        flight = SingleFlight('test-errors', client=UnavailableRedis())
+        def call(i):
+            try:
+                return flight.run('bug_1', fail)
+            except KeyError:
+                return 'missing'
+        self.assertEqual(fire(5, call), ['missing'] * 5)
+
+    def test_recursive_call_fails_instead_of_deadlocking(self):
+        flight = SingleFlight('test-recursive', client=UnavailableRedis())
+        with self.assertRaises(RuntimeError):
+            flight.run('group', lambda: flight.run('group', lambda: None))
+
+    @skipUnless(fakeredis, 'fakeredis is not installed')
+    def test_workers_coalesce_through_redis(self):
+        server = fakeredis.FakeServer()
+        upstream = FakeUpstream()
+        # One SingleFlight per simulated worker, sharing only Redis
+        workers = [SingleFlight('test-remote', client=fakeredis.FakeRedis(server=server)) for i in range(4)]
+        results = fire(4, lambda i: workers[i].run('bug_1', upstream.fetch))
+        self.assertTrue(all(result == {'id': 1, 'title': 'A bug'} for result in results))
+        self.assertEqual(upstream.calls, 1)
+        self.assertEqual(sum(worker.stats()['coalesced_remote'] for worker in workers), 3)
+
+    @skipUnless(fakeredis, 'fakeredis is not installed')
+    def test_workers_share_not_found_outcomes(self):
+        server = fakeredis.FakeServer()
+        calls = []
+        def fetch():
+            calls.append(1)
+            time.sleep(0.2)
+            raise NotFoundError('no-such-team')
+        workers = [SingleFlight('test-remote-missing', client=fakeredis.FakeRedis(server=server)) for i in range(4)]
+        def call(i):
+            try:
+                return workers[i].run('group', fetch)
+            except NotFoundError as e:
+                return e.args[0]
+        self.assertEqual(fire(4, call), ['no-such-team'] * 4)
+        self.assertEqual(len(calls), 1)
+
+class LaunchpadClientsTests(SimpleTestCase):
+    def setUp(self):
+        self.clients = LaunchpadClients(size=2, cache_dir='/tmp/ubottu-test-launchpadlib', retry_after=60,
+                                        wait_timeout=0.1)
+        def login(*args, **kwargs):
+            return SimpleNamespace(_browser=SimpleNamespace(_connection=SimpleNamespace(request=None)), args=args)
+        patcher = mock.patch('launchpad.launchpad_singleton.Launchpad.login_anonymously', side_effect=login)
+        self.login = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_clients_are_checked_out_and_reused(self):
+        with self.clients.client() as first, self.clients.client() as second:
+            self.assertIsNot(first, second)
+            # Both are busy, the next lookup gives up waiting
+            with self.assertRaises(UpstreamError):
+                with self.clients.client():
+                    pass
+        with self.clients.client() as client:
+            self.assertIn(client, (first, second))
+        self.assertEqual(self.clients.stats()['exhausted'], 1)
+        self.assertEqual(self.clients.created, 2)
+        self.assertEqual({call.args[2] for call in self.login.call_args_list}, {'/tmp/ubottu-test-launchpadlib'})
+
+    def test_waiters_get_the_clients_handed_back(self):
+        self.clients.wait_timeout = 5
+        def lookup(i):
+            with self.clients.client() as client:
+                time.sleep(0.05)
+                return client
+        self.assertEqual(len(set(map(id, fire(6, lookup)))), 2)
+        self.assertEqual(self.clients.created, 2)
+
+    def test_warms_up_to_size(self):
+        self.clients.warm(5)
+        self.assertEqual(self.clients.created, 2)
+        self.assertEqual(self.clients.stats()['idle'], 2)
+        with self.clients.client():
+            pass
+        self.assertEqual(self.clients.created, 2)
+
+    def test_clients_of_the_parent_are_dropped_after_fork(self):
+        with self.clients.client() as parent:
+            pass
+        with mock.patch('launchpad.launchpad_singleton.os.getpid', return_value=os.getpid() + 1):
+            with self.clients.client() as child:
+                self.assertIsNot(child, parent)
+        self.assertEqual(self.login.call_count, 2)
+
+    def test_failures_in_the_parent_are_forgotten_after_fork(self):
+        self.login.side_effect = ConnectionError('no route to host')
+        with self.assertRaises(UpstreamError):
+            self.clients.checkout()
+        self.login.side_effect = None
+        with mock.patch('launchpad.launchpad_singleton.os.getpid', return_value=os.getpid() + 1):
+            self.clients.checkout()
+        self.assertEqual(self.login.call_count, 2)
+
+    def test_clients_without_a_connection_are_not_instrumented(self):
+        self.login.side_effect = lambda *args, **kwargs: SimpleNamespace()
+        with self.clients.client() as client:
+            self.assertIsNotNone(client)
+
+    def test_failures_are_not_retried_right_away(self):
+        self.login.side_effect = ConnectionError('no route to host')
+        with self.assertRaises(UpstreamError):
+            self.clients.checkout()
+        self.clients.warm()
+        with self.assertRaises(UpstreamError):
+            self.clients.checkout()
+        self.assertEqual(self.login.call_count, 1)
+        # A failed login does not use up the pool
+        self.assertEqual(self.clients.stats()['clients'], 0)
+
+@skipUnless(fakeredis, 'fakeredis is not installed')
+class PrefetcherTests(SimpleTestCase):
+    def setUp(self):
+        self.prefetcher = Prefetcher(client=fakeredis.FakeRedis(), min_hits=2, lead_time=60, workers=2, flush_interval=0)
+        self.expiry = {'hot': 30, 'fresh': 3600, 'cold': None, 'rare': 10}
+        self.refreshed = []
+        self.prefetcher.register('bug', self.expiry.get, self.refreshed.append)
+
+    def test_refreshes_hot_entries_about_to_expire(self):
+        for name in ('hot', 'hot', 'fresh', 'fresh', 'cold', 'cold', 'rare'):
+            self.prefetcher.record('bug', name)
+        self.assertEqual(self.prefetcher.run_once(), 2)
+        self.assertEqual(sorted(self.refreshed), ['cold', 'hot'])
+
+    def test_hits_decay(self):
+        self.prefetcher.record_many([('bug', 'hot')] * 4)
+        self.prefetcher.run_once()
+        self.prefetcher.run_once()
+        self.assertEqual(self.refreshed, ['hot', 'hot'])
+        # Down to one hit's worth, below min_hits
+        self.assertEqual(self.prefetcher.hot(), [])
+
+    def test_hits_are_written_in_batches(self):
+        self.prefetcher.record_many([('bug', 'hot')] * 3)
+        self.prefetcher.record('bug', 'cold')
+        self.assertIsNone(self.prefetcher.client.zscore(self.prefetcher.key, json.dumps(['bug', 'hot'])))
+        self.assertEqual(self.prefetcher.flush(), 2)
+        self.assertEqual(self.prefetcher.client.zscore(self.prefetcher.key, json.dumps(['bug', 'hot'])), 3)
+        self.assertEqual(self.prefetcher.flush(), 0)
+
+    def test_hits_are_kept_while_redis_is_down(self):
+        self.prefetcher._client = UnavailableRedis()
+        self.prefetcher.record_many([('bug', 'hot')] * 2)
+        self.assertEqual(self.prefetcher.flush(), 0)
+        self.prefetcher._client = fakeredis.FakeRedis()
+        self.assertEqual(self.prefetcher.flush(), 1)
+        self.assertEqual([(kind, args) for kind, args, score in self.prefetcher.hot()], [('bug', ['hot'])])
+
+    def test_failed_refresh_does_not_stop_the_pass(self):
+        def refresh(name):
+            if name == 'hot':
+                raise KeyError(name)
+            self.refreshed.append(name)
+        self.prefetcher.register('bug', self.expiry.get, refresh)
+        self.prefetcher.record_many([('bug', 'hot'), ('bug', 'hot'), ('bug', 'cold'), ('bug', 'cold')])
+        self.assertEqual(self.prefetcher.run_once(), 1)
+        self.assertEqual(self.refreshed, ['cold'])
+
+class FakeTeams:
+    """Stands in for launchpad.people, each team's members fetch counting as one HTTP call"""
+    def __init__(self, graph):
+        self.graph = graph
+        self.fetched = []
+
+    def __getitem__(self, name):
+        self.fetched.append(name)
+        if name not in self.graph:
+            raise NotFound(mock.Mock(status=404), b'')
+        http.observe('api.launchpad.net', 0.01)
+        members = [SimpleNamespace(name=member, is_team=member in self.graph or member.endswith('-team'))
+                   for member in self.graph[name]]
+        return SimpleNamespace(members=members)
+
+class TeamExpanderTests(SimpleTestCase):
+    graph = {
+        'ubuntu-core': ['alice', 'bob', 'core-dev', 'motu'],
+        'core-dev': ['carol', 'motu', 'ubuntu-core'],
+        'motu': ['dave', 'alice', 'gone-team'],
+    }
+
+    def setUp(self):
+        self.people = FakeTeams(self.graph)
+        patcher = mock.patch('launchpad.teams.launchpad_client',
+                             return_value=nullcontext(SimpleNamespace(people=self.people)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.expander = TeamExpander(LocalCache(), workers=4)
+        self.expander.flight = SingleFlight('test-teams', client=UnavailableRedis())
+
+    def test_expands_breadth_first_once_per_team(self):
+        expansion = self.expander.expand('ubuntu-core')
+        self.assertEqual(expansion.people, {'alice', 'bob', 'carol', 'dave'})
+        # The cycle back to ubuntu-core and the shared motu are fetched once
+        self.assertEqual(sorted(self.people.fetched), ['core-dev', 'gone-team', 'motu', 'ubuntu-core'])
+        self.assertEqual(expansion.as_dict(), {'teams': 4, 'http_calls': 3, 'failed_teams': ['gone-team'],
+                                               'truncated': False})
+
+    def test_sub_teams_are_cached_on_their_own(self):
+        self.expander.expand('motu')
+        expansion = self.expander.expand('core-dev')
+        self.assertEqual(expansion.people, {'alice', 'bob', 'carol', 'dave'})
+        self.assertEqual(self.people.fetched.count('motu'), 1)
+
+    def test_without_recursion_and_with_limits(self):
+        self.assertEqual(self.expander.expand('ubuntu-core', recurse=False).people, {'alice', 'bob'})
+        self.expander.max_teams = 2
+        self.assertTrue(self.expander.expand('ubuntu-core').truncated)
+        with self.assertRaises(KeyError):
+            self.expander.expand('nobody')
+
+    def test_refresh_skips_cached_teams(self):
+        self.expander.expand('motu')
+        self.expander.expand('motu', refresh=True)
+        self.assertEqual(self.people.fetched.count('motu'), 2)
+
+    def test_prefetch_refresh_reaches_launchpad(self):
+        with mock.patch('launchpad.utils.cache', LocalCache()), \
+                mock.patch.object(launchpad_utils, 'team_expander', self.expander), \
+                mock.patch.object(launchpad_utils.group_flight, 'client', UnavailableRedis()):
+            launchpad_utils.lookup_group_members('ubuntu-core', True)
+            launchpad_utils._refresh_group_members('ubuntu-core', True)
+        self.assertEqual(self.people.fetched.count('ubuntu-core'), 2)
+        self.assertEqual(self.people.fetched.count('core-dev'), 2)
+
+class FakeProfiles:
+    """Stands in for launchpad.people when looking up Matrix accounts"""
+    accounts = {'bob': [{'identity': {'username': 'bob', 'homeserver': 'matrix.org'}}], 'carol': []}
+
+    def __init__(self):
+        self.fetched = []
+
+    def __getitem__(self, name):
+        self.fetched.append(name)
+        if name not in self.accounts:
+            raise KeyError(name)
+        return SimpleNamespace(getSocialAccountsByPlatform=lambda platform: self.accounts[name])
+
+class GroupMatrixAccountsTests(SimpleTestCase):
+    def setUp(self):
+        self.redis = LocalCache()
+        self.people = FakeProfiles()
+        group = {'group_members': ('alice', 'bob', 'carol', 'dave'), 'group_name': 'motu'}
+        for patcher in (mock.patch('launchpad.utils.cache', self.redis),
+                        mock.patch('launchpad.utils.lookup_group_members', return_value=group),
+                        mock.patch('launchpad.utils.launchpad_client',
+                                   return_value=nullcontext(SimpleNamespace(people=self.people))),
+                        mock.patch.object(launchpad_utils.matrix_flight, 'client', UnavailableRedis())):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.redis.setex('matrix_alice', 1800, json.dumps(['@alice:example.org']))
+
+    def test_merges_real_accounts_with_fallbacks(self):
+        result = launchpad_utils.fetch_group_matrix_accounts('motu')
+        self.assertEqual(result['members'], {'alice': ['@alice:example.org'], 'bob': ['@bob:matrix.org'],
+                                             'carol': ['@carol:ubuntu.com'], 'dave': ['@dave:ubuntu.com']})
+        self.assertEqual((result['resolved'], result['refreshed'], result['failed']), (2, 2, ['dave']))
+        self.assertEqual(sorted(self.people.fetched), ['bob', 'carol', 'dave'])
+
+    def test_only_expired_members_are_refreshed(self):
+        launchpad_utils.fetch_group_matrix_accounts('motu')
+        self.redis.delete('matrix_bob')
+        self.people.fetched.clear()
+        result = launchpad_utils.fetch_group_matrix_accounts('motu')
+        self.assertEqual(sorted(self.people.fetched), ['bob', 'dave'])
+        self.assertEqual(result['members']['bob'], ['@bob:matrix.org'])
+
+class GroupLookupErrorTests(SimpleTestCase):
+    def setUp(self):
+        self.redis = LocalCache()
+        self.expand = mock.Mock(side_effect=NotFoundError('no-such-team'))
+        for patcher in (mock.patch('launchpad.utils.cache', self.redis),
+                        mock.patch.object(launchpad_utils.negative_cache, '_client', self.redis),
+                        mock.patch.object(launchpad_utils.team_expander, 'expand', self.expand),
+                        mock.patch.object(launchpad_utils.group_flight, 'client', UnavailableRedis())):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_missing_group_is_a_remembered_404(self):
+        for _ in range(3):
+            response = APIClient().get('/launchpad/api/groups/members/no-such-team/')
+            self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.expand.call_count, 1)
+        self.assertFalse(launchpad_utils.fetch_group_members('no-such-team'))
+
+    def test_private_and_failing_lookups(self):
+        self.expand.side_effect = PrivateError('secret-team is private')
+        self.assertEqual(APIClient().get('/launchpad/api/groups/members/secret-team/').status_code, 403)
+        self.expand.side_effect = UpstreamError('Launchpad failed looking up flaky: 503')
+        self.assertEqual(APIClient().get('/launchpad/api/groups/members/flaky/').status_code, 502)
+        self.assertEqual(APIClient().get('/launchpad/api/groups/members/flaky/').status_code, 502)
+        # Upstream failures are not remembered
+        self.assertEqual(self.expand.call_count, 3)
+
+class FlakyUpstream(BaseHTTPRequestHandler):
+    """Fails the first two requests of each path, then answers"""
+    seen = {}
+
+    def do_GET(self):
+        self.seen[self.path] = self.seen.get(self.path, 0) + 1
+        if self.seen[self.path] <= 2:
+            self.send_response(503 if self.path != '/limited' else 429)
+            self.send_header('Retry-After', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(b'{"ok": true}')
+
+    def log_message(self, *args):
+        pass
+
+class HTTPClientTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FlakyUpstream)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f'http://127.0.0.1:{cls.server.server_port}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        super().tearDownClass()
+
+    def test_retries_until_success(self):
+        client = HTTPClient(retries=2, backoff=0.01)
+        for path in ('/unavailable', '/limited'):
+            self.assertEqual(client.get(self.url + path).json(), {'ok': True})
+        stats = client.stats()[f'127.0.0.1:{self.server.server_port}']
+        self.assertEqual((stats['requests'], stats['retries'], stats['errors']), (6, 4, 2))
+
+    def test_async_retries(self):
+        client = HTTPClient(retries=2, backoff=0.01)
+        async def get():
+            async with aiohttp.ClientSession() as session:
+                return await client.aget(session, self.url + '/async')
+        response = asyncio.run(get())
+        self.assertEqual((response.status_code, response.json()), (200, {'ok': True}))
+        self.assertEqual(client.stats()[f'127.0.0.1:{self.server.server_port}']['retries'], 2)
+
+    def test_gives_up_after_retries(self):
+        client = HTTPClient(retries=1, backoff=0.01)
+        self.assertEqual(client.get(self.url + '/down').status_code, 503)
+        self.assertIs(client.session(self.url + '/a'), client.session(self.url + '/b'))
+
+    def test_backoff_is_jittered_and_capped(self):
+        client = HTTPClient(backoff=1, max_backoff=4)
+        self.assertTrue(all(0 <= client.retry_delay(attempt) <= 4 for attempt in range(10)))
+        self.assertEqual(client.retry_delay(0, '2'), 2)
+        self.assertEqual(client.retry_delay(0, '600'), 4)
+
+class AsyncViewTests(SimpleTestCase):
+    async def test_group_members(self):
+        group = {'group_name': 'motu', 'group_members': ['alice'], 'mxids': ['@alice:ubuntu.com']}
+        with mock.patch('launchpad.views.lookup_group_members', return_value=group):
+            response = await self.async_client.get('/launchpad/async/api/groups/members/motu/')
+        self.assertEqual(response.json()['mxids'], ['@alice:ubuntu.com'])
+        with mock.patch('launchpad.views.lookup_group_members', side_effect=PrivateError('motu is private')):
+            response = await self.async_client.get('/launchpad/async/api/groups/members/motu/')
+        self.assertEqual(response.status_code, 403)
+
+    async def test_matrix_profiles(self):
+        with mock.patch('launchpad.views.lookup_matrix_accounts', return_value=['@bob:matrix.org']):
+            response = await self.async_client.get('/launchpad/async/api/people/bob/socials/matrix')
+        self.assertEqual(response.json(), ['@bob:matrix.org'])
+        with mock.patch('launchpad.views.lookup_matrix_accounts', side_effect=NotFoundError('nobody')):
+            response = await self.async_client.get('/launchpad/async/api/people/nobody/socials/matrix')
+        self.assertEqual(response.status_code, 404)
\ No newline at end of file
@@ -4,5 +4,9 @@ from . import views
 urlpatterns = [
     #path('', views.list_facts, name='facts-list'),
     path('api/groups/members/<str:group_name>/', views.group_members, name='get_group_members'),
-    path('api/people/<str:profile_id>/socials/matrix', views.matrix_profiles, name='get_matrix_accounts')
+    path('api/groups/matrix/<str:group_name>/', views.group_matrix_accounts, name='get_group_matrix_accounts'),
+    path('api/people/<str:profile_id>/socials/matrix', views.matrix_profiles, name='get_matrix_accounts'),
+    path('async/api/groups/members/<str:group_name>/', views.group_members_async, name='get_group_members_async'),
+    path('async/api/people/<str:profile_id>/socials/matrix', views.matrix_profiles_async,
+         name='get_matrix_accounts_async'),
 ]
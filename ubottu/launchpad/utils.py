@@ -1,38 +1,53 @@
-import redis
-import json
+import functools
+import os
 import traceback
-from .launchpad_singleton import get_launchpad
+from concurrent.futures import ThreadPoolExecutor
+from .launchpad_singleton import launchpad_client
+from .singleflight import SingleFlight
+from .prefetch import prefetcher
+from .teams import TeamExpander
+from .cache_client import CacheClient, AsyncCacheClient
+from .codec import codec
+from .errors import launchpad_errors
+from .negative import NegativeCache
+from django.conf import settings
 
-# Connect to Redis
-cache = redis.Redis(host='localhost', port=6379, db=0)
+# Connect to Redis, falling back to an in-process cache while it is unreachable
+cache = CacheClient(
+    url=getattr(settings, 'CACHE_REDIS_URL', 'redis://localhost:6379/0'),
+    max_connections=getattr(settings, 'CACHE_REDIS_MAX_CONNECTIONS', 50),
+    socket_timeout=getattr(settings, 'CACHE_REDIS_SOCKET_TIMEOUT', 2),
+    connect_timeout=getattr(settings, 'CACHE_REDIS_CONNECT_TIMEOUT', 1),
+    failure_threshold=getattr(settings, 'CACHE_REDIS_FAILURE_THRESHOLD', 3),
+    reset_timeout=getattr(settings, 'CACHE_REDIS_RESET_TIMEOUT', 10),
+    local_timeout=getattr(settings, 'CACHE_LOCAL_TIMEOUT', 300),
+)
+async_cache = AsyncCacheClient(cache)
 
-def fetch_matrix_accounts(profile_id):
-    try:
-        # Try to fetch from cache first
-        cached_result = cache.get(f"matrix_{profile_id}")
-        if cached_result:
-            return json.loads(cached_result)
+# Lookups that found nothing or something private are not repeated for a while
+negative_cache = NegativeCache(cache, not_found_timeout=getattr(settings, 'NEGATIVE_CACHE_NOT_FOUND_TIMEOUT', 300),
+                               private_timeout=getattr(settings, 'NEGATIVE_CACHE_PRIVATE_TIMEOUT', 900))
 
-        # Fetch Launchpad API data
-        launchpad = get_launchpad()
-        person = launchpad.people[profile_id]
+# Concurrent misses for the same profile/group share one Launchpad call
+matrix_flight = SingleFlight('launchpad_matrix', client=cache)
+group_flight = SingleFlight('launchpad_groups', client=cache)
 
-        # Fetch social accounts by platform (Matrix)
-        matrix_accounts = person.getSocialAccountsByPlatform(platform='Matrix platform')
+team_expander = TeamExpander(cache, workers=getattr(settings, 'LAUNCHPAD_TEAM_WORKERS', 8),
+                             max_teams=getattr(settings, 'LAUNCHPAD_MAX_TEAMS', 500))
 
-        # Extract the Matrix IDs
-        matrix_ids = []
-        for account in matrix_accounts:
-            username = account['identity']['username']
-            homeserver = account['identity']['homeserver']
-            matrix_id = f"@{username}:{homeserver}"
-            matrix_ids.append(matrix_id)
+MATRIX_WORKERS = getattr(settings, 'LAUNCHPAD_MATRIX_WORKERS', 8)
+_matrix_executor = None
+_matrix_executor_pid = None
 
-        # Cache the result with expiration time of 30 minutes (1800 seconds)
-        cache.setex(f"matrix_{profile_id}", 1800, json.dumps(matrix_ids))
+def _read(key):
+    # The positive and negative entries of key in one round trip, raising the error remembered in the latter
+    cached_result, missing = cache.get_many([key, negative_cache.key(key)])
+    negative_cache.raise_cached(None if cached_result else missing)
+    return cached_result
 
-        return matrix_ids
-        
+def fetch_matrix_accounts(profile_id):
+    try:
+        return lookup_matrix_accounts(profile_id)
     except KeyError as e:
         print(f"Profile with name {profile_id} was not found. Error: {e}")
         print(traceback.format_exc())
@@ -42,35 +57,86 @@ def fetch_matrix_accounts(profile_id):
         print(traceback.format_exc())
         return False
 
+def lookup_matrix_accounts(profile_id):
+    """fetch_matrix_accounts() raising NotFoundError, PrivateError or UpstreamError instead of returning False."""
+    # Try to fetch from cache first
+    key = f"matrix_{profile_id}"
+    cached_result = _read(key)
+    if cached_result:
+        return codec.loads(cached_result)
+    return matrix_flight.run(profile_id, functools.partial(
+        negative_cache.guard, key, functools.partial(_fetch_matrix_accounts, profile_id)))
+
+def _fetch_matrix_accounts(profile_id):
+    with launchpad_client() as launchpad, launchpad_errors(profile_id):
+        # Fetch Launchpad API data
+        person = launchpad.people[profile_id]
+
+        # Fetch social accounts by platform (Matrix)
+        matrix_accounts = person.getSocialAccountsByPlatform(platform='Matrix platform')
+
+    # Extract the Matrix IDs
+    matrix_ids = []
+    for account in matrix_accounts:
+        username = account['identity']['username']
+        homeserver = account['identity']['homeserver']
+        matrix_id = f"@{username}:{homeserver}"
+        matrix_ids.append(matrix_id)
+
+    # Cache the result with expiration time of 30 minutes (1800 seconds)
+    cache.setex(f"matrix_{profile_id}", 1800, codec.dumps(matrix_ids))
+
+    return matrix_ids
+
+
+def fetch_group_matrix_accounts(group_name, recurse=False):
+    """
+    Map every member of a group to their Matrix IDs.
+
+    Members' Matrix accounts are read from their matrix_<name> cache entries
+    in one MGET, only the members without a live entry are looked up on
+    Launchpad, concurrently and at most LAUNCHPAD_MATRIX_WORKERS at a time.
+    Members without a Matrix account on their profile (or whose lookup
+    failed) keep the @name:ubuntu.com fallback.
+    """
+    group = lookup_group_members(group_name, recurse)
+    names = sorted(group['group_members'])
+    try:
+        cached = cache.get_many(f"matrix_{name}" for name in names)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        cached = [None] * len(names)
+
+    accounts = {name: codec.loads(cached_result) for name, cached_result in zip(names, cached) if cached_result}
+    missing = [name for name in names if name not in accounts]
+    futures = {name: _matrix_pool().submit(matrix_flight.run, name, functools.partial(_fetch_matrix_accounts, name))
+               for name in missing}
+    failed = []
+    for name, future in futures.items():
+        try:
+            accounts[name] = future.result()
+        except Exception as e:
+            print(f"Could not fetch Matrix accounts of {name}: {e}")
+            failed.append(name)
+
+    members = {name: accounts.get(name) or [f"@{name}:ubuntu.com"] for name in names}
+    return {'group_name': group_name, 'members': members,
+            'mxids': [mxid for mxids in members.values() for mxid in mxids],
+            'resolved': sum(1 for name in names if accounts.get(name)),
+            'refreshed': len(missing) - len(failed), 'failed': failed}
+
+def _matrix_pool():
+    # One pool per process, uWSGI forks after import
+    global _matrix_executor, _matrix_executor_pid
+    if _matrix_executor_pid != os.getpid():
+        _matrix_executor = ThreadPoolExecutor(max_workers=MATRIX_WORKERS, thread_name_prefix='matrix-accounts')
+        _matrix_executor_pid = os.getpid()
+    return _matrix_executor
+
 
 def fetch_group_members(group_name, recurse=False):
     try:
-        # Try to fetch from cache first
-        cached_result = cache.get(f"group_members_{group_name}")
-        if cached_result:
-            return json.loads(cached_result)
-
-        # Fetch the group from the Launchpad API
-        launchpad = get_launchpad()
-        group = launchpad.people[group_name]
-        
-        group_members = set()
-        for person in group.members:
-            if not person.is_team:
-                group_members.add(person.name)
-            # Optional recursion to get sub-teams' members
-            elif recurse:
-                sub_group_members = fetch_group_members(person.name, recurse=True)
-                group_members.update(sub_group_members['group_members'])
-
-        # Generate MXIDs for individual members
-        mxids = [f"@{member}:ubuntu.com" for member in group_members]
-        result = {'group_members': tuple(group_members), 'group_name': group_name, 'mxids': mxids}
-
-        # Cache the result with expiration time of 30 minutes (1800 seconds)
-        cache.setex(f"group_members_{group_name}", 1800, json.dumps(result))
-
-        return result
+        return lookup_group_members(group_name, recurse)
     except KeyError as e:
         print(f"Group with name {group_name} was not found. Error: {e}")
         print(traceback.format_exc())
@@ -79,3 +145,84 @@ def fetch_group_members(group_name, recurse=False):
         print(f"An error occurred: {e}")
         print(traceback.format_exc())
         return False
+
+def _group_key(group_name, recurse=False):
+    # A recursive expansion also holds the sub-teams' members, it is cached apart
+    return f"group_members_{group_name}:recurse" if recurse else f"group_members_{group_name}"
+
+def lookup_group_members(group_name, recurse=False):
+    """fetch_group_members() raising NotFoundError, PrivateError or UpstreamError instead of returning False."""
+    # Try to fetch from cache first
+    key = _group_key(group_name, recurse)
+    cached_result = _read(key)
+    if cached_result:
+        result = _load_group(cached_result)
+    else:
+        result = group_flight.run(f"{group_name}:{recurse}", functools.partial(
+            negative_cache.guard, key, functools.partial(_fetch_group_members, group_name, recurse)))
+    # Only groups that exist are worth keeping warm
+    prefetcher.record('group', group_name, recurse)
+    return result
+
+def _fetch_group_members(group_name, recurse, refresh=False):
+    # Breadth first over the sub-teams when recursing, each team's members cached on their own
+    expansion = team_expander.expand(group_name, recurse, refresh=refresh)
+    result = {'group_members': tuple(sorted(expansion.people)), 'group_name': group_name,
+              'expansion': expansion.as_dict()}
+
+    # Cache the result with expiration time of 30 minutes (1800 seconds)
+    cache.setex(_group_key(group_name, recurse), 1800, _dump_group(result))
+
+    return _with_mxids(result)
+
+def _dump_group(result):
+    # The MXIDs are derived from the member names, they are not stored twice
+    return codec.dumps({key: value for key, value in result.items() if key != 'mxids'})
+
+def _load_group(cached_result):
+    result = codec.loads(cached_result)
+    result['group_members'] = tuple(result['group_members'])
+    return _with_mxids(result)
+
+def _with_mxids(result):
+    # Generate MXIDs for individual members
+    result['mxids'] = [f"@{member}:ubuntu.com" for member in result['group_members']]
+    return result
+
+
+def fetch_many_group_members(group_names):
+    """
+    Fetch several groups at once, returning {group name: fetch_group_members() result}.
+
+    All cached groups are read with a single MGET, only the misses go to Launchpad.
+    """
+    group_names = list(dict.fromkeys(group_names))
+    if not group_names:
+        return {}
+    try:
+        cached = cache.get_many(_group_key(group_name) for group_name in group_names)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        cached = [None] * len(group_names)
+
+    results = {}
+    for group_name, cached_result in zip(group_names, cached):
+        if cached_result:
+            results[group_name] = _load_group(cached_result)
+        else:
+            results[group_name] = fetch_group_members(group_name)
+    prefetcher.record_many([('group', group_name, False) for group_name, cached_result in zip(group_names, cached)
+                            if cached_result])
+    return results
+
+
+def _group_members_expire_in(group_name, recurse=False):
+    ttl = cache.ttl(_group_key(group_name, recurse))
+    return ttl if ttl >= 0 else None
+
+def _refresh_group_members(group_name, recurse=False):
+    # The teams' own entries expire with the group's, read them and nothing would be refreshed
+    return group_flight.run(f"{group_name}:{recurse}", lambda: _fetch_group_members(group_name, recurse, refresh=True))
+
+# Hot groups are re-fetched by the prefetch command before their 30 minutes run out
+prefetcher.register('group', _group_members_expire_in, _refresh_group_members)
@@ -1,4 +1,4 @@
-from django.http import HttpResponse, Http404
+from django.http import HttpResponse, Http404, JsonResponse
 from rest_framework.views import APIView
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
@@ -7,42 +7,70 @@ from django.utils.decorators import method_decorator
 from django.views.decorators.cache import cache_page
 from datetime import datetime
 from rest_framework import status
-from .launchpad_singleton import get_launchpad
-from .utils import fetch_group_members  # Adjust the import path as necessary
-from .utils import fetch_matrix_accounts  # Adjust the import path as necessary
+from .utils import lookup_group_members, lookup_matrix_accounts
+from .utils import fetch_group_matrix_accounts
+from .errors import PrivateError, UpstreamError
+from . import aio
 import pytz
 import json
 import requests
 
+def lookup_error(e, kind, name):
+    """Map a failed group or profile lookup to an (error message, HTTP status) pair."""
+    if isinstance(e, KeyError):
+        print(f"{kind} with name {name} was not found. Error: {e}")
+        return f'{kind} not found', status.HTTP_404_NOT_FOUND
+    if isinstance(e, PrivateError):
+        return f'{kind} is private', status.HTTP_403_FORBIDDEN
+    if isinstance(e, UpstreamError):
+        print(f"Error processing request for launchpad {kind.lower()} {name}: {e}")
+        return str(e), status.HTTP_502_BAD_GATEWAY
+    print(f"An error occurred: {e}")
+    print(f"Error processing request for launchpad {kind.lower()} {name}: {str(e)}")
+    return 'An error occurred processing your request', status.HTTP_500_INTERNAL_SERVER_ERROR
+
 @api_view(['GET'])
 #@cache_page(60 * 30)  # Cache for 30 minutes
 def group_members(self, group_name):
     try:
-        result = fetch_group_members(group_name)
-        return Response(result)
-    except KeyError as e:
-        # Handle the case where the bug is not found
-        print(f"Group with name {group_name} was not found. Error: {e}")
-        return Response({'error': 'Group not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(lookup_group_members(group_name))
     except Exception as e:
-        # Handle other potential exceptions
-        print(f"An error occurred: {e}")
-        print(f"Error processing request for launchpad group {group_name}: {str(e)}")
-        return Response({'error': 'An error occurred processing your request'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-    
+        error, error_status = lookup_error(e, 'Group', group_name)
+        return Response({'error': error}, status=error_status)
+
 @api_view(['GET'])
 #@cache_page(60 * 30)  # Cache for 30 minutes
 def matrix_profiles(self, profile_id):
     try:
-        result = fetch_matrix_accounts(profile_id)
-        return Response(result)
-    except KeyError as e:
-        # Handle the case where the bug is not found
-        print(f"Profile with name {profile_id} was not found. Error: {e}")
-        return Response({'error': 'Group not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(lookup_matrix_accounts(profile_id))
+    except Exception as e:
+        error, error_status = lookup_error(e, 'Profile', profile_id)
+        return Response({'error': error}, status=error_status)
+
+@api_view(['GET'])
+def group_matrix_accounts(request, group_name):
+    # ?recurse=1 includes the members of sub-teams
+    recurse = request.query_params.get('recurse') in ('1', 'true')
+    try:
+        return Response(fetch_group_matrix_accounts(group_name, recurse))
+    except Exception as e:
+        error, error_status = lookup_error(e, 'Group', group_name)
+        return Response({'error': error}, status=error_status)
+
+async def group_members_async(request, group_name):
+    # group_members for ASGI servers, launchpadlib runs in the bounded blocking pool
+    try:
+        result = await aio.run_blocking(lookup_group_members, group_name)
+        return JsonResponse(result, safe=False)
+    except Exception as e:
+        error, error_status = lookup_error(e, 'Group', group_name)
+        return JsonResponse({'error': error}, status=error_status)
+
+async def matrix_profiles_async(request, profile_id):
+    # matrix_profiles for ASGI servers, launchpadlib runs in the bounded blocking pool
+    try:
+        result = await aio.run_blocking(lookup_matrix_accounts, profile_id)
+        return JsonResponse(result, safe=False)
     except Exception as e:
-        # Handle other potential exceptions
-        print(f"An error occurred: {e}")
-        print(f"Error processing request for launchpad profile {profile_id}: {str(e)}")
-        return Response({'error': 'An error occurred processing your request'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-    
\ No newline at end of file
+        error, error_status = lookup_error(e, 'Profile', profile_id)
+        return JsonResponse({'error': error}, status=error_status)
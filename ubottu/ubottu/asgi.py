@@ -14,3 +14,12 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ubottu.settings')
 
 application = get_asgi_application()
+
+# Load the timezone polygons before the first !time request needs them
+from factoids.geo import get_timezone_finder
+get_timezone_finder()
+
+# Have a few Launchpad clients ready for the first lookups
+from django.conf import settings
+from launchpad.launchpad_singleton import launchpad_clients
+launchpad_clients.warm(getattr(settings, 'LAUNCHPAD_WARM_CLIENTS', 4))
@@ -14,3 +14,23 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ubottu.settings')
 
 application = get_wsgi_application()
+
+# Load the timezone polygons before the first !time request needs them
+from factoids.geo import get_timezone_finder
+get_timezone_finder()
+
+# Create each worker's first Launchpad client, which also fills the WADL cache its other
+# clients load from. Under uWSGI's master this waits for the fork, a client (or a failed
+# login) made before it would be of no use to the workers. Other servers create
+# clients lazily, as lookups need them.
+from launchpad.launchpad_singleton import launchpad_clients
+try:
+    import uwsgi
+    from uwsgidecorators import postfork
+except ImportError:
+    uwsgi = None
+if uwsgi is not None and uwsgi.worker_id() == 0:
+    postfork(launchpad_clients.warm)
+elif uwsgi is not None:
+    # lazy-apps: already loading inside the worker
+    launchpad_clients.warm()